@@ -0,0 +1,94 @@
+''' Compare the color recommendation methods used by get_ab_reccs
+
+Runs ab_reccs_modes (histogram clustering) and ab_reccs_kmeans (sampling +
+KMeans) on the same per-pixel ab distributions and reports latency and
+quality. Quality is the expected squared ab distance from the distribution
+to its nearest recommended color, so lower is better.
+
+Distributions are synthetic mixtures of Gaussians over the 23x23 ab grid,
+or pixels of a saved ABxXxX dist_ab array (--dist_npy).
+
+    python benchmarks/bench_ab_reccs.py --num 200 --K 5 --json out.json
+'''
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from data.ab_reccs import ab_reccs_modes, ab_reccs_kmeans, quantization_error  # noqa: E402
+
+PTS = np.array(np.meshgrid(np.arange(-110, 120, 10), np.arange(-110, 120, 10))).reshape((2, 529)).T
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='benchmark get_ab_reccs methods')
+    parser.add_argument('--num', dest='num', help='number of distributions', type=int, default=200)
+    parser.add_argument('--K', dest='K', help='number of recommended colors', type=int, default=5)
+    parser.add_argument('--N', dest='N', help='samples for the kmeans method', type=int, default=25000)
+    parser.add_argument('--dist_npy', dest='dist_npy', help='saved ABxXxX dist_ab to sample pixels from', type=str, default='')
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+    parser.add_argument('--json', dest='json', help='write results to this file', type=str, default='')
+    return parser.parse_args()
+
+
+def synthetic_dists(num, rng):
+    dists = np.zeros((num, PTS.shape[0]))
+    for n in range(num):
+        for _ in range(rng.randint(1, 5)):
+            center = rng.uniform(-80, 80, size=2)
+            sigma = rng.uniform(8, 30)
+            d2 = np.sum((PTS - center)**2, axis=1)
+            dists[n] += rng.uniform(.2, 1.) * np.exp(-d2 / (2 * sigma**2))
+        dists[n] /= dists[n].sum()
+    return dists
+
+
+def npy_dists(path, num, rng):
+    dist_ab = np.load(path, mmap_mode='r')
+    hs = rng.randint(0, dist_ab.shape[1], size=num)
+    ws = rng.randint(0, dist_ab.shape[2], size=num)
+    return np.stack([np.asarray(dist_ab[:, h, w], dtype=np.float64) for h, w in zip(hs, ws)])
+
+
+def run(method, dists, K, N):
+    times = []
+    errors = []
+    for dist in dists:
+        start = time.perf_counter()
+        if method == 'kmeans':
+            centers, _ = ab_reccs_kmeans(dist, PTS, K=K, N=N)
+        else:
+            centers, _ = ab_reccs_modes(dist, PTS, K=K)
+        times.append(time.perf_counter() - start)
+        errors.append(quantization_error(dist, PTS, centers))
+    times = 1000. * np.array(times)
+    return {
+        'method': method,
+        'ms_p50': float(np.percentile(times, 50)),
+        'ms_p95': float(np.percentile(times, 95)),
+        'ms_mean': float(times.mean()),
+        'error_mean': float(np.mean(errors)),
+    }
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    rng = np.random.RandomState(args.seed)
+    if args.dist_npy:
+        dists = npy_dists(args.dist_npy, args.num, rng)
+    else:
+        dists = synthetic_dists(args.num, rng)
+
+    results = [run('modes', dists, args.K, args.N), run('kmeans', dists, args.K, args.N)]
+
+    print('%-8s %10s %10s %10s %12s' % ('method', 'p50 ms', 'p95 ms', 'mean ms', 'sq err'))
+    for res in results:
+        print('%-8s %10.3f %10.3f %10.3f %12.2f' % (res['method'], res['ms_p50'], res['ms_p95'], res['ms_mean'], res['error_mean']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'num': len(dists), 'K': args.K, 'N': args.N, 'results': results}, f, indent=2)
@@ -0,0 +1,109 @@
+''' Compare the float32 engine against the float64 reference path
+
+Runs ColorizeImageTorch with dtype float32 and float64 on the same images
+and hints, and reports how far the float32 path drifts from float64 and
+how much faster it is:
+
+    L max err     largest difference of the XdxXd L input, in L units
+    ab max err    largest difference of the XdxXd ab prediction, in ab units
+    rgb max err   largest difference of the full resolution result, in levels
+    PSNR          of the float32 result against the float64 one, in dB
+
+Exits with status 1 if any image is outside --max_ab_err or --min_psnr, so
+it can gate changes to the numeric pipeline; tests/test_dtype.py asserts the
+same on a few images.
+
+    python benchmarks/bench_dtype.py --model_path ./models/pytorch/caffemodel.pth
+'''
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+DEEPCOLOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, DEEPCOLOR_DIR)
+from data import colorize_image as CI  # noqa: E402
+from data.hints import rasterize_hints  # noqa: E402
+
+TEST_IMG_DIR = os.path.join(DEEPCOLOR_DIR, '..', 'test_img')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='compare the float32 and float64 engine paths')
+    parser.add_argument('--image_dir', dest='image_dir', help='images to colorize', type=str, default=TEST_IMG_DIR)
+    parser.add_argument('--model_path', dest='model_path', help='weights to load (default: random init)', type=str, default=None)
+    parser.add_argument('--load_size', dest='load_size', help='network input size', type=int, default=256)
+    parser.add_argument('--num_hints', dest='num_hints', help='random color hints per image', type=int, default=10)
+    parser.add_argument('--max_ab_err', dest='max_ab_err', help='largest allowed ab prediction error', type=float, default=1.)
+    parser.add_argument('--min_psnr', dest='min_psnr', help='lowest allowed PSNR of the result, dB', type=float, default=40.)
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+    parser.add_argument('--json', dest='json', help='write results to this file', type=str, default='')
+    return parser.parse_args()
+
+
+def colorize(model, path, input_ab, input_mask):
+    # (engine, full resolution result, seconds)
+    engine = model.fork()
+    start = time.perf_counter()
+    engine.load_image(path)
+    engine.net_forward(input_ab, input_mask)
+    result = engine.get_img_fullres()
+    return engine, result, time.perf_counter() - start
+
+
+def compare(model32, model64, path, num_hints, rng):
+    Xd = model32.Xd
+    xy = rng.randint(0, Xd, size=(num_hints, 2))
+    rgb = rng.randint(0, 256, size=(num_hints, 3))
+    input_ab, input_mask = rasterize_hints(xy, rgb, Xd, dtype=np.float64)
+
+    engine64, result64, seconds64 = colorize(model64, path, input_ab, input_mask)
+    engine32, result32, seconds32 = colorize(model32, path, input_ab, input_mask)
+
+    rgb_err = np.abs(result32.astype(np.int16) - result64.astype(np.int16))
+    mse = np.mean(rgb_err.astype(np.float64)**2)
+    return {
+        'image': os.path.basename(path),
+        'pixels': int(result64.shape[0] * result64.shape[1]),
+        'l_max_err': float(np.abs(engine32.img_l - engine64.img_l).max()),
+        'ab_max_err': float(np.abs(engine32.output_ab - engine64.output_ab).max()),
+        'rgb_max_err': int(rgb_err.max()),
+        'rgb_mean_err': float(rgb_err.mean()),
+        'psnr': float('inf') if mse == 0 else float(20 * np.log10(255. / np.sqrt(mse))),
+        'ms_float64': 1000. * seconds64,
+        'ms_float32': 1000. * seconds32,
+    }
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    rng = np.random.RandomState(args.seed)
+
+    model32 = CI.ColorizeImageTorch(Xd=args.load_size, dtype=np.float32)
+    model32.prep_net(path=args.model_path)
+    model64 = CI.ColorizeImageTorch(Xd=args.load_size, dtype=np.float64)
+    model64.prep_net(path=args.model_path)
+
+    names = sorted(n for n in os.listdir(args.image_dir) if n.lower().endswith(('.jpg', '.jpeg', '.png')))
+    colorize(model32, os.path.join(args.image_dir, names[0]), *rasterize_hints([], [], args.load_size))  # warm up
+    results = [compare(model32, model64, os.path.join(args.image_dir, n), args.num_hints, rng) for n in names]
+
+    print('%-24s %10s %10s %10s %10s %8s %10s %10s' % ('image', 'L max', 'ab max', 'rgb max', 'rgb mean', 'PSNR', 'ms f64', 'ms f32'))
+    failed = []
+    for res in results:
+        print('%-24s %10.4f %10.4f %10d %10.4f %8.2f %10.1f %10.1f' % (
+            res['image'][:24], res['l_max_err'], res['ab_max_err'], res['rgb_max_err'], res['rgb_mean_err'],
+            res['psnr'], res['ms_float64'], res['ms_float32']))
+        if res['ab_max_err'] > args.max_ab_err or res['psnr'] < args.min_psnr:
+            failed.append(res['image'])
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+    if failed:
+        print('Outside tolerance: %s' % ', '.join(failed))
+        sys.exit(1)
@@ -0,0 +1,262 @@
+''' Benchmark the colorization engine and the Flask API
+
+Times each stage of ColorizeImageTorch (decode, load_image, which includes
+_set_img_lab_fullres_, _set_img_lab_fullres_ on its own, net_forward,
+get_img_fullres and JPEG encoding) on the images in test_img/ and on
+synthetic images of 256x256, 1, 12 and 40 megapixels. It also times
+get_ab_reccs and the API endpoints through the Flask test client. Reports
+latency percentiles per stage and the peak RSS of the process after each
+group. Groups run smallest first, so each peak is the one that group caused.
+
+The network is randomly initialized unless --model_path is given: the
+timings don't depend on the weights.
+
+    python benchmarks/bench_engine.py --sizes 256,1mp,12mp --json out.json
+'''
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from io import BytesIO
+
+import cv2
+import numpy as np
+
+DEEPCOLOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, DEEPCOLOR_DIR)
+from data import colorize_image as CI  # noqa: E402
+
+TEST_IMG_DIR = os.path.join(DEEPCOLOR_DIR, '..', 'test_img')
+
+# name -> (height, width) of the synthetic images
+SIZES = {
+    '256': (256, 256),
+    '1mp': (864, 1152),
+    '12mp': (3000, 4000),
+    '40mp': (5472, 7296),
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='benchmark the colorization engine and API')
+    parser.add_argument('--sizes', dest='sizes', help='comma separated groups: test_img, 256, 1mp, 12mp, 40mp', type=str,
+                        default='test_img,256,1mp,12mp,40mp')
+    parser.add_argument('--repeat', dest='repeat', help='runs per image', type=int, default=5)
+    parser.add_argument('--repeat_large', dest='repeat_large', help='runs per image above 4 megapixels', type=int, default=2)
+    parser.add_argument('--reccs', dest='reccs', help='get_ab_reccs calls per method', type=int, default=200)
+    parser.add_argument('--api_repeat', dest='api_repeat', help='requests per endpoint (0 to skip the API)', type=int, default=5)
+    parser.add_argument('--model_path', dest='model_path', help='weights to load (default: random init)', type=str, default=None)
+    parser.add_argument('--load_size', dest='load_size', help='network input size', type=int, default=256)
+    parser.add_argument('--dtype', dest='dtype', help='engine float type (float32, float64)', type=str, default='float32')
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+    parser.add_argument('--json', dest='json', help='write results to this file', type=str, default='')
+    return parser.parse_args()
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024. * 1024.) if sys.platform == 'darwin' else rss / 1024.
+
+
+class Timings():
+    ''' Latency samples per stage '''
+
+    def __init__(self):
+        self.samples = {}
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        yield
+        self.samples.setdefault(stage, []).append(1000. * (time.perf_counter() - start))
+
+    def summary(self):
+        out = {}
+        for stage, samples in self.samples.items():
+            ms = np.array(samples)
+            out[stage] = {
+                'n': len(ms),
+                'ms_p50': float(np.percentile(ms, 50)),
+                'ms_p90': float(np.percentile(ms, 90)),
+                'ms_p99': float(np.percentile(ms, 99)),
+                'ms_mean': float(ms.mean()),
+                'ms_min': float(ms.min()),
+            }
+        return out
+
+
+def synthetic_image(path, height, width, rng):
+    # smooth random shapes plus grain, written as a grayscale-looking JPEG
+    low = cv2.GaussianBlur(rng.uniform(0, 255, size=(48, 64)).astype(np.float32), (0, 0), 3)
+    low = (low - low.min()) / max(low.max() - low.min(), 1e-6) * 255
+    gray = cv2.resize(low, (width, height), interpolation=cv2.INTER_CUBIC)
+    gray = np.clip(gray + rng.normal(0, 6, size=(height, width)).astype(np.float32), 0, 255).astype(np.uint8)
+    cv2.imwrite(path, cv2.merge((gray, gray, gray)), [cv2.IMWRITE_JPEG_QUALITY, 95])
+    return path
+
+
+def image_groups(sizes, tmp_dir, rng):
+    # [(group name, [image paths])]
+    groups = []
+    for size in sizes:
+        if size == 'test_img':
+            names = sorted(n for n in os.listdir(TEST_IMG_DIR) if n.lower().endswith(('.jpg', '.jpeg', '.png')))
+            groups.append((size, [os.path.join(TEST_IMG_DIR, n) for n in names]))
+        else:
+            height, width = SIZES[size]
+            groups.append((size, [synthetic_image(os.path.join(tmp_dir, 'synthetic_%s.jpg' % size), height, width, rng)]))
+    return groups
+
+
+def bench_engine(model, paths, repeat, repeat_large):
+    timings = Timings()
+    zeros_ab = np.zeros((2, model.Xd, model.Xd), dtype=model.dtype)
+    zeros_mask = np.zeros((1, model.Xd, model.Xd), dtype=model.dtype)
+    pixels = []
+    for path in paths:
+        im = cv2.imread(path, cv2.IMREAD_COLOR)
+        pixels.append(im.shape[0] * im.shape[1])
+        del im
+        runs = repeat_large if pixels[-1] > 4e6 else repeat
+        for _ in range(runs):
+            engine = model.fork()
+            with timings.time('decode'):
+                cv2.imread(path, cv2.IMREAD_COLOR)
+            with timings.time('load_image'):
+                engine.load_image(path)
+            with timings.time('_set_img_lab_fullres_'):
+                engine._set_img_lab_fullres_()
+            with timings.time('net_forward'):
+                engine.net_forward(zeros_ab, zeros_mask)
+            with timings.time('get_img_fullres'):
+                result = engine.get_img_fullres()
+            with timings.time('encode_jpeg'):
+                cv2.imencode('.jpg', cv2.cvtColor(result, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, 95])
+            del engine, result
+    return timings, int(np.mean(pixels))
+
+
+def bench_reccs(dist_model, path, num, rng):
+    timings = Timings()
+    engine = dist_model.fork()
+    engine.load_image(path)
+    with timings.time('net_forward_dist'):
+        engine.net_forward(np.zeros((2, engine.Xd, engine.Xd), dtype=engine.dtype), np.zeros((1, engine.Xd, engine.Xd), dtype=engine.dtype))
+    points = rng.randint(0, engine.Xd, size=(num, 2))
+    for method, n in (('modes', num), ('kmeans', max(1, num // 10))):
+        for h, w in points[:n]:
+            with timings.time('get_ab_reccs_%s' % method):
+                engine.get_ab_reccs(h, w, K=5, return_conf=True, method=method)
+    return timings
+
+
+def import_api(model_path, tmp_dir):
+    # model_api loads its network at import: point it at a scratch store and
+    # hand it the benchmark's network through the per-process net cache
+    os.environ.setdefault('STORE_FOLDER', os.path.join(tmp_dir, 'store'))
+    os.environ.setdefault('SESSION_BACKEND', 'memory')
+    os.environ.setdefault('JOB_WORKERS', '0')
+    os.environ.setdefault('MODEL_VERSION', 'benchmark')
+    cwd = os.getcwd()
+    os.chdir(tmp_dir)
+    try:
+        net = CI.load_siggraph_net(model_path)
+        CI._siggraph_nets[(os.path.abspath('./models/pytorch/caffemodel.pth'), None)] = net
+        import model_api
+    finally:
+        os.chdir(cwd)
+    return model_api
+
+
+def bench_api(api, path, repeat, rng):
+    timings = Timings()
+    client = api.app.test_client()
+    with open(path, 'rb') as f:
+        image = f.read()
+
+    def upload(data):
+        return {'image': (BytesIO(data), os.path.basename(path))}
+
+    def unique(data):
+        # bytes after the JPEG end marker are ignored by decoders, but change
+        # the content hash, so the result cache can't answer
+        return data + rng.bytes(16)
+
+    session_id = None
+    for _ in range(repeat):
+        with timings.time('POST /colorize (new image)'):
+            r = client.post('/colorize', data=upload(unique(image)))
+        session_id = r.get_json()['session_id']
+    client.post('/colorize', data=upload(image))  # store the result to hit
+    for _ in range(repeat):
+        with timings.time('POST /colorize (cached result)'):
+            client.post('/colorize', data=upload(image))
+    for _ in range(repeat):
+        with timings.time('POST /colorize (image/jpeg)'):
+            client.post('/colorize', data=upload(unique(image)), headers={'Accept': 'image/jpeg'})
+    for _ in range(repeat):
+        points = [{'x': float(x), 'y': float(y), 'r': int(r), 'g': int(g), 'b': int(b)}
+                  for x, y, r, g, b in zip(rng.uniform(0, 100, 8), rng.uniform(0, 100, 8), *rng.randint(0, 256, (3, 8)))]
+        with timings.time('POST /colorize_with_hints'):
+            client.post('/colorize_with_hints', data={'session_id': session_id, 'hints': json.dumps({'points': points})})
+    for _ in range(repeat):
+        with timings.time('POST /suggest_colors'):
+            client.post('/suggest_colors', data={'session_id': session_id, 'x': rng.uniform(0, 100), 'y': rng.uniform(0, 100)})
+    return timings
+
+
+def print_group(name, group):
+    print('\n[%s] %d px, peak RSS %.0f MB' % (name, group['pixels'], group['peak_rss_mb']))
+    print('%-34s %6s %10s %10s %10s %10s' % ('stage', 'n', 'p50 ms', 'p90 ms', 'p99 ms', 'mean ms'))
+    for stage, res in group['stages'].items():
+        print('%-34s %6d %10.2f %10.2f %10.2f %10.2f' % (stage, res['n'], res['ms_p50'], res['ms_p90'], res['ms_p99'], res['ms_mean']))
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    rng = np.random.RandomState(args.seed)
+    tmp_dir = tempfile.mkdtemp(prefix='bench_engine_')
+
+    model = CI.ColorizeImageTorch(Xd=args.load_size, dtype=args.dtype)
+    model.prep_net(path=args.model_path)
+    dist_model = CI.ColorizeImageTorchDist(Xd=args.load_size, dtype=args.dtype)
+    dist_model.prep_net(path=args.model_path, dist=True)
+
+    groups = {}
+    sizes = [s.strip() for s in args.sizes.split(',') if s.strip()]
+    for name, paths in image_groups(sizes, tmp_dir, rng):
+        timings, pixels = bench_engine(model, paths, args.repeat, args.repeat_large)
+        groups[name] = {'pixels': pixels, 'peak_rss_mb': peak_rss_mb(), 'stages': timings.summary()}
+        print_group(name, groups[name])
+
+    reccs_path = os.path.join(TEST_IMG_DIR, 'Winter.jpg')
+    groups['get_ab_reccs'] = {'pixels': args.load_size**2, 'peak_rss_mb': peak_rss_mb(),
+                              'stages': bench_reccs(dist_model, reccs_path, args.reccs, rng).summary()}
+    print_group('get_ab_reccs', groups['get_ab_reccs'])
+
+    if args.api_repeat > 0:
+        api = import_api(args.model_path, tmp_dir)
+        for name, paths in image_groups(['1mp'], tmp_dir, rng) + [('Winter', [reccs_path])]:
+            im = cv2.imread(paths[0])
+            key = 'api_%s' % name
+            timings = bench_api(api, paths[0], args.api_repeat, rng)
+            groups[key] = {'pixels': im.shape[0] * im.shape[1], 'peak_rss_mb': peak_rss_mb(), 'stages': timings.summary()}
+            print_group(key, groups[key])
+
+    if args.json:
+        import torch
+        machine = {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'torch': torch.__version__,
+            'torch_threads': torch.get_num_threads(),
+        }
+        with open(args.json, 'w') as f:
+            json.dump({'machine': machine, 'args': vars(args), 'groups': groups}, f, indent=2)
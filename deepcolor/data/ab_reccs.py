@@ -0,0 +1,103 @@
+import numpy as np
+
+
+def ab_reccs_modes(dist, pts, K=5, min_dist=20., max_iter=10):
+    ''' Deterministic color recommendations from a per-pixel ab histogram
+    Runs a weighted k-means directly over the histogram bins, started from the
+    K highest peaks that are at least min_dist apart in ab.
+        INPUTS
+            dist      AB         probability of each bin (need not be normalized)
+            pts       ABx2       ab value of each bin
+            K         clamped to [1, AB]
+        OUTPUTS
+            centers   Kx2        ab cluster centers, most probable first
+            conf      K          probability mass of each cluster '''
+    K = int(min(max(K, 1), len(pts)))
+    p = np.maximum(np.asarray(dist, dtype=np.float64), 0)
+    total = p.sum()
+    if total <= 0:
+        p = np.ones_like(p)
+        total = p.sum()
+    p = p / total
+    pts = np.asarray(pts, dtype=np.float64)
+
+    centers = pts[_peak_inds(p, pts, K, min_dist)]
+    labels = None
+    for _ in range(max_iter):
+        d2 = ((pts[:, np.newaxis, :] - centers[np.newaxis, :, :])**2).sum(axis=2)
+        new_labels = np.argmin(d2, axis=1)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+
+        mass = np.bincount(labels, weights=p, minlength=K)
+        filled = mass > 0  # empty clusters keep their center
+        for c in range(2):
+            sums = np.bincount(labels, weights=p * pts[:, c], minlength=K)
+            centers[filled, c] = sums[filled] / mass[filled]
+
+    conf = np.bincount(labels, weights=p, minlength=K)
+    order = np.argsort(-conf, kind='stable')
+    return centers[order], conf[order]
+
+
+def ab_reccs_kmeans(dist, pts, K=5, N=25000):
+    ''' Color recommendations by sampling N points from the histogram and
+    running scikit-learn KMeans on them (the original, randomized method)
+        OUTPUTS
+            centers   Kx2        ab cluster centers, largest cluster first
+            conf      K          fraction of samples in each cluster '''
+    from sklearn.cluster import KMeans
+
+    # randomly sample from pdf
+    cmf = np.cumsum(dist, dtype=np.float64)  # CMF (dist may be stored compactly)
+    cmf = cmf / cmf[-1]
+    cmf_bins = cmf
+
+    # randomly sample N points
+    rnd_pts = np.random.uniform(low=0, high=1.0, size=N)
+    inds = np.digitize(rnd_pts, bins=cmf_bins)
+    rnd_pts_ab = pts[inds, :]
+
+    # run k-means
+    kmeans = KMeans(n_clusters=K).fit(rnd_pts_ab)
+
+    # sort by cluster occupancy
+    k_label_cnt = np.histogram(kmeans.labels_, np.arange(0, K + 1))[0]
+    k_inds = np.argsort(k_label_cnt, axis=0)[::-1]
+
+    cluster_per = 1. * k_label_cnt[k_inds] / N  # percentage of points within cluster
+    cluster_centers = kmeans.cluster_centers_[k_inds, :]  # cluster centers
+    return cluster_centers, cluster_per
+
+
+def quantization_error(dist, pts, centers):
+    # expected squared ab distance from the histogram to the nearest center,
+    # for comparing recommendation methods
+    p = np.asarray(dist, dtype=np.float64)
+    p = p / p.sum()
+    d2 = ((np.asarray(pts, dtype=np.float64)[:, np.newaxis, :] - centers[np.newaxis, :, :])**2).sum(axis=2)
+    return np.sum(p * d2.min(axis=1))
+
+
+def _peak_inds(p, pts, K, min_dist):
+    # greedily take the most probable bins that are min_dist apart (looking
+    # at the top 4K bins only), topped up with the next most probable ones
+    order = np.argsort(-p, kind='stable')
+    cand = order[:4 * K]
+    cand = cand[p[cand] > 0]
+    near = ((pts[cand, np.newaxis, :] - pts[np.newaxis, cand, :])**2).sum(axis=2) < min_dist**2
+    blocked = np.zeros(len(cand), dtype=bool)
+    chosen = []
+    for i in range(len(cand)):
+        if len(chosen) == K:
+            break
+        if not blocked[i]:
+            chosen.append(cand[i])
+            blocked |= near[i]
+    for ind in order:
+        if len(chosen) == K:
+            break
+        if ind not in chosen:
+            chosen.append(ind)
+    return np.array(chosen)
@@ -0,0 +1,22 @@
+''' Content negotiation for the API's binary responses '''
+
+
+def negotiate(accept, binary_types, default='application/json'):
+    ''' Response type for a parsed Accept header (werkzeug MIMEAccept, as
+    request.accept_mimetypes): one of binary_types only when the client names
+    it explicitly and ranks it above default and every other type it names.
+    Anything else gets default, including wildcards (*/*, image/*), which
+    browsers send with every navigation.
+        INPUTS
+            accept          MIMEAccept
+            binary_types    mimetypes the response can also be sent as
+        OUTPUTS
+            default or one of binary_types '''
+    named = [(value.lower(), quality) for value, quality in accept if '*' not in value and quality > 0]
+    if not named:
+        return default
+    top = max(quality for _, quality in named)
+    for value, quality in named:
+        if quality == top and quality > accept[default] and value in binary_types:
+            return value
+    return default
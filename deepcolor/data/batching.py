@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class BatchScheduler():
+    ''' Dynamic micro-batching for network forward passes.
+    Concurrent callers submit single-image inputs; a worker thread waits up to
+    max_delay seconds for more requests to arrive, stacks up to max_batch_size
+    of them along a new leading axis and runs forward_fn once on the batch.
+    Each caller gets back its own slice of the outputs.
+
+    forward_fn(batch, key) receives a tuple of stacked arrays (NxCxHxW) and
+    returns an array, or a tuple of arrays, with the same leading N.
+    Requests are only batched together when they share the same key.
+
+    num_workers threads take batches; with the default of one, forward passes
+    run one at a time, and a batch waits for the one before it to finish.
+    More workers let forward_fn run concurrently, if it is safe to.
+    '''
+
+    def __init__(self, forward_fn, max_batch_size=8, max_delay=.005, num_workers=1):
+        self.forward_fn = forward_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_delay = max(0., float(max_delay))
+        self.num_workers = max(1, int(num_workers))
+
+        self._pending = deque()  # (key, inputs, future, enqueue time)
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # queue-depth and batch metrics
+        self._stats_lock = threading.Lock()
+        self._peak_queue_depth = 0
+        self._num_batches = 0
+        self._num_items = 0
+        self._max_batch_seen = 0
+        self._total_wait = 0.
+        self._total_forward = 0.
+
+        self._workers = [threading.Thread(target=self._run, name='BatchScheduler-%d' % n, daemon=True)
+                         for n in range(self.num_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, inputs, key=None):
+        ''' Queue one request and block until its slice of the batch is ready
+        INPUTS
+            inputs    tuple of arrays, each CxHxW, for a single image
+            key       requests are only batched with others of the same key
+        '''
+        return self.submit_async(inputs, key=key).result()
+
+    def submit_async(self, inputs, key=None):
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('BatchScheduler has been closed')
+            self._pending.append((key, tuple(inputs), future, time.perf_counter()))
+            depth = len(self._pending)
+            self._cond.notify()
+        with self._stats_lock:
+            self._peak_queue_depth = max(self._peak_queue_depth, depth)
+        return future
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._pending)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'queue_depth': self.queue_depth(),
+                'peak_queue_depth': self._peak_queue_depth,
+                'batches': self._num_batches,
+                'items': self._num_items,
+                'mean_batch_size': 1. * self._num_items / self._num_batches if self._num_batches else 0.,
+                'max_batch_size_seen': self._max_batch_seen,
+                'mean_queue_wait_ms': 1000. * self._total_wait / self._num_items if self._num_items else 0.,
+                'mean_forward_ms': 1000. * self._total_forward / self._num_batches if self._num_batches else 0.,
+                'max_batch_size': self.max_batch_size,
+                'max_delay_ms': 1000. * self.max_delay,
+                'workers': self.num_workers,
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join()
+
+    # ***** Private functions *****
+    def _take_batch(self):
+        # wait for a first request, then give others up to max_delay to join
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            if not self._pending:
+                return None
+
+            key = self._pending[0][0]
+            deadline = self._pending[0][3] + self.max_delay
+            while not self._closed and self._count_key(key) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = []
+            rest = deque()
+            while self._pending:
+                item = self._pending.popleft()
+                if item[0] == key and len(batch) < self.max_batch_size:
+                    batch.append(item)
+                else:
+                    rest.append(item)
+            self._pending = rest
+            return key, batch
+
+    def _count_key(self, key):
+        return sum(1 for item in self._pending if item[0] == key)
+
+    def _run(self):
+        while True:
+            taken = self._take_batch()
+            if taken is None:
+                return
+            key, batch = taken
+
+            futures = [item[2] for item in batch]
+            start = time.perf_counter()
+            try:
+                stacked = tuple(np.stack(arrays, axis=0) for arrays in zip(*[item[1] for item in batch]))
+                outputs = self.forward_fn(stacked, key)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            end = time.perf_counter()
+
+            for n, future in enumerate(futures):
+                if isinstance(outputs, tuple):
+                    future.set_result(tuple(output[n] for output in outputs))
+                else:
+                    future.set_result(outputs[n])
+
+            with self._stats_lock:
+                self._num_batches += 1
+                self._num_items += len(batch)
+                self._max_batch_seen = max(self._max_batch_seen, len(batch))
+                self._total_wait += sum(start - item[3] for item in batch)
+                self._total_forward += end - start
@@ -0,0 +1,228 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+
+from .sqlite_util import SQLiteDB
+
+
+def sha256_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def sha256_file(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class BlobStore():
+    ''' Content-addressed file store, shared by all processes on a host
+    Blobs are stored once under root, named by the SHA-256 of their bytes.
+    Named links (e.g. 'upload/<session_id>') point at blobs and count as
+    references; the cache table maps arbitrary keys to blobs without holding
+    a reference. When the store grows past max_bytes, unreferenced blobs are
+    deleted least recently used first, along with cache entries pointing at
+    them. Referenced blobs are never deleted, so the cap can be exceeded. '''
+
+    def __init__(self, root, max_bytes=2 * 1024 * 1024 * 1024):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+        self._db = SQLiteDB(os.path.join(self.root, 'index.sqlite3'), '''
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY, ext TEXT, size INTEGER,
+                refs INTEGER DEFAULT 0, last_access REAL);
+            CREATE INDEX IF NOT EXISTS blobs_gc ON blobs (refs, last_access);
+            CREATE TABLE IF NOT EXISTS links (name TEXT PRIMARY KEY, hash TEXT);
+            CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, hash TEXT, meta TEXT);
+            CREATE INDEX IF NOT EXISTS cache_hash ON cache (hash);
+
+            -- total size of the blobs, kept by triggers so checking it after
+            -- every put doesn't scan the table (initialized for stores
+            -- created before it)
+            CREATE TABLE IF NOT EXISTS total (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER);
+            CREATE TRIGGER IF NOT EXISTS blobs_insert AFTER INSERT ON blobs
+                BEGIN UPDATE total SET size = size + new.size; END;
+            CREATE TRIGGER IF NOT EXISTS blobs_delete AFTER DELETE ON blobs
+                BEGIN UPDATE total SET size = size - old.size; END;
+            INSERT OR IGNORE INTO total (id, size) SELECT 0, COALESCE(SUM(size), 0) FROM blobs;
+        ''')
+
+    def path(self, digest, ext=None):
+        ''' File path of a blob (ext is looked up when not given) '''
+        if ext is None:
+            with self._db.read() as db:
+                row = db.execute('SELECT ext FROM blobs WHERE hash=?', (digest,)).fetchone()
+            if row is None:
+                return None
+            ext = row[0]
+        return os.path.join(self.root, digest[:2], digest + ext)
+
+    def put(self, data, ext='', name=None):
+        ''' Store data (bytes), returning its hash. If name is given, it is
+        linked to the blob in the same transaction, so it can't be collected
+        in between. '''
+        digest = sha256_bytes(data)
+        # the first put of some bytes decides their extension
+        with self._db.read() as db:
+            row = db.execute('SELECT ext FROM blobs WHERE hash=?', (digest,)).fetchone()
+        if row is not None:
+            ext = row[0]
+        # the file goes first, so a row never points at a missing one
+        self._write(self.path(digest, ext), data)
+        with self._db.transaction() as db:
+            db.execute('INSERT INTO blobs (hash, ext, size, last_access) VALUES (?, ?, ?, ?) '
+                       'ON CONFLICT(hash) DO UPDATE SET last_access=excluded.last_access',
+                       (digest, ext, len(data), time.time()))
+            if name is not None:
+                self._link(db, name, digest)
+            # a gc (or a put with another extension) may have run since the
+            # write; files are only removed under this lock, so this holds
+            ext = db.execute('SELECT ext FROM blobs WHERE hash=?', (digest,)).fetchone()[0]
+            self._write(self.path(digest, ext), data)
+            over = self._over_limit(db)
+        if over:
+            self.gc()
+        return digest
+
+    def get(self, digest):
+        ''' Bytes of a blob, or None if it is not stored '''
+        path = self.path(digest)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self._touch(digest)
+        return data
+
+    def link(self, name, digest):
+        ''' Point name at a stored blob, releasing whatever it pointed at '''
+        with self._db.transaction() as db:
+            self._link(db, name, digest)
+            over = self._over_limit(db)
+        if over:
+            self.gc()
+
+    def unlink(self, name):
+        with self._db.transaction() as db:
+            self._unlink(db, name)
+            over = self._over_limit(db)
+        if over:
+            self.gc()
+
+    def resolve(self, name):
+        ''' Hash of the blob name points at, or None '''
+        with self._db.read() as db:
+            row = db.execute('SELECT hash FROM links WHERE name=?', (name,)).fetchone()
+        if row is None:
+            return None
+        self._touch(row[0])
+        return row[0]
+
+    def cache_put(self, key, data, ext='', meta=None):
+        ''' Cache data under key, with optional JSON-serializable meta '''
+        digest = self.put(data, ext)
+        with self._db.transaction() as db:
+            db.execute('INSERT OR REPLACE INTO cache (key, hash, meta) VALUES (?, ?, ?)',
+                       (key, digest, json.dumps(meta)))
+        return digest
+
+    def cache_get(self, key):
+        ''' (data, meta) cached under key, or None '''
+        with self._db.read() as db:
+            row = db.execute('SELECT hash, meta FROM cache WHERE key=?', (key,)).fetchone()
+        if row is None:
+            return None
+        data = self.get(row[0])
+        if data is None:
+            return None
+        return data, json.loads(row[1])
+
+    def gc(self):
+        ''' Delete unreferenced blobs, least recently used first, until the
+        store fits in max_bytes. Returns the number of blobs deleted. '''
+        deleted = []
+        with self._db.transaction() as db:
+            total = self._total(db)
+            if total <= self.max_bytes:
+                return 0
+            for digest, ext, size in db.execute(
+                    'SELECT hash, ext, size FROM blobs WHERE refs <= 0 ORDER BY last_access').fetchall():
+                if total <= self.max_bytes:
+                    break
+                db.execute('DELETE FROM blobs WHERE hash=?', (digest,))
+                db.execute('DELETE FROM cache WHERE hash=?', (digest,))
+                total -= size
+                deleted.append((digest, ext))
+
+        # files go once their rows are committed, so a crash can leave a stray
+        # file but never a row without one; blobs put again since are kept
+        with self._db.transaction() as db:
+            for digest, ext in deleted:
+                if db.execute('SELECT 1 FROM blobs WHERE hash=?', (digest,)).fetchone() is None:
+                    try:
+                        os.remove(self.path(digest, ext))
+                    except FileNotFoundError:
+                        pass
+        return len(deleted)
+
+    def stats(self):
+        with self._db.read() as db:
+            blobs, referenced = db.execute('SELECT COUNT(*), COALESCE(SUM(refs > 0), 0) FROM blobs').fetchone()
+            size = self._total(db)
+            links = db.execute('SELECT COUNT(*) FROM links').fetchone()[0]
+            cached = db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        return {
+            'blobs': blobs,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'referenced': referenced,
+            'links': links,
+            'cache_entries': cached,
+        }
+
+    def close(self):
+        self._db.close()
+
+    # ***** Private functions *****
+    def _write(self, path, data):
+        # content-addressed, so concurrent writes of a path are identical
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+    def _total(self, db):
+        return db.execute('SELECT size FROM total').fetchone()[0]
+
+    def _over_limit(self, db):
+        return self._total(db) > self.max_bytes
+
+    def _touch(self, digest):
+        with self._db.transaction() as db:
+            db.execute('UPDATE blobs SET last_access=? WHERE hash=?', (time.time(), digest))
+
+    def _link(self, db, name, digest):
+        row = db.execute('SELECT hash FROM links WHERE name=?', (name,)).fetchone()
+        if row is not None and row[0] == digest:
+            return
+        self._unlink(db, name)
+        db.execute('INSERT INTO links (name, hash) VALUES (?, ?)', (name, digest))
+        db.execute('UPDATE blobs SET refs=refs+1, last_access=? WHERE hash=?', (time.time(), digest))
+
+    def _unlink(self, db, name):
+        row = db.execute('SELECT hash FROM links WHERE name=?', (name,)).fetchone()
+        if row is None:
+            return
+        db.execute('DELETE FROM links WHERE name=?', (name,))
+        db.execute('UPDATE blobs SET refs=refs-1 WHERE hash=?', (row[0],))
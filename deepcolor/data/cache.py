@@ -0,0 +1,139 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def nbytes(value):
+    ''' Approximate memory held by a cached value
+    Counts numpy arrays and bytes inside (nested) dicts, lists and tuples. '''
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes(v) for v in value)
+    return 0
+
+
+class LRUCache():
+    ''' Thread-safe LRU cache bounded by total size in bytes
+    Entries stored more than ttl seconds ago (None for no expiry) are dropped
+    on access, and from the least recently used end on put. The ttl counts
+    from put, not from the last get: hits don't extend it, so a value is
+    never served more than ttl seconds after it was computed.
+    on_evict(key, value), if given, is called for every entry that is evicted
+    or expires, but not for ones removed with pop(). '''
+
+    def __init__(self, max_bytes=512 * 1024 * 1024, ttl=None, sizeof=nbytes, on_evict=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+
+        self._entries = OrderedDict()  # key -> (value, size, time stored)
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        evicted = []
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                evicted.append((key, self._evict(key)))
+                entry = None
+            if entry is None:
+                self.misses += 1
+                value = default
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                value = entry[0]
+        self._notify(evicted)
+        return value
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                # would never fit, don't flush everything else for it
+                return False
+            self._entries[key] = (value, size, time.time())
+            self._bytes += size
+            evicted += self._expire()
+            while self._bytes > self.max_bytes:
+                old_key = next(iter(self._entries))
+                evicted.append((old_key, self._evict(old_key)))
+        self._notify(evicted)
+        return True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            return self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and not self._expired(entry)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    # ***** Private functions *****
+    # these assume self._lock is held
+    def _expired(self, entry):
+        return self.ttl is not None and time.time() - entry[2] > self.ttl
+
+    def _expire(self):
+        # up to the first entry still fresh, so a put doesn't scan the whole
+        # cache; expired entries used since then are dropped by get
+        expired = []
+        while self.ttl is not None and self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if not self._expired(entry):
+                break
+            expired.append((key, self._evict(key)))
+        return expired
+
+    def _remove(self, key):
+        value, size, _ = self._entries.pop(key)
+        self._bytes -= size
+        return value
+
+    def _evict(self, key):
+        self.evictions += 1
+        return self._remove(key)
+
+    def _notify(self, evicted):
+        # called without the lock, so callbacks may use the cache
+        if self.on_evict is not None:
+            for key, value in evicted:
+                self.on_evict(key, value)
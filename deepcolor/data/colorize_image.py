@@ -2,9 +2,14 @@ import numpy as np
 import cv2
 import matplotlib.pyplot as plt
 from skimage import color
-from sklearn.cluster import KMeans
 import os
+import copy
+import threading
 from scipy.ndimage.interpolation import zoom
+from .batching import BatchScheduler
+from .ab_reccs import ab_reccs_modes, ab_reccs_kmeans
+from .metrics import stage_timer, timed
+from .uncertainty import entropy_map
 
 
 def create_temp_directory(path_template, N=1e8):
@@ -17,28 +22,270 @@ def create_temp_directory(path_template, N=1e8):
     return cur_path
 
 
-def lab2rgb_transpose(img_l, img_ab):
+def lab2rgb_transpose(img_l, img_ab, dtype=np.float64):
     ''' INPUTS
             img_l     1xXxX     [0,100]
             img_ab     2xXxX     [-100,100]
+            dtype     float32 converts through OpenCV (see lab2rgb_rows),
+                      float64 through skimage
         OUTPUTS
             returned value is XxXx3 '''
+    if np.dtype(dtype) == np.float32:
+        return lab2rgb_rows(img_l[0], img_ab)
     pred_lab = np.concatenate((img_l, img_ab), axis=0).transpose((1, 2, 0))
     pred_rgb = (np.clip(color.lab2rgb(pred_lab), 0, 1) * 255).astype('uint8')
     return pred_rgb
 
 
-def rgb2lab_transpose(img_rgb):
+def rgb2lab_transpose(img_rgb, dtype=np.float64):
     ''' INPUTS
-            img_rgb XxXx3
+            img_rgb XxXx3   uint8
+            dtype     float32 converts through OpenCV, float64 through skimage
         OUTPUTS
             returned value is 3xXxX '''
+    if np.dtype(dtype) == np.float32:
+        img_rgb = np.asarray(img_rgb)
+        if img_rgb.dtype == np.uint8:
+            img_rgb = img_rgb.astype(np.float32) / 255.
+        return cv2.cvtColor(img_rgb.astype(np.float32), cv2.COLOR_RGB2Lab).transpose((2, 0, 1))
     return color.rgb2lab(img_rgb).transpose((2, 0, 1))
 
 
+def _lerp_coords(n_in, n_out, dtype=np.float32):
+    # source indices and weights of a linear resize with corners aligned,
+    # the geometry of scipy.ndimage.zoom(order=1)
+    if n_out == 1 or n_in == 1:
+        src = np.zeros(n_out)
+    else:
+        src = np.arange(n_out) * (1. * (n_in - 1) / (n_out - 1))
+    i0 = np.minimum(np.floor(src).astype(np.int64), n_in - 1)
+    i1 = np.minimum(i0 + 1, n_in - 1)
+    frac = (src - i0).astype(dtype)
+    return i0, i1, frac
+
+
+def upsample_ab_cols(img_ab, out_w, dtype=np.float32, c0=0, c1=None):
+    ''' First (horizontal) pass of the bilinear ab upsampling, done once per image
+        INPUTS
+            img_ab     2xhxw
+            c0, c1     only compute output columns c0:c1
+        OUTPUTS
+            returned value is 2xhxout_w (or 2xhx(c1-c0)), in dtype '''
+    img_ab = np.asarray(img_ab, dtype=dtype)
+    j0, j1, fx = _lerp_coords(img_ab.shape[2], out_w, dtype=dtype)
+    j0, j1, fx = j0[c0:c1], j1[c0:c1], fx[c0:c1]
+    return img_ab[:, :, j0] * (1 - fx) + img_ab[:, :, j1] * fx
+
+
+def upsample_ab_rows(ab_cols, out_h, r0, r1):
+    ''' Rows r0:r1 of the second (vertical) pass of the bilinear ab upsampling
+        INPUTS
+            ab_cols    2xhxW     from upsample_ab_cols
+        OUTPUTS
+            returned value is 2x(r1-r0)xW, in the dtype of ab_cols '''
+    i0, i1, fy = _lerp_coords(ab_cols.shape[1], out_h, dtype=ab_cols.dtype)
+    i0, i1, fy = i0[r0:r1], i1[r0:r1], fy[r0:r1, np.newaxis]
+    return ab_cols[:, i0, :] * (1 - fy) + ab_cols[:, i1, :] * fy
+
+
+def lab2rgb_rows(img_l, img_ab):
+    ''' float32 Lab to uint8 RGB, through OpenCV
+    b is first limited to keep Z >= 0, which is how skimage's lab2rgb
+    clips, so results match lab2rgb_transpose to within 1 level.
+        INPUTS
+            img_l     hxW       [0,100]
+            img_ab    2xhxW
+        OUTPUTS
+            returned value is hxWx3 '''
+    lab = np.empty(img_l.shape + (3,), dtype=np.float32)
+    lab[:, :, 0] = img_l
+    lab[:, :, 1] = img_ab[0]
+    lab[:, :, 2] = np.minimum(img_ab[1], 200. * (lab[:, :, 0] + 16.) / 116.)
+    rgb = cv2.cvtColor(lab, cv2.COLOR_Lab2RGB)
+    np.clip(rgb, 0, 1, out=rgb)
+    rgb *= 255
+    return rgb.astype('uint8')
+
+
+def lab2rgb_fullres(img_l_fullres, img_ab, tile_rows=512, dtype=np.float32):
+    ''' Full resolution RGB from full resolution L and low resolution ab
+    Bilinear upsampling (same geometry as zoom(order=1)) and Lab->RGB in
+    dtype, a strip of tile_rows at a time to bound peak memory.
+        INPUTS
+            img_l_fullres   1xHxW     [0,100]
+            img_ab          2xhxw
+        OUTPUTS
+            returned value is HxWx3 '''
+    H, W = img_l_fullres.shape[1:]
+    ab_cols = upsample_ab_cols(img_ab, W, dtype=dtype)
+    out = np.empty((H, W, 3), dtype=np.uint8)
+    for r0 in range(0, H, tile_rows):
+        r1 = min(H, r0 + tile_rows)
+        out[r0:r1] = lab2rgb_transpose(img_l_fullres[:, r0:r1], upsample_ab_rows(ab_cols, H, r0, r1), dtype=dtype)
+    return out
+
+
+def changed_bbox(ab_old, ab_new, out_h, out_w, threshold=1., align=16):
+    ''' Full resolution region that changes between two ab predictions
+    Finds the low resolution pixels whose ab moved by more than threshold,
+    and the full resolution pixels whose bilinear upsampling reads them.
+        INPUTS
+            ab_old, ab_new   2xhxw
+            out_h, out_w     full resolution size
+            align            round the region out to multiples of this
+        OUTPUTS
+            returned value is (r0, r1, c0, c1), or None if nothing changed '''
+    changed = np.abs(np.asarray(ab_new, dtype=np.float32) - np.asarray(ab_old, dtype=np.float32)).max(axis=0) > threshold
+    rows = np.where(changed.any(axis=1))[0]
+    if len(rows) == 0:
+        return None
+    cols = np.where(changed.any(axis=0))[0]
+
+    def span(lo, hi, n_in, n_out):
+        i0, i1, _ = _lerp_coords(n_in, n_out)
+        hit = np.where(((i0 >= lo) & (i0 <= hi)) | ((i1 >= lo) & (i1 <= hi)))[0]
+        return int(hit[0] // align) * align, int(min(n_out, -(-(hit[-1] + 1) // align) * align))
+
+    r0, r1 = span(rows[0], rows[-1], changed.shape[0], out_h)
+    c0, c1 = span(cols[0], cols[-1], changed.shape[1], out_w)
+    return r0, r1, c0, c1
+
+
+# network input sizes (longer side) the engine accepts; the network halves
+# its input three times, so sides are multiples of 8
+INFERENCE_SIZES = tuple(range(128, 513, 8))
+
+
+def inference_shape(h, w, size, bucket=16, min_side=128):
+    ''' Network input shape for an hxw image, keeping its aspect ratio
+    The longer side is size; the shorter is rounded to a multiple of bucket
+    (so similar images share a shape, and batch together) and kept within
+    [min(min_side, size), size].
+        OUTPUTS
+            returned value is (H, W) '''
+    short = 1. * min(h, w) / max(h, w) * size
+    short = int(round(short / bucket)) * bucket
+    short = max(min(min_side, size), min(size, short))
+    return (size, short) if h >= w else (short, size)
+
+
+_siggraph_nets = {}  # (path, gpu_id) -> loaded SIGGRAPHGenerator
+_siggraph_nets_lock = threading.Lock()
+
+
+def load_siggraph_net(path, gpu_id=None):
+    ''' Load a SIGGRAPHGenerator from path, once per process
+    Every ColorizeImageTorch view prepared from the same weights and device
+    gets the same network. It is built with dist=True, so a single forward
+    pass can give the ab prediction, the distribution, or both.
+    With path None the weights are left randomly initialized (for
+    benchmarks, which don't need the trained model). '''
+    key = (os.path.abspath(path) if path is not None else None, gpu_id)
+    with _siggraph_nets_lock:
+        if key not in _siggraph_nets:
+            import torch
+            import models.pytorch.model as model
+            print('path = %s' % path)
+            net = model.SIGGRAPHGenerator(dist=True)
+            if path is not None:
+                state_dict = torch.load(path)
+                if hasattr(state_dict, '_metadata'):
+                    del state_dict._metadata
+
+                # patch InstanceNorm checkpoints prior to 0.4
+                for key_ in list(state_dict.keys()):  # need to copy keys here because we mutate in loop
+                    _patch_instance_norm_state_dict(state_dict, net, key_.split('.'))
+                net.load_state_dict(state_dict)
+            if gpu_id != None:
+                net.cuda()
+            net.eval()
+            _siggraph_nets[key] = net
+        return _siggraph_nets[key]
+
+
+def _patch_instance_norm_state_dict(state_dict, module, keys, i=0):
+    key = keys[i]
+    if i + 1 == len(keys):  # at the end, pointing to a parameter/buffer
+        if module.__class__.__name__.startswith('InstanceNorm') and \
+                (key == 'running_mean' or key == 'running_var'):
+            if getattr(module, key) is None:
+                state_dict.pop('.'.join(keys))
+        if module.__class__.__name__.startswith('InstanceNorm') and \
+           (key == 'num_batches_tracked'):
+            state_dict.pop('.'.join(keys))
+    else:
+        _patch_instance_norm_state_dict(state_dict, getattr(module, key), keys, i + 1)
+
+
+def siggraph_forward(net, input_A, input_B, mask_B, maskcent=0, dist=False):
+    ''' Batched forward pass through a SIGGRAPHGenerator
+    SIGGRAPHGenerator.forward only takes a single image, so this runs the
+    same layer stack on stacked inputs.
+        INPUTS
+            input_A     Nx1xXxX     [-50,50]
+            input_B     Nx2xXxX     [-110,110]
+            mask_B      Nx1xXxX     [0,1]
+        OUTPUTS
+            Nx2xXxX ab prediction, and also the NxABx(X/4)x(X/4) distribution
+            if dist, at the resolution the network predicts it '''
+    import torch
+    device = next(net.parameters()).device
+    with torch.no_grad():
+        input_A = torch.as_tensor(input_A, dtype=torch.float32, device=device)
+        input_B = torch.as_tensor(input_B, dtype=torch.float32, device=device)
+        mask_B = torch.as_tensor(mask_B, dtype=torch.float32, device=device)
+        outputs = siggraph_graph(net, input_A, input_B, mask_B, maskcent=maskcent, dist=dist)
+        if dist:
+            return tuple(output.cpu().numpy() for output in outputs)
+        return outputs.cpu().numpy()
+
+
+def siggraph_graph(net, input_A, input_B, mask_B, maskcent=0, dist=False):
+    ''' The layers of siggraph_forward on tensors, also traced by
+    data/exported_net.py to export the network '''
+    import torch
+    mask_B = mask_B - maskcent
+    conv1_2 = net.model1(torch.cat((input_A / 100., input_B / 110., mask_B), dim=1))
+    conv2_2 = net.model2(conv1_2[:, :, ::2, ::2])
+    conv3_3 = net.model3(conv2_2[:, :, ::2, ::2])
+    conv4_3 = net.model4(conv3_3[:, :, ::2, ::2])
+    conv5_3 = net.model5(conv4_3)
+    conv6_3 = net.model6(conv5_3)
+    conv7_3 = net.model7(conv6_3)
+
+    conv8_up = net.model8up(conv7_3) + net.model3short8(conv3_3)
+    conv8_3 = net.model8(conv8_up)
+
+    conv9_up = net.model9up(conv8_3) + net.model2short9(conv2_2)
+    conv9_3 = net.model9(conv9_up)
+    conv10_up = net.model10up(conv9_3) + net.model1short10(conv1_2)
+    conv10_2 = net.model10(conv10_up)
+    out_reg = net.model_out(conv10_2) * 110
+
+    if dist:
+        # net.upsample4 would only repeat each value 4x4 (nearest), see
+        # ColorizeImageTorchDist.dist_at
+        out_cl = net.softmax(net.model_class(conv8_3) * .2)
+        return out_reg, out_cl
+    return out_reg
+
+
 class ColorizeImageBase():
-    def __init__(self, Xd=256, Xfullres_max=10000):
+    # attributes describing the current image, hints and outputs
+    # these are never shared between forks
+    image_state_attrs = ('img_rgb_fullres', 'img_lab_fullres', 'img_l_fullres', 'img_ab_fullres',
+                         'img_rgb', 'img_lab', 'img_l', 'img_ab', 'img_lab_mc', 'img_l_mc', 'img_ab_mc',
+                         'input_ab', 'input_ab_mc', 'input_mask', 'input_mask_mult',
+                         '_output_rgb', 'output_lab', 'output_ab', '_memo')
+
+    def __init__(self, Xd=256, Xfullres_max=10000, dtype=np.float32, keep_aspect=False):
         self.Xd = Xd
+        # with keep_aspect, images are resized to an inference_shape with
+        # longer side Xd instead of XdxXd
+        self.keep_aspect = keep_aspect
+        # floating point type of every intermediate, from Lab conversion to
+        # the result; float64 is the slower reference path
+        self.dtype = np.dtype(dtype)
         self.img_l_set = False
         self.net_set = False
         self.Xfullres_max = Xfullres_max  # maximum size of maximum dimension
@@ -48,14 +295,47 @@ class ColorizeImageBase():
     def prep_net(self):
         raise Exception("Should be implemented by base class")
 
+    def fork(self, Xd=None):
+        ''' Per-request context
+        Returns an engine which shares this one's network, settings and
+        batching scheduler, but carries its own image, hints and outputs.
+        One loaded net can then serve many threads, each on its own fork.
+        Xd, if given, is the fork's inference size. '''
+        other = copy.copy(self)
+        if Xd is not None:
+            other.Xd = Xd
+        for attr in self.image_state_attrs:
+            other.__dict__.pop(attr, None)
+        other._reset_image_state()
+        return other
+
+    def _reset_image_state(self):
+        self.img_l_set = False
+        self.img_just_set = False
+
+    def inference_shape(self, h, w):
+        # network input shape (H, W) for an hxw image
+        if self.keep_aspect:
+            return inference_shape(h, w, self.Xd)
+        return (self.Xd, self.Xd)
+
+    @property
+    def input_shape(self):
+        # (H, W) of the current network input
+        if self.__dict__.get('img_l') is not None:
+            return self.img_l.shape[1:]
+        return (self.Xd, self.Xd)
+
     # ***** Image prepping *****
     def load_image(self, input_path):
-        # rgb image [CxXdxXd]
-        im = cv2.cvtColor(cv2.imread(input_path, 1), cv2.COLOR_BGR2RGB)
+        # rgb image [CxHxW], HxW = inference_shape
+        with stage_timer('decode'):
+            im = cv2.cvtColor(cv2.imread(input_path, 1), cv2.COLOR_BGR2RGB)
         self.img_rgb_fullres = im.copy()
         self._set_img_lab_fullres_()
 
-        im = cv2.resize(im, (self.Xd, self.Xd))
+        H, W = self.inference_shape(*im.shape[:2])
+        im = cv2.resize(im, (W, H))
         self.img_rgb = im.copy()
         # self.img_rgb = sp.misc.imresize(plt.imread(input_path),(self.Xd,self.Xd)).transpose((2,0,1))
 
@@ -76,6 +356,34 @@ class ColorizeImageBase():
         self._set_img_lab_()
         self._set_img_lab_mc_()
 
+    def set_image_lowres(self, img_rgb):
+        # prepare only the network input, from an rgb image already resized
+        # (to inference_shape); full resolution attributes are left unset
+        # (used when streaming large images, see data/large_image.py)
+        self.img_rgb = img_rgb
+        self.img_l_set = True
+        self._set_img_lab_()
+        self._set_img_lab_mc_()
+
+    def get_prepared(self):
+        # the parts of a loaded image needed to run net_forward and
+        # get_img_fullres again, e.g. to cache between requests
+        return {'img_l_fullres': self.img_l_fullres, 'img_l': self.img_l, 'img_l_mc': self.img_l_mc}
+
+    def set_output_ab(self, output_ab):
+        # use a previously predicted ab (2xXxX) as the result, instead of
+        # calling net_forward, e.g. to render part of it again
+        self._set_out_ab_raw_(output_ab)
+
+    def set_prepared(self, prepared):
+        # restore an image from get_prepared(), skipping decode and Lab conversion
+        # (methods needing the rgb or ab of the input, like get_result_PSNR, are not available)
+        self._clear_memo_()
+        self.img_l_fullres = prepared['img_l_fullres']
+        self.img_l = prepared['img_l']
+        self.img_l_mc = prepared['img_l_mc']
+        self.img_l_set = True
+
     def net_forward(self, input_ab, input_mask):
         # INPUTS
         #     ab         2xXxX     input color patches (non-normalized)
@@ -89,10 +397,11 @@ class ColorizeImageBase():
             print('I need to have a net!')
             return -1
 
-        self.input_ab = input_ab
-        self.input_ab_mc = (input_ab - self.ab_mean) / self.ab_norm
-        self.input_mask = input_mask
-        self.input_mask_mult = input_mask * self.mask_mult
+        self._clear_memo_('hints', 'output')
+        self.input_ab = np.asarray(input_ab, dtype=self.dtype)
+        self.input_ab_mc = (self.input_ab - self.dtype.type(self.ab_mean)) / self.dtype.type(self.ab_norm)
+        self.input_mask = np.asarray(input_mask, dtype=self.dtype)
+        self.input_mask_mult = self.input_mask * self.dtype.type(self.mask_mult)
         return 0
 
     def get_result_PSNR(self, result=-1, return_SE_map=False):
@@ -108,56 +417,105 @@ class ColorizeImageBase():
         else:
             return cur_PSNR
 
+    @property
+    def output_rgb(self):
+        # HxWx3 result at the network's size, built from the raw ab prediction on first use
+        if self.__dict__.get('_output_rgb') is None:
+            self._output_rgb = lab2rgb_transpose(self.img_l, self.output_ab, dtype=self.dtype)
+        return self._output_rgb
+
+    @output_rgb.setter
+    def output_rgb(self, output_rgb):
+        self._clear_memo_('output')
+        self._output_rgb = output_rgb
+
     def get_img_forward(self):
         # get image with point estimate
         return self.output_rgb
 
     def get_img_gray(self):
         # Get black and white image
-        return lab2rgb_transpose(self.img_l, np.zeros((2, self.Xd, self.Xd)))
+        return self._memoize_('image', 'gray', lambda: lab2rgb_transpose(
+            self.img_l, np.zeros((2,) + self.img_l.shape[1:], dtype=self.dtype), dtype=self.dtype))
 
     def get_img_gray_fullres(self):
         # Get black and white image
-        return lab2rgb_transpose(self.img_l_fullres, np.zeros((2, self.img_l_fullres.shape[1], self.img_l_fullres.shape[2])))
+        return self._memoize_('image', 'gray_fullres', lambda: lab2rgb_transpose(
+            self.img_l_fullres, np.zeros((2,) + self.img_l_fullres.shape[1:], dtype=self.dtype), dtype=self.dtype))
 
+    @timed('upsample')
     def get_img_fullres(self):
         # This assumes self.img_l_fullres, self.output_ab are set.
         # Typically, this means that set_image() and net_forward()
         # have been called.
-        # bilinear upsample
-        zoom_factor = (1, 1. * self.img_l_fullres.shape[1] / self.output_ab.shape[1], 1. * self.img_l_fullres.shape[2] / self.output_ab.shape[2])
-        output_ab_fullres = zoom(self.output_ab, zoom_factor, order=1)
+        # bilinear upsample and convert in float32 row tiles
+        return self._memoize_('output', 'img_fullres', lambda: lab2rgb_fullres(self.img_l_fullres, self.output_ab, dtype=self.dtype))
 
-        return lab2rgb_transpose(self.img_l_fullres, output_ab_fullres)
+    @timed('upsample')
+    def get_img_fullres_window(self, r0, r1, c0, c1):
+        # rows r0:r1 and columns c0:c1 of get_img_fullres(), computing only
+        # those (e.g. the region changed by a hint edit, see changed_bbox)
+        H, W = self.img_l_fullres.shape[1:]
+        ab_cols = upsample_ab_cols(self.output_ab, W, dtype=self.dtype, c0=c0, c1=c1)
+        return lab2rgb_transpose(self.img_l_fullres[:, r0:r1, c0:c1], upsample_ab_rows(ab_cols, H, r0, r1), dtype=self.dtype)
 
     def get_input_img_fullres(self):
-        zoom_factor = (1, 1. * self.img_l_fullres.shape[1] / self.input_ab.shape[1], 1. * self.img_l_fullres.shape[2] / self.input_ab.shape[2])
-        input_ab_fullres = zoom(self.input_ab, zoom_factor, order=1)
-        return lab2rgb_transpose(self.img_l_fullres, input_ab_fullres)
+        # bilinear, as zoom(order=1)
+        return self._memoize_('hints', 'input_img_fullres', lambda: lab2rgb_fullres(self.img_l_fullres, self.input_ab, dtype=self.dtype))
 
     def get_input_img(self):
-        return lab2rgb_transpose(self.img_l, self.input_ab)
+        return lab2rgb_transpose(self.img_l, self.input_ab, dtype=self.dtype)
 
     def get_img_mask(self):
         # Get black and white image
-        return lab2rgb_transpose(100. * (1 - self.input_mask), np.zeros((2, self.Xd, self.Xd)))
+        return lab2rgb_transpose(100. * (1 - self.input_mask), np.zeros((2,) + self.input_mask.shape[1:], dtype=self.dtype), dtype=self.dtype)
 
     def get_img_mask_fullres(self):
         # Get black and white image
-        zoom_factor = (1, 1. * self.img_l_fullres.shape[1] / self.input_ab.shape[1], 1. * self.img_l_fullres.shape[2] / self.input_ab.shape[2])
-        input_mask_fullres = zoom(self.input_mask, zoom_factor, order=0)
-        return lab2rgb_transpose(100. * (1 - input_mask_fullres), np.zeros((2, input_mask_fullres.shape[1], input_mask_fullres.shape[2])))
+        def compute():
+            input_mask_fullres = self._input_fullres_('input_mask_fullres', self.input_mask)
+            return lab2rgb_transpose(100. * (1 - input_mask_fullres), np.zeros((2,) + input_mask_fullres.shape[1:], dtype=self.dtype),
+                                     dtype=self.dtype)
+        return self._memoize_('hints', 'img_mask_fullres', compute)
 
     def get_sup_img(self):
-        return lab2rgb_transpose(50 * self.input_mask, self.input_ab)
+        return lab2rgb_transpose(50 * self.input_mask, self.input_ab, dtype=self.dtype)
 
     def get_sup_fullres(self):
-        zoom_factor = (1, 1. * self.img_l_fullres.shape[1] / self.output_ab.shape[1], 1. * self.img_l_fullres.shape[2] / self.output_ab.shape[2])
-        input_mask_fullres = zoom(self.input_mask, zoom_factor, order=0)
-        input_ab_fullres = zoom(self.input_ab, zoom_factor, order=0)
-        return lab2rgb_transpose(50 * input_mask_fullres, input_ab_fullres)
+        def compute():
+            input_mask_fullres = self._input_fullres_('input_mask_fullres', self.input_mask)
+            input_ab_fullres = self._input_fullres_('input_ab_fullres', self.input_ab)
+            return lab2rgb_transpose(50 * input_mask_fullres, input_ab_fullres, dtype=self.dtype)
+        return self._memoize_('hints', 'sup_fullres', compute)
 
     # ***** Private functions *****
+    def _memoize_(self, group, name, compute):
+        # outputs derived from the current image ('image'), hints ('hints')
+        # or prediction ('output'), computed once until that changes
+        memo = self.__dict__.setdefault('_memo', {})
+        key = (group, name)
+        if key not in memo:
+            memo[key] = compute()
+        return memo[key]
+
+    def _clear_memo_(self, *groups):
+        # forget what was derived from groups, or everything
+        memo = self.__dict__.get('_memo')
+        if memo:
+            for key in list(memo):
+                if not groups or key[0] in groups:
+                    del memo[key]
+
+    def _fullres_zoom_(self, shape):
+        # zoom factors from a CxhxW input to the full resolution image
+        return self._memoize_('image', ('zoom', shape), lambda: (
+            1, 1. * self.img_l_fullres.shape[1] / shape[1], 1. * self.img_l_fullres.shape[2] / shape[2]))
+
+    def _input_fullres_(self, name, value):
+        # nearest neighbor upsampling of a hint input to full resolution
+        return self._memoize_('hints', name, lambda: zoom(value, self._fullres_zoom_(value.shape), order=0))
+
+    @timed('lab_fullres')
     def _set_img_lab_fullres_(self):
         # adjust full resolution image to be within maximum dimension is within Xfullres_max
         Xfullres = self.img_rgb_fullres.shape[0]
@@ -169,21 +527,24 @@ class ColorizeImageBase():
                 zoom_factor = 1. * self.Xfullres_max / Yfullres
             self.img_rgb_fullres = zoom(self.img_rgb_fullres, (zoom_factor, zoom_factor, 1), order=1)
 
-        self.img_lab_fullres = color.rgb2lab(self.img_rgb_fullres).transpose((2, 0, 1))
+        self._clear_memo_()
+        self.img_lab_fullres = rgb2lab_transpose(self.img_rgb_fullres, dtype=self.dtype)
         self.img_l_fullres = self.img_lab_fullres[[0], :, :]
         self.img_ab_fullres = self.img_lab_fullres[1:, :, :]
 
+    @timed('lab')
     def _set_img_lab_(self):
         # set self.img_lab from self.im_rgb
-        self.img_lab = color.rgb2lab(self.img_rgb).transpose((2, 0, 1))
+        self._clear_memo_()
+        self.img_lab = rgb2lab_transpose(self.img_rgb, dtype=self.dtype)
         self.img_l = self.img_lab[[0], :, :]
         self.img_ab = self.img_lab[1:, :, :]
 
     def _set_img_lab_mc_(self):
         # set self.img_lab_mc from self.img_lab
         # lab image, mean centered [XxYxX]
-        self.img_lab_mc = self.img_lab / np.array((self.l_norm, self.ab_norm, self.ab_norm))[:, np.newaxis, np.newaxis] - np.array(
-            (self.l_mean / self.l_norm, self.ab_mean / self.ab_norm, self.ab_mean / self.ab_norm))[:, np.newaxis, np.newaxis]
+        self.img_lab_mc = self.img_lab / np.array((self.l_norm, self.ab_norm, self.ab_norm), dtype=self.dtype)[:, np.newaxis, np.newaxis] - np.array(
+            (self.l_mean / self.l_norm, self.ab_mean / self.ab_norm, self.ab_mean / self.ab_norm), dtype=self.dtype)[:, np.newaxis, np.newaxis]
         self._set_img_l_()
 
     def _set_img_l_(self):
@@ -194,56 +555,78 @@ class ColorizeImageBase():
         self.img_ab_mc = self.img_lab_mc[[1, 2], :, :]
 
     def _set_out_ab_(self):
-        self.output_lab = rgb2lab_transpose(self.output_rgb)
+        self.output_lab = rgb2lab_transpose(self.output_rgb, dtype=self.dtype)
         self.output_ab = self.output_lab[1:, :, :]
 
+    def _set_out_ab_raw_(self, output_ab):
+        # keep the network's ab as the result; output_rgb is built lazily
+        self._clear_memo_('output')
+        self.output_ab = np.asarray(output_ab, dtype=self.dtype)
+        self._output_rgb = None
+
 
 class ColorizeImageTorch(ColorizeImageBase):
-    def __init__(self, Xd=256, maskcent=False):
+    def __init__(self, Xd=256, maskcent=False, dtype=np.float32, keep_aspect=False):
         print('ColorizeImageTorch instantiated')
-        ColorizeImageBase.__init__(self, Xd)
+        ColorizeImageBase.__init__(self, Xd, dtype=dtype, keep_aspect=keep_aspect)
         self.l_norm = 1.
         self.ab_norm = 1.
         self.l_mean = 50.
         self.ab_mean = 0.
         self.mask_mult = 1.
         self.mask_cent = .5 if maskcent else 0
+        self.dist = False
+        self.scheduler = None  # set by enable_batching
 
         # Load grid properties
         self.pts_in_hull = np.array(np.meshgrid(np.arange(-110, 120, 10), np.arange(-110, 120, 10))).reshape((2, 529)).T
 
     # ***** Net preparation *****
     def prep_net(self, gpu_id=None, path='', dist=False):
-        import torch
-        import models.pytorch.model as model
-        print('path = %s' % path)
+        # the color and distribution views load the same weights, so they
+        # share one network; dist only selects which outputs net_forward computes
         print('Model set! dist mode? ', dist)
-        self.net = model.SIGGRAPHGenerator(dist=dist)
-        state_dict = torch.load(path)
-        if hasattr(state_dict, '_metadata'):
-            del state_dict._metadata
-
-        # patch InstanceNorm checkpoints prior to 0.4
-        for key in list(state_dict.keys()):  # need to copy keys here because we mutate in loop
-            self.__patch_instance_norm_state_dict(state_dict, self.net, key.split('.'))
-        self.net.load_state_dict(state_dict)
-        if gpu_id != None:
-            self.net.cuda()
-        self.net.eval()
+        self.net = load_siggraph_net(path, gpu_id=gpu_id)
+        self.dist = dist
         self.net_set = True
 
-    def __patch_instance_norm_state_dict(self, state_dict, module, keys, i=0):
-        key = keys[i]
-        if i + 1 == len(keys):  # at the end, pointing to a parameter/buffer
-            if module.__class__.__name__.startswith('InstanceNorm') and \
-                    (key == 'running_mean' or key == 'running_var'):
-                if getattr(module, key) is None:
-                    state_dict.pop('.'.join(keys))
-            if module.__class__.__name__.startswith('InstanceNorm') and \
-               (key == 'num_batches_tracked'):
-                state_dict.pop('.'.join(keys))
-        else:
-            self.__patch_instance_norm_state_dict(state_dict, getattr(module, key), keys, i + 1)
+    def enable_batching(self, max_batch_size=8, max_delay=.005, num_workers=1):
+        # route net_forward through a micro-batching scheduler, so concurrent
+        # callers sharing this net get stacked into one forward pass (those
+        # with the same mode and input shape), on num_workers threads
+        if self.scheduler is not None:
+            self.scheduler.close()
+        self.scheduler = BatchScheduler(self._forward_scheduled, max_batch_size=max_batch_size, max_delay=max_delay,
+                                        num_workers=num_workers)
+        return self.scheduler
+
+    @timed('forward_batch')
+    def forward_batch(self, img_l_mc, input_ab_mc, input_mask_mult, dist=None):
+        # INPUTS
+        #     img_l_mc          Nx1xXxX   mean-centered L
+        #     input_ab_mc       Nx2xXxX   mean-centered input ab
+        #     input_mask_mult   Nx1xXxX   scaled input mask
+        # OUTPUTS
+        #     Nx2xXxX ab prediction (and NxABxXxX distribution in dist mode)
+        if dist is None:
+            dist = self.dist
+        return siggraph_forward(self.net, img_l_mc, input_ab_mc, input_mask_mult, maskcent=self.mask_cent, dist=dist)
+
+    def _forward_scheduled(self, batch, key):
+        dist, _ = key
+        return self.forward_batch(*batch, dist=dist)
+
+    @timed('inference')
+    def _forward_single(self):
+        # run the current image and inputs, through the scheduler if there is one
+        # (so 'inference' includes the wait for a batch, 'forward_batch' doesn't)
+        inputs = (self.img_l_mc, self.input_ab_mc, self.input_mask_mult)
+        if self.scheduler is not None:
+            return self.scheduler.submit(inputs, key=(self.dist, self.img_l_mc.shape))
+        outputs = self.forward_batch(*[inp[np.newaxis] for inp in inputs])
+        if isinstance(outputs, tuple):
+            return tuple(output[0] for output in outputs)
+        return outputs[0]
 
     # ***** Call forward *****
     def net_forward(self, input_ab, input_mask):
@@ -255,45 +638,47 @@ class ColorizeImageTorch(ColorizeImageBase):
         if ColorizeImageBase.net_forward(self, input_ab, input_mask) == -1:
             return -1
 
-        # net_input_prepped = np.concatenate((self.img_l_mc, self.input_ab_mc, self.input_mask_mult), axis=0)
-
         # return prediction
-        # self.net.blobs['data_l_ab_mask'].data[...] = net_input_prepped
-        # embed()
-        output_ab = self.net.forward(self.img_l_mc, self.input_ab_mc, self.input_mask_mult, self.mask_cent)[0, :, :, :].cpu().data.numpy()
-        self.output_rgb = lab2rgb_transpose(self.img_l, output_ab)
-        # self.output_rgb = lab2rgb_transpose(self.img_l, self.net.blobs[self.pred_ab_layer].data[0, :, :, :])
-
-        self._set_out_ab_()
-        return self.output_rgb
+        output_ab = self._forward_single()
+        if self.dist:
+            output_ab = output_ab[0]
+        self._set_out_ab_raw_(output_ab)
+        return self.output_ab
 
     def get_img_forward(self):
         # get image with point estimate
         return self.output_rgb
 
-    def get_img_gray(self):
-        # Get black and white image
-        return lab2rgb_transpose(self.img_l, np.zeros((2, self.Xd, self.Xd)))
-
 
 class ColorizeImageTorchDist(ColorizeImageTorch):
-    def __init__(self, Xd=256, maskcent=False):
-        ColorizeImageTorch.__init__(self, Xd)
+    image_state_attrs = ColorizeImageTorch.image_state_attrs + ('_dist_ab', '_dist_ab_full', 'dist_entropy')
+
+    def __init__(self, Xd=256, maskcent=False, dtype=np.float32, dist_dtype=np.float16, dist_layout='channel', keep_aspect=False):
+        # the distribution is kept at 1/dist_scale of the input size, as the
+        # network predicts it, in dist_dtype, as ABxHxW ('channel') or HxWxAB
+        # ('pixel', so the distribution at one pixel is contiguous)
+        ColorizeImageTorch.__init__(self, Xd, dtype=dtype, keep_aspect=keep_aspect)
+        if dist_layout not in ('channel', 'pixel'):
+            raise ValueError('dist_layout must be channel or pixel, not %s' % dist_layout)
+        self.dist_dtype = np.dtype(dist_dtype)
+        self.dist_layout = dist_layout
+        self.dist_scale = 4
         self.dist_ab_set = False
         self.pts_grid = np.array(np.meshgrid(np.arange(-110, 120, 10), np.arange(-110, 120, 10))).reshape((2, 529)).T
         self.in_hull = np.ones(529, dtype=bool)
         self.AB = self.pts_grid.shape[0]  # 529
         self.A = int(np.sqrt(self.AB))  # 23
         self.B = int(np.sqrt(self.AB))  # 23
-        self.dist_ab_full = np.zeros((self.AB, self.Xd, self.Xd))
-        self.dist_ab_grid = np.zeros((self.A, self.B, self.Xd, self.Xd))
-        self.dist_entropy = np.zeros((self.Xd, self.Xd))
         self.mask_cent = .5 if maskcent else 0
 
     def prep_net(self, gpu_id=None, path='', dist=True, S=.2):
         ColorizeImageTorch.prep_net(self, gpu_id=gpu_id, path=path, dist=dist)
         # set S somehow
 
+    def _reset_image_state(self):
+        ColorizeImageTorch._reset_image_state(self)
+        self.dist_ab_set = False
+
     def net_forward(self, input_ab, input_mask):
         # INPUTS
         #     ab         2xXxX     input color patches (non-normalized)
@@ -305,77 +690,144 @@ class ColorizeImageTorchDist(ColorizeImageTorch):
             return -1
 
         # set distribution
-        (function_return, self.dist_ab) = self.net.forward(self.img_l_mc, self.input_ab_mc, self.input_mask_mult, self.mask_cent)
-        function_return = function_return[0, :, :, :].cpu().data.numpy()
-        self.dist_ab = self.dist_ab[0, :, :, :].cpu().data.numpy()
-        self.dist_ab_set = True
-
-        # full grid, ABxXxX, AB = 529
-        self.dist_ab_full[self.in_hull, :, :] = self.dist_ab
-
-        # gridded, AxBxXxX, A = 23
-        self.dist_ab_grid = self.dist_ab_full.reshape((self.A, self.B, self.Xd, self.Xd))
+        # ab prediction and distribution come from the same forward pass
+        (function_return, dist_ab) = self._forward_single()
+        self.set_dist(dist_ab)
+        self._set_out_ab_raw_(function_return)
 
         # return
         return function_return
 
-    def get_ab_reccs(self, h, w, K=5, N=25000, return_conf=False):
+    def set_dist(self, dist_ab):
+        ''' Use a predicted distribution, ABx(X/4)x(X/4), e.g. one cached from
+        dist_ab instead of calling net_forward, for get_ab_reccs. It is stored
+        in dist_dtype and dist_layout (without a copy if it already is).
+        A distribution upsampled to the input size (ABxXxX, as from graphs
+        exported before) is subsampled back, which loses nothing. '''
+        dist_ab = np.asarray(dist_ab, dtype=self.dist_dtype)
+        if dist_ab.shape[1:] == self.img_l.shape[1:]:
+            dist_ab = dist_ab[:, ::self.dist_scale, ::self.dist_scale]
+        if self.dist_layout == 'pixel':
+            dist_ab = np.ascontiguousarray(dist_ab.transpose((1, 2, 0)))
+        self._dist_ab = dist_ab
+        self.dist_ab_set = True
+        self.__dict__.pop('_dist_ab_full', None)
+        self.__dict__.pop('dist_entropy', None)
+
+    @property
+    def dist_ab(self):
+        # in-gamut distribution, ABx(X/4)x(X/4) (a transposed view in pixel layout)
+        if self.dist_layout == 'pixel':
+            return self._dist_ab.transpose((2, 0, 1))
+        return self._dist_ab
+
+    def dist_at(self, h, w):
+        # distribution at input pixel (h,w), AB
+        h, w = h // self.dist_scale, w // self.dist_scale
+        if self.dist_layout == 'pixel':
+            return self._dist_ab[h, w]
+        return self._dist_ab[:, h, w]
+
+    @property
+    def dist_ab_full(self):
+        # full grid, ABx(X/4)x(X/4), AB = 529, in dtype
+        # built on first use: it is several times the size of dist_ab
+        if self.__dict__.get('_dist_ab_full') is None:
+            dist_ab = self.dist_ab
+            dist_ab_full = np.zeros((self.AB,) + dist_ab.shape[1:], dtype=self.dtype)
+            dist_ab_full[self.in_hull, :, :] = dist_ab
+            self._dist_ab_full = dist_ab_full
+        return self._dist_ab_full
+
+    @property
+    def dist_ab_grid(self):
+        # gridded, AxBx(X/4)x(X/4), A = 23, a view of dist_ab_full
+        return self.dist_ab_full.reshape((self.A, self.B) + self.dist_ab_full.shape[1:])
+
+    def get_ab_reccs(self, h, w, K=5, N=25000, return_conf=False, method='modes'):
         ''' Recommended colors at point (h,w)
         Call this after calling net_forward
+        method 'modes' clusters the predicted histogram directly (fast, deterministic),
+        'kmeans' runs KMeans on N points sampled from it
         '''
         if not self.dist_ab_set:
             print('Need to set prediction first')
             return 0
 
-        # randomly sample from pdf
-        cmf = np.cumsum(self.dist_ab[:, h, w])  # CMF
-        cmf = cmf / cmf[-1]
-        cmf_bins = cmf
-
-        # randomly sample N points
-        rnd_pts = np.random.uniform(low=0, high=1.0, size=N)
-        inds = np.digitize(rnd_pts, bins=cmf_bins)
-        rnd_pts_ab = self.pts_in_hull[inds, :]
-
-        # run k-means
-        kmeans = KMeans(n_clusters=K).fit(rnd_pts_ab)
-
-        # sort by cluster occupancy
-        k_label_cnt = np.histogram(kmeans.labels_, np.arange(0, K + 1))[0]
-        k_inds = np.argsort(k_label_cnt, axis=0)[::-1]
-
-        cluster_per = 1. * k_label_cnt[k_inds] / N  # percentage of points within cluster
-        cluster_centers = kmeans.cluster_centers_[k_inds, :]  # cluster centers
+        if method == 'kmeans':
+            cluster_centers, cluster_per = ab_reccs_kmeans(self.dist_at(h, w), self.pts_in_hull, K=K, N=N)
+        else:
+            cluster_centers, cluster_per = ab_reccs_modes(self.dist_at(h, w), self.pts_in_hull, K=K)
 
-        # cluster_centers = np.random.uniform(low=-100,high=100,size=(N,2))
         if return_conf:
             return cluster_centers, cluster_per
         else:
             return cluster_centers
 
-    def compute_entropy(self):
-        # compute the distribution entropy (really slow right now)
-        self.dist_entropy = np.sum(self.dist_ab * np.log(self.dist_ab), axis=0)
+    @timed('entropy')
+    def compute_entropy(self, stride=1, normalize=False):
+        # entropy of the distribution at every stride-th input pixel,
+        # XxX / stride (see data/uncertainty.py); higher is less certain
+        if stride % self.dist_scale == 0:
+            entropy = entropy_map(self.dist_ab, stride=stride // self.dist_scale, normalize=normalize, dtype=self.dtype)
+        else:
+            H, W = self.img_l.shape[1:]
+            rows = np.arange(0, H, stride) // self.dist_scale
+            cols = np.arange(0, W, stride) // self.dist_scale
+            entropy = entropy_map(self.dist_ab, normalize=normalize, dtype=self.dtype)[rows[:, np.newaxis], cols]
+        self.dist_entropy = entropy
+        return self.dist_entropy
 
     def plot_dist_grid(self, h, w):
         # Plots distribution at a given point
         plt.figure()
-        plt.imshow(self.dist_ab_grid[:, :, h, w], extent=[-110, 110, 110, -110], interpolation='nearest')
+        plt.imshow(self.dist_ab_grid[:, :, h // self.dist_scale, w // self.dist_scale], extent=[-110, 110, 110, -110], interpolation='nearest')
         plt.colorbar()
         plt.ylabel('a')
         plt.xlabel('b')
 
     def plot_dist_entropy(self):
         # Plots distribution at a given point
+        if self.__dict__.get('dist_entropy') is None:
+            self.compute_entropy()
         plt.figure()
-        plt.imshow(-self.dist_entropy, interpolation='nearest')
+        plt.imshow(self.dist_entropy, interpolation='nearest')
         plt.colorbar()
 
 
+class ColorizeImageExported(ColorizeImageTorch):
+    ''' ColorizeImageTorch running a TorchScript or ONNX export of the
+    network (see data/exported_net.py and export_model.py) '''
+
+    # ***** Net preparation *****
+    def prep_net(self, gpu_id=None, path='', dist=False, runtime='torchscript', num_threads=0):
+        # path is the prefix the graphs were exported to
+        from .exported_net import load_exported_net
+        print('Exported model set! runtime: %s, dist mode? %s' % (runtime, dist))
+        self.net = load_exported_net(path, runtime=runtime, gpu_id=gpu_id, num_threads=num_threads)
+        self.dist = dist
+        self.net_set = True
+
+    @timed('forward_batch')
+    def forward_batch(self, img_l_mc, input_ab_mc, input_mask_mult, dist=None):
+        if dist is None:
+            dist = self.dist
+        return self.net.forward(img_l_mc, input_ab_mc, input_mask_mult, maskcent=self.mask_cent, dist=dist)
+
+
+class ColorizeImageExportedDist(ColorizeImageTorchDist):
+    ''' ColorizeImageTorchDist running an exported network '''
+
+    def prep_net(self, gpu_id=None, path='', dist=True, runtime='torchscript', num_threads=0):
+        ColorizeImageExported.prep_net(self, gpu_id=gpu_id, path=path, dist=dist, runtime=runtime, num_threads=num_threads)
+
+    forward_batch = ColorizeImageExported.forward_batch
+
+
 class ColorizeImageCaffe(ColorizeImageBase):
-    def __init__(self, Xd=256):
+    def __init__(self, Xd=256, dtype=np.float32):
         print('ColorizeImageCaffe instantiated')
-        ColorizeImageBase.__init__(self, Xd)
+        ColorizeImageBase.__init__(self, Xd, dtype=dtype)
         self.l_norm = 1.
         self.ab_norm = 1.
         self.l_mean = 50.
@@ -428,7 +880,7 @@ class ColorizeImageCaffe(ColorizeImageBase):
         self.net.forward()
 
         # return prediction
-        self.output_rgb = lab2rgb_transpose(self.img_l, self.net.blobs[self.pred_ab_layer].data[0, :, :, :])
+        self.output_rgb = lab2rgb_transpose(self.img_l, self.net.blobs[self.pred_ab_layer].data[0, :, :, :], dtype=self.dtype)
 
         self._set_out_ab_()
         return self.output_rgb
@@ -437,15 +889,11 @@ class ColorizeImageCaffe(ColorizeImageBase):
         # get image with point estimate
         return self.output_rgb
 
-    def get_img_gray(self):
-        # Get black and white image
-        return lab2rgb_transpose(self.img_l, np.zeros((2, self.Xd, self.Xd)))
-
 
 class ColorizeImageCaffeGlobDist(ColorizeImageCaffe):
     # Caffe colorization, with additional global histogram as input
-    def __init__(self, Xd=256):
-        ColorizeImageCaffe.__init__(self, Xd)
+    def __init__(self, Xd=256, dtype=np.float32):
+        ColorizeImageCaffe.__init__(self, Xd, dtype=dtype)
         self.glob_mask_mult = 1.
         self.glob_layer = 'glob_ab_313_mask'
 
@@ -465,8 +913,8 @@ class ColorizeImageCaffeGlobDist(ColorizeImageCaffe):
 
 class ColorizeImageCaffeDist(ColorizeImageCaffe):
     # caffe model which includes distribution prediction
-    def __init__(self, Xd=256):
-        ColorizeImageCaffe.__init__(self, Xd)
+    def __init__(self, Xd=256, dtype=np.float32):
+        ColorizeImageCaffe.__init__(self, Xd, dtype=dtype)
         self.dist_ab_set = False
         self.scale_S_layer = 'scale_S'
         self.dist_ab_S_layer = 'dist_ab_S'  # softened distribution layer
@@ -475,9 +923,9 @@ class ColorizeImageCaffeDist(ColorizeImageCaffe):
         self.AB = self.pts_grid.shape[0]  # 529
         self.A = int(np.sqrt(self.AB))  # 23
         self.B = int(np.sqrt(self.AB))  # 23
-        self.dist_ab_full = np.zeros((self.AB, self.Xd, self.Xd))
-        self.dist_ab_grid = np.zeros((self.A, self.B, self.Xd, self.Xd))
-        self.dist_entropy = np.zeros((self.Xd, self.Xd))
+        self.dist_ab_full = np.zeros((self.AB, self.Xd, self.Xd), dtype=self.dtype)
+        self.dist_ab_grid = np.zeros((self.A, self.B, self.Xd, self.Xd), dtype=self.dtype)
+        self.dist_entropy = np.zeros((self.Xd, self.Xd), dtype=self.dtype)
 
     def prep_net(self, gpu_id, prototxt_path='', caffemodel_path='', S=.2):
         ColorizeImageCaffe.prep_net(self, gpu_id, prototxt_path=prototxt_path, caffemodel_path=caffemodel_path)
@@ -508,43 +956,31 @@ class ColorizeImageCaffeDist(ColorizeImageCaffe):
         # return
         return function_return
 
-    def get_ab_reccs(self, h, w, K=5, N=25000, return_conf=False):
+    def get_ab_reccs(self, h, w, K=5, N=25000, return_conf=False, method='modes'):
         ''' Recommended colors at point (h,w)
         Call this after calling net_forward
+        method 'modes' clusters the predicted histogram directly (fast, deterministic),
+        'kmeans' runs KMeans on N points sampled from it
         '''
         if not self.dist_ab_set:
             print('Need to set prediction first')
             return 0
 
-        # randomly sample from pdf
-        cmf = np.cumsum(self.dist_ab[:, h, w])  # CMF
-        cmf = cmf / cmf[-1]
-        cmf_bins = cmf
-
-        # randomly sample N points
-        rnd_pts = np.random.uniform(low=0, high=1.0, size=N)
-        inds = np.digitize(rnd_pts, bins=cmf_bins)
-        rnd_pts_ab = self.pts_in_hull[inds, :]
-
-        # run k-means
-        kmeans = KMeans(n_clusters=K).fit(rnd_pts_ab)
-
-        # sort by cluster occupancy
-        k_label_cnt = np.histogram(kmeans.labels_, np.arange(0, K + 1))[0]
-        k_inds = np.argsort(k_label_cnt, axis=0)[::-1]
-
-        cluster_per = 1. * k_label_cnt[k_inds] / N  # percentage of points within cluster
-        cluster_centers = kmeans.cluster_centers_[k_inds, :]  # cluster centers
+        if method == 'kmeans':
+            cluster_centers, cluster_per = ab_reccs_kmeans(self.dist_ab[:, h, w], self.pts_in_hull, K=K, N=N)
+        else:
+            cluster_centers, cluster_per = ab_reccs_modes(self.dist_ab[:, h, w], self.pts_in_hull, K=K)
 
-        # cluster_centers = np.random.uniform(low=-100,high=100,size=(N,2))
         if return_conf:
             return cluster_centers, cluster_per
         else:
             return cluster_centers
 
-    def compute_entropy(self):
-        # compute the distribution entropy (really slow right now)
-        self.dist_entropy = np.sum(self.dist_ab * np.log(self.dist_ab), axis=0)
+    def compute_entropy(self, stride=1, normalize=False):
+        # entropy of the distribution at every stride-th pixel, XxX / stride
+        # (see data/uncertainty.py); higher is less certain
+        self.dist_entropy = entropy_map(self.dist_ab, stride=stride, normalize=normalize, dtype=self.dtype)
+        return self.dist_entropy
 
     def plot_dist_grid(self, h, w):
         # Plots distribution at a given point
@@ -557,5 +993,5 @@ class ColorizeImageCaffeDist(ColorizeImageCaffe):
     def plot_dist_entropy(self):
         # Plots distribution at a given point
         plt.figure()
-        plt.imshow(-self.dist_entropy, interpolation='nearest')
+        plt.imshow(self.dist_entropy, interpolation='nearest')
         plt.colorbar()
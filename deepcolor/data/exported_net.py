@@ -0,0 +1,167 @@
+''' SIGGRAPHGenerator exported to TorchScript or ONNX, for CPU inference
+
+The batched layer stack of siggraph_forward is traced into a standalone
+graph, once for each mode: 'color' (ab prediction) and 'dist' (ab prediction
+and distribution, at 1/4 of the image size). Graphs take mean-centered L,
+input ab and the mask, with any batch size and image size, and are saved as
+<prefix>_color.pt and <prefix>_dist.pt (TorchScript, frozen) or .onnx.
+
+TorchScript graphs are optimized for inference on load (conv/batchnorm
+folding, fused conv+relu with oneDNN). ONNX graphs run on onnxruntime with
+all graph optimizations on, which needs `pip install onnx onnxruntime`; this
+runtime is experimental (see tests/test_exported_net.py).
+
+See export_model.py to export and check a model. '''
+import os
+import threading
+
+import numpy as np
+import torch
+
+from .colorize_image import siggraph_graph
+
+RUNTIMES = ('torchscript', 'onnx')
+MODES = ('color', 'dist')
+EXTENSIONS = {'torchscript': '.pt', 'onnx': '.onnx'}
+INPUT_NAMES = ['input_A', 'input_B', 'mask_B']
+
+
+class SiggraphForward(torch.nn.Module):
+    ''' The layers of siggraph_forward as a module, for tracing '''
+
+    def __init__(self, net, dist=False):
+        super(SiggraphForward, self).__init__()
+        self.net = net
+        self.dist = dist
+
+    def forward(self, input_A, input_B, mask_B):
+        return siggraph_graph(self.net, input_A, input_B, mask_B, dist=self.dist)
+
+
+def exported_path(prefix, runtime, mode):
+    return '%s_%s%s' % (prefix, mode, EXTENSIONS[runtime])
+
+
+def example_inputs(batch_size=2, Xd=256, seed=0):
+    # random network inputs in their normal ranges
+    rng = np.random.RandomState(seed)
+    input_A = rng.uniform(-50, 50, size=(batch_size, 1, Xd, Xd))
+    input_B = rng.uniform(-110, 110, size=(batch_size, 2, Xd, Xd)) * (rng.uniform(size=(batch_size, 1, Xd, Xd)) < .01)
+    mask_B = (input_B[:, :1] != 0).astype(np.float32)
+    return [x.astype(np.float32) for x in (input_A, input_B, mask_B)]
+
+
+def export_torchscript(net, prefix, Xd=256):
+    ''' Trace and freeze net in both modes, returning {mode: path} '''
+    paths = {}
+    inputs = [torch.from_numpy(x) for x in example_inputs(Xd=Xd)]
+    for mode in MODES:
+        module = SiggraphForward(net.cpu(), dist=(mode == 'dist')).eval()
+        with torch.no_grad():
+            traced = torch.jit.trace(module, inputs, check_trace=False)
+        paths[mode] = exported_path(prefix, 'torchscript', mode)
+        torch.jit.save(torch.jit.freeze(traced), paths[mode])
+    return paths
+
+
+def export_onnx(net, prefix, Xd=256, opset=17):
+    ''' Export net in both modes, with dynamic batch and image size,
+    returning {mode: path} '''
+    paths = {}
+    inputs = tuple(torch.from_numpy(x) for x in example_inputs(Xd=Xd))
+    for mode in MODES:
+        module = SiggraphForward(net.cpu(), dist=(mode == 'dist')).eval()
+        output_names = ['out_reg', 'out_cl'] if mode == 'dist' else ['out_reg']
+        dynamic_axes = {name: {0: 'N', 2: 'H', 3: 'W'} for name in INPUT_NAMES + output_names}
+        paths[mode] = exported_path(prefix, 'onnx', mode)
+        with torch.no_grad():
+            torch.onnx.export(module, inputs, paths[mode], input_names=INPUT_NAMES, output_names=output_names,
+                              dynamic_axes=dynamic_axes, opset_version=opset, dynamo=False)
+    return paths
+
+
+class ExportedSiggraphNet():
+    ''' Exported color and dist graphs, run like siggraph_forward
+    Each graph is loaded on first use. num_threads sets the intra-op threads
+    of the runtime (0 leaves its default). '''
+
+    def __init__(self, prefix, runtime='torchscript', gpu_id=None, num_threads=0):
+        if runtime not in RUNTIMES:
+            raise ValueError('runtime must be one of %s, not %s' % (', '.join(RUNTIMES), runtime))
+        self.prefix = prefix
+        self.runtime = runtime
+        self.gpu_id = gpu_id
+        self.num_threads = num_threads
+        self._graphs = {}
+        self._lock = threading.Lock()
+        for mode in MODES:
+            if not os.path.exists(exported_path(prefix, runtime, mode)):
+                raise IOError('No exported graph at %s (see export_model.py)' % exported_path(prefix, runtime, mode))
+
+    def forward(self, input_A, input_B, mask_B, maskcent=0, dist=False):
+        ''' INPUTS and OUTPUTS as for siggraph_forward '''
+        graph = self._graph('dist' if dist else 'color')
+        inputs = [np.ascontiguousarray(x, dtype=np.float32) for x in (input_A, input_B, mask_B)]
+        inputs[2] = inputs[2] - np.float32(maskcent)
+
+        if self.runtime == 'onnx':
+            outputs = graph.run(None, dict(zip(INPUT_NAMES, inputs)))
+        else:
+            device = 'cpu' if self.gpu_id is None else 'cuda:%d' % self.gpu_id
+            with torch.inference_mode():
+                outputs = graph(*[torch.from_numpy(x).to(device) for x in inputs])
+            outputs = [output.cpu().numpy() for output in (outputs if dist else [outputs])]
+        return tuple(outputs) if dist else outputs[0]
+
+    # ***** Private functions *****
+    def _graph(self, mode):
+        with self._lock:
+            if mode not in self._graphs:
+                self._graphs[mode] = self._load(exported_path(self.prefix, self.runtime, mode))
+            return self._graphs[mode]
+
+    def _load(self, path):
+        print('Loading %s graph %s' % (self.runtime, path))
+        if self.runtime == 'onnx':
+            import onnxruntime as ort
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if self.num_threads > 0:
+                options.intra_op_num_threads = self.num_threads
+            providers = ['CPUExecutionProvider'] if self.gpu_id is None else ['CUDAExecutionProvider', 'CPUExecutionProvider']
+            return ort.InferenceSession(path, options, providers=providers)
+
+        if self.num_threads > 0:
+            torch.set_num_threads(self.num_threads)
+        if self.gpu_id is None:
+            return torch.jit.optimize_for_inference(torch.jit.load(path, map_location='cpu'))
+        return torch.jit.load(path, map_location='cuda:%d' % self.gpu_id)
+
+
+_exported_nets = {}  # (prefix, runtime, gpu_id) -> ExportedSiggraphNet
+_exported_nets_lock = threading.Lock()
+
+
+def load_exported_net(prefix, runtime='torchscript', gpu_id=None, num_threads=0):
+    ''' ExportedSiggraphNet for prefix, once per process, so the color and
+    distribution views share it (as load_siggraph_net) '''
+    key = (os.path.abspath(prefix), runtime, gpu_id)
+    with _exported_nets_lock:
+        if key not in _exported_nets:
+            _exported_nets[key] = ExportedSiggraphNet(prefix, runtime=runtime, gpu_id=gpu_id, num_threads=num_threads)
+        return _exported_nets[key]
+
+
+def check_parity(net, exported, batch_size=2, Xd=256, seed=0, maskcent=0):
+    ''' Largest differences between the eager net and an exported one on
+    random inputs: {'color_reg', 'dist_reg' (ab units), 'dist_cl' (probability)} '''
+    from .colorize_image import siggraph_forward
+    inputs = example_inputs(batch_size=batch_size, Xd=Xd, seed=seed)
+    diffs = {}
+    reg = siggraph_forward(net, *inputs, maskcent=maskcent)
+    diffs['color_reg'] = float(np.abs(exported.forward(*inputs, maskcent=maskcent) - reg).max())
+    reg, cl = siggraph_forward(net, *inputs, maskcent=maskcent, dist=True)
+    reg_x, cl_x = exported.forward(*inputs, maskcent=maskcent, dist=True)
+    diffs['dist_reg'] = float(np.abs(reg_x - reg).max())
+    diffs['dist_cl'] = float(np.abs(cl_x - cl).max())
+    return diffs
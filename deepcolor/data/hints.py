@@ -0,0 +1,93 @@
+import numpy as np
+from skimage import color
+
+# largest hint radius, in pixels of the network input; a hint's kernel has
+# (2r+1)^2 offsets, so larger radii are clipped to keep memory bounded
+MAX_HINT_RADIUS = 64
+
+
+def hint_kernel(radius, shape='disk', falloff='linear'):
+    ''' Pixel offsets and mask weights of one hint
+        shape     'disk' or 'square'
+        falloff   'linear' (1 - d/radius), 'gaussian' or 'none'
+        OUTPUTS
+            dy, dx, weight   M each '''
+    r = int(radius)
+    dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+    dy = dy.flatten()
+    dx = dx.flatten()
+    if shape == 'square':
+        d = np.maximum(np.abs(dy), np.abs(dx)).astype(np.float64)
+    else:
+        d = np.sqrt(dy**2 + dx**2)
+    keep = d <= r
+    dy, dx, d = dy[keep], dx[keep], d[keep]
+
+    if falloff == 'none' or r == 0:
+        weight = np.ones_like(d)
+    elif falloff == 'gaussian':
+        weight = np.exp(-d**2 / (2 * (r / 2.)**2))
+    else:
+        weight = 1. - d / r
+    return dy, dx, weight
+
+
+def rasterize_hints(xy, rgb, size, alpha=None, radius=3, shape='disk', falloff='linear', dtype=np.float32):
+    ''' Paint point hints into network inputs
+    Where hints overlap, the mask keeps the largest weight and the ab of the
+    later hint wins.
+        INPUTS
+            xy        Nx2       pixel coordinates (x, y) of the hint centers
+            rgb       Nx3       hint colors, uint8
+            size      int or (H, W) of the network input
+            alpha     N         color intensity in [0, 1], scales ab (default 1)
+            radius    int or N  hint radius in pixels, per hint or for all,
+                                clipped to [0, MAX_HINT_RADIUS]
+            dtype     of the outputs
+        OUTPUTS
+            input_ab      2xHxW
+            input_mask    1xHxW '''
+    H, W = (size, size) if np.isscalar(size) else size
+    input_ab = np.zeros((2, H, W), dtype=dtype)
+    input_mask = np.zeros((1, H, W), dtype=dtype)
+    N = len(xy)
+    if N == 0:
+        return input_ab, input_mask
+
+    xy = np.asarray(xy, dtype=np.int64).reshape((N, 2))
+    x = np.clip(xy[:, 0], 0, W - 1)
+    y = np.clip(xy[:, 1], 0, H - 1)
+
+    # convert all hint colors at once
+    lab = color.rgb2lab(np.asarray(rgb, dtype=np.uint8).reshape((1, N, 3)))[0]
+    ab = lab[:, 1:]
+    if alpha is not None:
+        ab = ab * np.clip(np.asarray(alpha, dtype=np.float64), 0, 1)[:, np.newaxis]
+
+    radii = np.clip(np.broadcast_to(np.asarray(radius, dtype=np.int64), (N,)), 0, MAX_HINT_RADIUS)
+    pix = []
+    weights = []
+    order = []
+    for r in np.unique(radii):
+        inds = np.where(radii == r)[0]
+        dy, dx, weight = hint_kernel(r, shape=shape, falloff=falloff)
+        ys = y[inds, np.newaxis] + dy[np.newaxis, :]
+        xs = x[inds, np.newaxis] + dx[np.newaxis, :]
+        valid = (ys >= 0) & (ys < H) & (xs >= 0) & (xs < W)
+        pix.append((ys * W + xs)[valid])
+        weights.append(np.broadcast_to(weight, ys.shape)[valid])
+        order.append(np.broadcast_to(inds[:, np.newaxis], ys.shape)[valid])
+    pix = np.concatenate(pix)
+    weights = np.concatenate(weights)
+    order = np.concatenate(order)
+
+    mask_flat = input_mask.reshape(-1)
+    np.maximum.at(mask_flat, pix, weights)
+
+    # last hint covering a pixel sets its ab
+    winner = np.full(H * W, -1, dtype=np.int64)
+    np.maximum.at(winner, pix, order)
+    covered = np.where(winner >= 0)[0]
+    ab_flat = input_ab.reshape((2, -1))
+    ab_flat[:, covered] = ab[winner[covered]].T
+    return input_ab, input_mask
@@ -0,0 +1,204 @@
+import json
+import threading
+import time
+import uuid
+
+from .sqlite_util import SQLiteDB
+
+
+class JobQueue():
+    ''' Batch colorization jobs in SQLite, shared by all processes on a host
+    A job is a list of items (one input image each). Workers claim pending
+    items one at a time and hold them for stale_after seconds, renewed with
+    heartbeat() while they work; items whose lease runs out (e.g. because the
+    worker died) are handed out again. '''
+
+    def __init__(self, path, stale_after=10 * 60):
+        self.stale_after = stale_after
+        self._db = SQLiteDB(path, '''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY, created REAL, cancelled INTEGER DEFAULT 0, options TEXT);
+            CREATE TABLE IF NOT EXISTS items (
+                job_id TEXT, idx INTEGER, name TEXT, image_hash TEXT,
+                status TEXT, claimed REAL, finished REAL, result_hash TEXT, error TEXT,
+                PRIMARY KEY (job_id, idx));
+            CREATE INDEX IF NOT EXISTS items_status ON items (status, claimed);
+        ''')
+
+    def create(self, items, options=None, job_id=None):
+        ''' Queue a job of items [(name, image_hash), ...], returning its id '''
+        if job_id is None:
+            job_id = str(uuid.uuid4())
+        with self._db.transaction() as db:
+            db.execute('INSERT INTO jobs (id, created, options) VALUES (?, ?, ?)',
+                       (job_id, time.time(), json.dumps(options or {})))
+            db.executemany('INSERT INTO items (job_id, idx, name, image_hash, status) VALUES (?, ?, ?, ?, ?)',
+                           [(job_id, i, name, image_hash, 'pending') for i, (name, image_hash) in enumerate(items)])
+        return job_id
+
+    def claim(self):
+        ''' Mark the oldest pending item running and return it, or None '''
+        now = time.time()
+        with self._db.transaction() as db:
+            row = db.execute(
+                'SELECT items.job_id, idx, name, image_hash, options FROM items JOIN jobs ON jobs.id=items.job_id '
+                'WHERE (status=\'pending\' OR (status=\'running\' AND claimed < ?)) AND NOT cancelled '
+                'ORDER BY jobs.created, idx LIMIT 1', (now - self.stale_after,)).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE items SET status=\'running\', claimed=? WHERE job_id=? AND idx=?', (now, row[0], row[1]))
+        return {
+            'job_id': row[0],
+            'index': row[1],
+            'name': row[2],
+            'image_hash': row[3],
+            'options': json.loads(row[4]),
+        }
+
+    def heartbeat(self, items):
+        ''' Renew the lease of running items [(job_id, index), ...] '''
+        now = time.time()
+        with self._db.transaction() as db:
+            db.executemany('UPDATE items SET claimed=? WHERE job_id=? AND idx=? AND status=\'running\'',
+                           [(now, job_id, index) for job_id, index in items])
+
+    def finish(self, job_id, index, result_hash=None, error=None):
+        status = 'failed' if error is not None else 'done'
+        with self._db.transaction() as db:
+            db.execute('UPDATE items SET status=?, finished=?, result_hash=?, error=? WHERE job_id=? AND idx=?',
+                       (status, time.time(), result_hash, error, job_id, index))
+
+    def exists(self, job_id):
+        with self._db.read() as db:
+            return db.execute('SELECT 1 FROM jobs WHERE id=?', (job_id,)).fetchone() is not None
+
+    def job(self, job_id):
+        ''' Status of a job and its items, or None if there is no such job '''
+        with self._db.read() as db:
+            job = db.execute('SELECT created, cancelled FROM jobs WHERE id=?', (job_id,)).fetchone()
+            if job is None:
+                return None
+            rows = db.execute('SELECT idx, name, status, result_hash, error FROM items WHERE job_id=? ORDER BY idx',
+                              (job_id,)).fetchall()
+        items = [{'index': idx, 'name': name, 'status': status, 'result_hash': result_hash, 'error': error}
+                 for idx, name, status, result_hash, error in rows]
+        counts = {status: 0 for status in ('pending', 'running', 'done', 'failed')}
+        for item in items:
+            counts[item['status']] += 1
+
+        if job[1]:
+            status = 'cancelled'
+        elif counts['pending'] + counts['running'] == 0:
+            status = 'finished'
+        elif counts['running'] + counts['done'] + counts['failed'] == 0:
+            status = 'queued'
+        else:
+            status = 'running'
+        return {
+            'job_id': job_id,
+            'status': status,
+            'created': job[0],
+            'total': len(items),
+            'done': counts['done'],
+            'failed': counts['failed'],
+            'progress': (counts['done'] + counts['failed']) / max(len(items), 1),
+            'items': items,
+        }
+
+    def cancel(self, job_id):
+        ''' Stop handing out the job's pending items. Returns False if there
+        is no such job. '''
+        with self._db.transaction() as db:
+            return db.execute('UPDATE jobs SET cancelled=1 WHERE id=?', (job_id,)).rowcount > 0
+
+    def delete(self, job_id):
+        ''' Remove a job, returning its items as for job() (None if unknown) '''
+        job = self.job(job_id)
+        if job is not None:
+            with self._db.transaction() as db:
+                db.execute('DELETE FROM items WHERE job_id=?', (job_id,))
+                db.execute('DELETE FROM jobs WHERE id=?', (job_id,))
+        return job
+
+    def expired(self, ttl):
+        ''' Ids of jobs created more than ttl seconds ago '''
+        with self._db.read() as db:
+            rows = db.execute('SELECT id FROM jobs WHERE created < ?', (time.time() - ttl,)).fetchall()
+        return [row[0] for row in rows]
+
+    def stats(self):
+        with self._db.read() as db:
+            jobs = db.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+            rows = db.execute('SELECT status, COUNT(*) FROM items GROUP BY status').fetchall()
+        stats = {'jobs': jobs, 'pending': 0, 'running': 0, 'done': 0, 'failed': 0}
+        stats.update(dict(rows))
+        return stats
+
+    def close(self):
+        self._db.close()
+
+
+class JobWorkerPool():
+    ''' Threads that run process(item) -> result_hash on claimed queue items
+    Workers wake up on notify() (for jobs queued by this process) or every
+    poll_interval seconds (for jobs queued by other processes). The leases of
+    the items being processed are renewed four times per queue.stale_after,
+    however long they take. '''
+
+    def __init__(self, queue, process, num_workers=2, poll_interval=1.):
+        self.queue = queue
+        self.process = process
+        self.poll_interval = poll_interval
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._closed = False
+        self._running = set()  # (job_id, index) being processed
+        self._running_lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._run, name='job-worker-%d' % i, daemon=True)
+                         for i in range(num_workers)]
+        self._threads.append(threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def notify(self):
+        self._wake.set()
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+    # ***** Private functions *****
+    def _run(self):
+        while not self._closed:
+            item = self.queue.claim()
+            if item is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            key = (item['job_id'], item['index'])
+            with self._running_lock:
+                self._running.add(key)
+            try:
+                result_hash = self.process(item)
+            except Exception as e:
+                print('Job %s item %d failed: %s' % (item['job_id'], item['index'], e))
+                self.queue.finish(item['job_id'], item['index'], error=str(e))
+            else:
+                self.queue.finish(item['job_id'], item['index'], result_hash=result_hash)
+            finally:
+                with self._running_lock:
+                    self._running.discard(key)
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.queue.stale_after / 4.):
+            with self._running_lock:
+                running = list(self._running)
+            if running:
+                try:
+                    self.queue.heartbeat(running)
+                except Exception as e:
+                    print('Job heartbeat failed: %s' % e)
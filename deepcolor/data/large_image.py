@@ -0,0 +1,215 @@
+''' Colorization of very large images with bounded memory
+
+Only the network-sized image is kept for the network. The full resolution L channel
+is computed strip by strip from the source, combined with the upsampled ab
+prediction, and written out strip by strip.
+'''
+import os
+import struct
+import tempfile
+import zlib
+
+import cv2
+import numpy as np
+from scipy.ndimage import zoom
+
+from .colorize_image import upsample_ab_cols, upsample_ab_rows, lab2rgb_rows
+
+
+class ImageSource():
+    ''' Full resolution rgb rows of an image file, without float copies
+    .npy files (HxWx3 uint8 RGB) are memory-mapped, anything else is decoded
+    once with OpenCV into uint8. '''
+
+    def __init__(self, path):
+        if path.lower().endswith('.npy'):
+            self.data = np.load(path, mmap_mode='r')
+            self.bgr = False
+        else:
+            self.data = cv2.imread(path, cv2.IMREAD_COLOR)
+            if self.data is None:
+                raise IOError('Could not read image %s' % path)
+            self.bgr = True
+        self.height, self.width = self.data.shape[:2]
+
+    def rows(self, r0, r1):
+        # rgb uint8 (r1-r0)xWx3
+        strip = np.asarray(self.data[r0:r1])
+        if self.bgr:
+            return cv2.cvtColor(strip, cv2.COLOR_BGR2RGB)
+        return strip
+
+    def limit(self, max_side):
+        # shrink the image so its longer side is at most max_side
+        if max(self.height, self.width) > max_side:
+            self.data = limit_size(self.rows(0, self.height), max_side)
+            self.bgr = False
+            self.height, self.width = self.data.shape[:2]
+
+    def resized(self, shape):
+        # whole image resized to shape (H, W), as load_image does
+        im = cv2.resize(np.asarray(self.data), (shape[1], shape[0]))
+        if self.bgr:
+            im = cv2.cvtColor(im, cv2.COLOR_BGR2RGB)
+        return im
+
+
+class PNGStripWriter():
+    ''' Writes an 8-bit RGB PNG a strip of rows at a time '''
+
+    def __init__(self, path, width, height, level=6):
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self._prev_row = np.zeros((width * 3,), dtype=np.uint8)
+        self._compress = zlib.compressobj(level)
+        self._file_path = path
+        self._file = open(path, 'wb')
+        self._file.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+
+    def write(self, strip):
+        # strip is hxWx3 uint8 RGB
+        rows = np.ascontiguousarray(strip, dtype=np.uint8).reshape((strip.shape[0], self.width * 3))
+        # 'Up' filter: each row minus the one above, modulo 256
+        prev = np.concatenate((self._prev_row[np.newaxis], rows[:-1]), axis=0)
+        filtered = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 2
+        filtered[:, 1:] = rows - prev
+        self._prev_row = rows[-1].copy()
+        self.rows_written += rows.shape[0]
+
+        data = self._compress.compress(filtered.tobytes())
+        if data:
+            self._chunk(b'IDAT', data)
+
+    def close(self):
+        if self._file is None:
+            return
+        if self.rows_written != self.height:
+            self._file.close()
+            self._file = None
+            raise ValueError('Wrote %d of %d rows' % (self.rows_written, self.height))
+        self._chunk(b'IDAT', self._compress.flush())
+        self._chunk(b'IEND', b'')
+        self._file.close()
+        self._file = None
+
+    def abort(self):
+        # drop the partial file
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.remove(self._file_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def _chunk(self, kind, data):
+        self._file.write(struct.pack('>I', len(data)))
+        self._file.write(kind)
+        self._file.write(data)
+        self._file.write(struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+
+class MemmapWriter():
+    ''' For formats OpenCV can only encode whole (JPEG, WebP): strips go into a
+    disk-backed buffer, which is encoded at the end, so the output never needs
+    to be held in anonymous memory. '''
+
+    def __init__(self, path, width, height, params=()):
+        self.path = path
+        self.params = list(params)
+        self._tmp = tempfile.NamedTemporaryFile(suffix='.rgb', dir=os.path.dirname(os.path.abspath(path)), delete=False)
+        self._tmp.close()
+        self.buffer = np.memmap(self._tmp.name, dtype=np.uint8, mode='w+', shape=(height, width, 3))
+        self.rows_written = 0
+
+    def write(self, strip):
+        self.buffer[self.rows_written:self.rows_written + strip.shape[0]] = strip[:, :, ::-1]  # stored as BGR
+        self.rows_written += strip.shape[0]
+
+    def close(self):
+        if self.buffer is None:
+            return
+        try:
+            self.buffer.flush()
+            if not cv2.imwrite(self.path, self.buffer, self.params):
+                raise IOError('Could not write %s' % self.path)
+        finally:
+            self.abort()
+
+    def abort(self):
+        # drop the buffer without encoding it
+        if self.buffer is not None:
+            del self.buffer
+            self.buffer = None
+            os.remove(self._tmp.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+def open_writer(path, width, height, jpeg_quality=95):
+    if path.lower().endswith('.png'):
+        return PNGStripWriter(path, width, height)
+    if path.lower().endswith(('.jpg', '.jpeg')):
+        return MemmapWriter(path, width, height, (cv2.IMWRITE_JPEG_QUALITY, jpeg_quality))
+    return MemmapWriter(path, width, height)
+
+
+def limit_size(rgb, max_side):
+    ''' rgb (HxWx3 uint8) shrunk so its longer side is at most max_side, the
+    way ColorizeImageBase applies Xfullres_max (or rgb itself if it fits) '''
+    if max(rgb.shape[:2]) <= max_side:
+        return rgb
+    factor = 1. * max_side / max(rgb.shape[:2])
+    return zoom(rgb, (factor, factor, 1), order=1)
+
+
+def strip_l(rgb):
+    # L channel [0,100] of an rgb uint8 strip, in float32
+    return cv2.cvtColor(rgb.astype(np.float32) / 255., cv2.COLOR_RGB2Lab)[:, :, 0]
+
+
+def colorize_large_image(model, input_path, output_path, input_ab=None, input_mask=None, strip_rows=256, jpeg_quality=95):
+    ''' Colorize input_path into output_path at full resolution (at most
+    model.Xfullres_max on the longer side, as get_img_fullres), with peak
+    memory bounded by the uint8 source and a few strips
+        INPUTS
+            model                  ColorizeImageTorch (or other ColorizeImageBase with a net)
+            input_ab, input_mask   hints, as for net_forward (default none)
+        OUTPUTS
+            returned value is the (H, W) of the output '''
+    source = ImageSource(input_path)
+    H, W = source.height, source.width
+
+    shape = model.inference_shape(H, W)
+    model.set_image_lowres(source.resized(shape))
+    source.limit(model.Xfullres_max)
+    H, W = source.height, source.width
+    if input_ab is None:
+        input_ab = np.zeros((2,) + shape, dtype=model.dtype)
+    if input_mask is None:
+        input_mask = np.zeros((1,) + shape, dtype=model.dtype)
+    model.net_forward(input_ab, input_mask)
+
+    ab_cols = upsample_ab_cols(model.output_ab, W)
+    with open_writer(output_path, W, H, jpeg_quality=jpeg_quality) as writer:
+        for r0 in range(0, H, strip_rows):
+            r1 = min(H, r0 + strip_rows)
+            img_l = strip_l(source.rows(r0, r1))
+            writer.write(lab2rgb_rows(img_l, upsample_ab_rows(ab_cols, H, r0, r1)))
+    return H, W
@@ -0,0 +1,158 @@
+''' Lightweight latency metrics, in the Prometheus text exposition format
+
+Histograms are a fixed set of cumulative bucket counters under a lock, so
+observing a value costs a few microseconds and can stay on all the time.
+Stage timers also record into the active trace, if any, so a slow request
+can log where its time went. '''
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# seconds
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30.)
+
+
+class Histogram():
+    ''' Counts of observed values per bucket, plus their sum and count '''
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last is +Inf
+        self.sum = 0.
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        # (cumulative counts per bucket and +Inf, sum, count)
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative = []
+        running = 0
+        for c in counts:
+            running += c
+            cumulative.append(running)
+        return cumulative, total, count
+
+
+class MetricsRegistry():
+    ''' Histograms by name and labels, and collectors of other values
+    A collector is a function returning [(name, type, help, [(labels, value)])],
+    called on render, for values kept elsewhere (queue depths, cache sizes). '''
+
+    def __init__(self):
+        self._histograms = {}  # name -> (help, buckets, {labels: Histogram})
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = (help_text, buckets, {})
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self._histograms[name][2]
+        histogram = series.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = series.setdefault(key, Histogram(self._histograms[name][1]))
+        histogram.observe(value)
+
+    def add_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        ''' All metrics in the Prometheus text format (version 0.0.4) '''
+        lines = []
+        with self._lock:
+            histograms = [(name, help_text, buckets, list(series.items()))
+                          for name, (help_text, buckets, series) in sorted(self._histograms.items())]
+            collectors = list(self._collectors)
+
+        for name, help_text, buckets, series in histograms:
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s histogram' % name)
+            for labels, histogram in sorted(series):
+                cumulative, total, count = histogram.snapshot()
+                for le, c in zip([_format_value(b) for b in buckets] + ['+Inf'], cumulative):
+                    lines.append('%s_bucket%s %d' % (name, _format_labels(labels + (('le', le),)), c))
+                lines.append('%s_sum%s %s' % (name, _format_labels(labels), _format_value(total)))
+                lines.append('%s_count%s %d' % (name, _format_labels(labels), count))
+
+        for collector in collectors:
+            for name, kind, help_text, samples in collector():
+                lines.append('# HELP %s %s' % (name, help_text))
+                lines.append('# TYPE %s %s' % (name, kind))
+                for labels, value in samples:
+                    lines.append('%s%s %s' % (name, _format_labels(tuple(sorted(labels.items()))), _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+REGISTRY.histogram('deepcolor_stage_seconds', 'Time spent in each stage of colorization.')
+
+# [(stage, seconds)] of the request being handled in this context, if traced
+_trace = contextvars.ContextVar('deepcolor_trace', default=None)
+
+
+@contextmanager
+def stage_timer(stage):
+    ''' Time a block as stage, into deepcolor_stage_seconds and the trace '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        REGISTRY.observe('deepcolor_stage_seconds', elapsed, stage=stage)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((stage, elapsed))
+
+
+def timed(stage):
+    ''' Decorator form of stage_timer '''
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_trace():
+    ''' Start collecting stage timings in this context; returns the token
+    for end_trace '''
+    return _trace.set([])
+
+
+def end_trace(token):
+    ''' Stop collecting, returning the [(stage, seconds)] recorded '''
+    trace = _trace.get()
+    _trace.reset(token)
+    return trace or []
+
+
+# ***** Private functions *****
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = ('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for k, v in labels)
+    return '{%s}' % ','.join(escaped)
@@ -0,0 +1,88 @@
+''' int8 post-training quantization of SIGGRAPHGenerator, for CPU inference
+
+The convolution stack is quantized statically (FX graph mode): activation
+ranges are calibrated by running the network on real images with hints
+taken from their own colors, and weights are int8 per channel. The small
+output heads (the 1x1 ab conv, and the distribution's conv and softmax)
+stay in float32, so the ab prediction and the probabilities keep their
+resolution.
+
+Quantized networks are saved as frozen TorchScript graphs in the layout of
+data/exported_net.py, and run with ColorizeImageExported(Dist) and
+runtime 'torchscript'. See quantize_model.py. '''
+import copy
+import os
+
+import numpy as np
+import torch
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+from .colorize_image import ColorizeImageBase
+from .exported_net import MODES, SiggraphForward, example_inputs, exported_path
+from .hints import rasterize_hints
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+FLOAT_MODULES = ('net.model_out', 'net.model_class', 'net.softmax')
+
+
+def calibration_images(image_dir, max_images=0):
+    ''' Paths of the images in image_dir, sorted (the first max_images, if set) '''
+    paths = sorted(os.path.join(image_dir, name) for name in os.listdir(image_dir)
+                   if name.lower().endswith(IMAGE_EXTENSIONS))
+    return paths[:max_images] if max_images > 0 else paths
+
+
+def calibration_batches(model, paths, num_hints=(0, 5, 20), seed=0):
+    ''' Network inputs for calibration: each image with no hints and with
+    some, their colors taken from the image itself
+        INPUTS
+            model      a ColorizeImageTorch, for its preprocessing
+            paths      images to use
+        OUTPUTS
+            yields (img_l_mc, input_ab_mc, input_mask_mult), each 1xCxXdxXd float32 '''
+    rng = np.random.RandomState(seed)
+    engine = model.fork()
+    for path in paths:
+        engine.load_image(path)
+        H, W = engine.img_l.shape[1:]
+        for n in num_hints:
+            xy = np.stack((rng.randint(0, W, size=n), rng.randint(0, H, size=n)), axis=1)
+            rgb = engine.img_rgb[xy[:, 1], xy[:, 0]]
+            input_ab, input_mask = rasterize_hints(xy, rgb, (H, W))
+            # only the input preparation, not the forward pass
+            ColorizeImageBase.net_forward(engine, input_ab, input_mask)
+            yield tuple(np.ascontiguousarray(x[np.newaxis], dtype=np.float32)
+                        for x in (engine.img_l_mc, engine.input_ab_mc, engine.input_mask_mult))
+
+
+def quantize_siggraph_net(net, batches, dist=False, maskcent=0, backend='x86'):
+    ''' int8 copy of net in one mode, calibrated on batches (as from
+    calibration_batches). Returns a GraphModule with the inputs and
+    outputs of SiggraphForward. '''
+    torch.backends.quantized.engine = backend
+    module = SiggraphForward(copy.deepcopy(net).cpu(), dist=dist).eval()
+    qconfig_mapping = get_default_qconfig_mapping(backend)
+    for name in FLOAT_MODULES:
+        qconfig_mapping.set_module_name(name, None)
+
+    example = tuple(torch.from_numpy(x) for x in example_inputs(batch_size=1, Xd=64))
+    prepared = prepare_fx(module, qconfig_mapping, example)
+    with torch.no_grad():
+        for img_l_mc, input_ab_mc, input_mask_mult in batches:
+            prepared(torch.from_numpy(img_l_mc), torch.from_numpy(input_ab_mc),
+                     torch.from_numpy(input_mask_mult - np.float32(maskcent)))
+    return convert_fx(prepared)
+
+
+def save_quantized(quantized, prefix, Xd=256):
+    ''' Save {mode: quantized GraphModule} as TorchScript graphs at prefix,
+    returning {mode: path} '''
+    paths = {}
+    inputs = [torch.from_numpy(x) for x in example_inputs(batch_size=1, Xd=Xd)]
+    for mode in MODES:
+        with torch.no_grad():
+            traced = torch.jit.trace(quantized[mode], inputs, check_trace=False)
+        paths[mode] = exported_path(prefix, 'torchscript', mode)
+        torch.jit.save(torch.jit.freeze(traced.eval()), paths[mode])
+    return paths
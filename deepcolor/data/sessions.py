@@ -0,0 +1,160 @@
+import json
+import threading
+import time
+
+from .cache import LRUCache
+from .sqlite_util import SQLiteDB
+
+
+class MemorySessionRegistry():
+    ''' Sessions of one process, in an LRU bounded by count
+    Sessions idle for more than ttl seconds expire. on_evict(session_id,
+    record) is called for every session that expires or is evicted. '''
+
+    def __init__(self, max_sessions=10000, ttl=24 * 60 * 60, on_evict=None):
+        self.ttl = ttl
+        self._sessions = LRUCache(max_bytes=max_sessions, ttl=ttl, sizeof=lambda record: 1, on_evict=on_evict)
+
+    def get(self, session_id):
+        record = self._sessions.get(session_id)
+        if record is not None:
+            # restart the idle timer
+            self._sessions.put(session_id, record)
+        return record
+
+    def put(self, session_id, record):
+        self._sessions.put(session_id, record)
+
+    def pop(self, session_id):
+        return self._sessions.pop(session_id)
+
+    def stats(self):
+        stats = self._sessions.stats()
+        return {
+            'backend': 'memory',
+            'sessions': stats['entries'],
+            'max_sessions': stats['max_bytes'],
+            'ttl': self.ttl,
+            'evictions': stats['evictions'],
+        }
+
+
+class SQLiteSessionRegistry():
+    ''' Sessions in a SQLite database, shared by all processes on a host
+    Same behaviour as MemorySessionRegistry; records must be JSON-serializable.
+    Lookups only read. The access times they refresh are kept in the process
+    and written in one transaction every touch_interval seconds (on a later
+    get), on put, and on close, so idle times are only exact to within
+    touch_interval. Evictions, of expired sessions too, happen on put, in
+    whichever process adds the session. '''
+
+    def __init__(self, path, max_sessions=10000, ttl=24 * 60 * 60, on_evict=None, touch_interval=60):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.touch_interval = touch_interval
+        self.evictions = 0
+
+        self._touched = {}  # session_id -> last access not yet written
+        self._touch_lock = threading.Lock()
+        self._last_flush = time.time()
+
+        self._db = SQLiteDB(path, '''
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY, record TEXT, last_access REAL);
+            CREATE INDEX IF NOT EXISTS sessions_lru ON sessions (last_access);
+        ''')
+
+    def get(self, session_id):
+        with self._db.read() as db:
+            row = db.execute('SELECT record, last_access FROM sessions WHERE id=?', (session_id,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        with self._touch_lock:
+            if self._expired(max(row[1], self._touched.get(session_id, row[1]))):
+                # left for the next put to evict
+                return None
+            self._touched[session_id] = now
+            flush = now - self._last_flush >= self.touch_interval
+        if flush:
+            self.flush()
+        return json.loads(row[0])
+
+    def put(self, session_id, record):
+        with self._db.transaction() as db:
+            # written first, so sessions used since the last flush aren't evicted
+            self._write_touches(db)
+            db.execute('INSERT OR REPLACE INTO sessions (id, record, last_access) VALUES (?, ?, ?)',
+                       (session_id, json.dumps(record), time.time()))
+            evicted = self._evict(db)
+        self._notify(evicted)
+
+    def flush(self):
+        ''' Write the access times refreshed by get since the last flush '''
+        with self._db.transaction() as db:
+            self._write_touches(db)
+
+    def pop(self, session_id):
+        with self._touch_lock:
+            self._touched.pop(session_id, None)
+        with self._db.transaction() as db:
+            row = db.execute('SELECT record FROM sessions WHERE id=?', (session_id,)).fetchone()
+            if row is None:
+                return None
+            db.execute('DELETE FROM sessions WHERE id=?', (session_id,))
+        return json.loads(row[0])
+
+    def stats(self):
+        with self._db.read() as db:
+            sessions = db.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+        return {
+            'backend': 'sqlite',
+            'sessions': sessions,
+            'max_sessions': self.max_sessions,
+            'ttl': self.ttl,
+            'evictions': self.evictions,
+        }
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+    # ***** Private functions *****
+    def _expired(self, last_access):
+        return self.ttl is not None and time.time() - last_access > self.ttl
+
+    def _write_touches(self, db):
+        with self._touch_lock:
+            touched, self._touched = self._touched, {}
+            self._last_flush = time.time()
+        # never moves an access time back, if another process wrote a later one
+        db.executemany('UPDATE sessions SET last_access=MAX(last_access, ?) WHERE id=?',
+                       [(last_access, session_id) for session_id, last_access in touched.items()])
+
+    def _evict(self, db):
+        # expired sessions, then the least recently used ones over the cap
+        cutoff = time.time() - self.ttl if self.ttl is not None else float('-inf')
+        rows = db.execute('SELECT id, record FROM sessions WHERE last_access < ?', (cutoff,)).fetchall()
+        over = db.execute('SELECT COUNT(*) FROM sessions').fetchone()[0] - len(rows) - self.max_sessions
+        if over > 0:
+            rows += db.execute('SELECT id, record FROM sessions WHERE last_access >= ? ORDER BY last_access LIMIT ?',
+                               (cutoff, over)).fetchall()
+        db.executemany('DELETE FROM sessions WHERE id=?', [(row[0],) for row in rows])
+        self.evictions += len(rows)
+        return [(session_id, json.loads(record)) for session_id, record in rows]
+
+    def _notify(self, evicted):
+        # called outside the transaction, so callbacks may use the registry
+        if self.on_evict is not None:
+            for session_id, record in evicted:
+                self.on_evict(session_id, record)
+
+
+def open_session_registry(backend, path=None, max_sessions=10000, ttl=24 * 60 * 60, on_evict=None):
+    ''' backend is 'memory' or 'sqlite' (at path) '''
+    if backend == 'memory':
+        return MemorySessionRegistry(max_sessions=max_sessions, ttl=ttl, on_evict=on_evict)
+    if backend == 'sqlite':
+        return SQLiteSessionRegistry(path, max_sessions=max_sessions, ttl=ttl, on_evict=on_evict)
+    raise ValueError('Unknown session backend %s' % backend)
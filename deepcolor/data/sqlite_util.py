@@ -0,0 +1,49 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class SQLiteDB():
+    ''' A SQLite database shared by all processes on a host, through one
+    connection per process (serialized between its threads)
+    The database is in WAL mode, so readers don't block the writer. Writes go
+    through transaction(); reads that write nothing use read(), which takes no
+    write lock. '''
+
+    def __init__(self, path, schema):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            # with WAL, only the last commits can be lost on power failure,
+            # never consistency
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.executescript(schema)
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, serializing writers
+        # across processes (a deferred one could fail to upgrade midway)
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    @contextmanager
+    def read(self):
+        # deferred: a consistent snapshot for the queries inside, without
+        # waiting for (or holding up) writers
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                yield self._db
+            finally:
+                self._db.execute('COMMIT')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
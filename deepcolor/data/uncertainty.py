@@ -0,0 +1,58 @@
+''' Where the colorization is least sure: entropy of the predicted ab distribution
+
+A pixel whose distribution has one sharp peak will keep its color whatever
+the user does; one spread over many colors is where a hint helps most. '''
+import numpy as np
+
+
+def entropy_map(dist_ab, stride=1, normalize=True, chunk_rows=32, dtype=np.float32):
+    ''' Entropy -sum(p log p) of the distribution at every stride-th pixel
+    The distribution is renormalized per pixel (it may be stored in float16),
+    and p=0 contributes 0. Computed a few rows at a time, so the temporaries
+    stay small whatever dist_ab's size.
+        INPUTS
+            dist_ab     ABxHxW   per pixel distribution over the ab bins
+            stride      int      step between sampled pixels
+            normalize   divide by log(AB), so the result is in [0,1]
+        OUTPUTS
+            returned value is ceil(H/stride)xceil(W/stride), in dtype '''
+    dist_ab = dist_ab[:, ::stride, ::stride]
+    AB, H, W = dist_ab.shape
+    out = np.empty((H, W), dtype=dtype)
+    for r0 in range(0, H, chunk_rows):
+        p = np.asarray(dist_ab[:, r0:r0 + chunk_rows], dtype=dtype)
+        total = p.sum(axis=0)
+        plogp = p * np.log(np.maximum(p, np.finfo(dtype).tiny))
+        # with q = p / total: -sum(q log q) = log(total) - sum(p log p) / total
+        total = np.maximum(total, np.finfo(dtype).tiny)
+        out[r0:r0 + chunk_rows] = np.log(total) - plogp.sum(axis=0) / total
+    np.maximum(out, 0, out=out)
+    if normalize:
+        out /= np.log(AB)
+    return out
+
+
+def top_regions(uncertainty, n=5, cell=16):
+    ''' The n most uncertain cell x cell regions, no two of them adjacent
+        INPUTS
+            uncertainty   HxW   e.g. from entropy_map
+        OUTPUTS
+            [(y0, x0, y1, x1, mean uncertainty), ...] in pixels of
+            uncertainty, most uncertain first '''
+    H, W = uncertainty.shape
+    gh, gw = -(-H // cell), -(-W // cell)
+    padded = np.full((gh * cell, gw * cell), np.nan, dtype=np.float64)
+    padded[:H, :W] = uncertainty
+    scores = np.nanmean(padded.reshape((gh, cell, gw, cell)), axis=(1, 3))
+
+    regions = []
+    taken = np.zeros((gh, gw), dtype=bool)
+    for ind in np.argsort(-scores, axis=None):
+        if len(regions) == n:
+            break
+        i, j = divmod(int(ind), gw)
+        if taken[i, j]:
+            continue
+        taken[max(0, i - 1):i + 2, max(0, j - 1):j + 2] = True
+        regions.append((i * cell, j * cell, min(H, (i + 1) * cell), min(W, (j + 1) * cell), float(scores[i, j])))
+    return regions
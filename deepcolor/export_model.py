@@ -0,0 +1,89 @@
+''' Export the colorization network to TorchScript and/or ONNX
+
+Writes <output>_color and <output>_dist graphs (see data/exported_net.py),
+then checks them against the eager network on random inputs and times both.
+Exits with status 1 if an exported graph is outside --tolerance.
+
+    python export_model.py --color_model ./models/pytorch/caffemodel.pth --output ./models/exported/siggraph
+
+The API then serves them with MODEL_RUNTIME=torchscript (or onnx) and
+EXPORTED_MODEL_PATH=./models/exported/siggraph. The ONNX runtime is
+experimental: tests/test_exported_net.py checks it only where onnx and
+onnxruntime are installed.
+'''
+from __future__ import print_function
+import argparse
+import os
+import sys
+import time
+
+from data import colorize_image as CI
+from data import exported_net
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='iDeepColor: export the network for the optimized runtimes')
+    parser.add_argument('--color_model', dest='color_model', help='colorization model', type=str,
+                        default='./models/pytorch/caffemodel.pth')
+    parser.add_argument('--output', dest='output', help='path prefix of the exported graphs', type=str,
+                        default='./models/exported/siggraph')
+    parser.add_argument('--runtime', dest='runtime', help='torchscript, onnx (experimental) or both', type=str, default='torchscript')
+    parser.add_argument('--load_size', dest='load_size', help='network input size to trace at', type=int, default=256)
+    parser.add_argument('--opset', dest='opset', help='ONNX opset', type=int, default=17)
+    parser.add_argument('--pytorch_maskcent', dest='pytorch_maskcent', help='check with a centered mask (as for siggraph_pretrained)', action='store_true')
+    parser.add_argument('--tolerance', dest='tolerance', help='largest allowed ab difference from eager', type=float, default=.05)
+    parser.add_argument('--batch_size', dest='batch_size', help='batch size to check and time', type=int, default=2)
+    parser.add_argument('--repeats', dest='repeats', help='timed forward passes per runtime', type=int, default=5)
+    parser.add_argument('--threads', dest='threads', help='intra-op threads for the exported runtime', type=int, default=0)
+    parser.add_argument('--no_check', dest='no_check', help='export only', action='store_true')
+    return parser.parse_args()
+
+
+def time_forward(forward, inputs, repeats):
+    # median seconds per forward pass, after one warm up
+    forward(*inputs)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        forward(*inputs)
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    runtimes = exported_net.RUNTIMES if args.runtime == 'both' else (args.runtime,)
+    if any(runtime not in exported_net.RUNTIMES for runtime in runtimes):
+        sys.exit('--runtime must be torchscript, onnx or both')
+    if os.path.dirname(args.output) and not os.path.exists(os.path.dirname(args.output)):
+        os.makedirs(os.path.dirname(args.output))
+
+    net = CI.load_siggraph_net(args.color_model)
+    for runtime in runtimes:
+        if runtime == 'onnx':
+            paths = exported_net.export_onnx(net, args.output, Xd=args.load_size, opset=args.opset)
+        else:
+            paths = exported_net.export_torchscript(net, args.output, Xd=args.load_size)
+        for mode in exported_net.MODES:
+            print('Exported %s %s graph to %s' % (runtime, mode, paths[mode]))
+    if args.no_check:
+        sys.exit(0)
+
+    maskcent = .5 if args.pytorch_maskcent else 0
+    inputs = exported_net.example_inputs(batch_size=args.batch_size, Xd=args.load_size)
+    seconds = time_forward(lambda *x: CI.siggraph_forward(net, *x, maskcent=maskcent), inputs, args.repeats)
+    print('%-12s %10s %10s %10s %10s' % ('runtime', 'color ab', 'dist ab', 'dist prob', 'ms/batch'))
+    print('%-12s %10s %10s %10s %10.1f' % ('eager', '-', '-', '-', 1000. * seconds))
+
+    failed = []
+    for runtime in runtimes:
+        exported = exported_net.ExportedSiggraphNet(args.output, runtime=runtime, num_threads=args.threads)
+        diffs = exported_net.check_parity(net, exported, batch_size=args.batch_size, Xd=args.load_size, maskcent=maskcent)
+        seconds = time_forward(lambda *x: exported.forward(*x, maskcent=maskcent), inputs, args.repeats)
+        print('%-12s %10.4f %10.4f %10.6f %10.1f' % (runtime, diffs['color_reg'], diffs['dist_reg'], diffs['dist_cl'], 1000. * seconds))
+        if max(diffs['color_reg'], diffs['dist_reg']) > args.tolerance:
+            failed.append(runtime)
+
+    if failed:
+        print('Outside tolerance: %s' % ', '.join(failed))
+        sys.exit(1)
@@ -0,0 +1,325 @@
+''' Headless bulk colorization of a directory of images
+
+Images go through a pipeline of stages, each a pool of threads connected to
+the next by a bounded queue:
+
+    decode -> preprocess -> batched inference -> upsample -> encode
+
+OpenCV, numpy and torch release the GIL for their heavy work, so the stages
+run in parallel across cores, and the bounded queues keep memory flat however
+many images there are. Outputs that already exist are skipped, so an
+interrupted run can simply be started again (outputs are written under a
+temporary name and renamed when complete). As in the interactive engine,
+results are at most --fullres_max pixels on their longer side.
+
+    python ideepcolor_batch.py --input_dir scans --output_dir colorized
+'''
+from __future__ import print_function
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from data import colorize_image as CI
+from data.large_image import colorize_large_image, limit_size, strip_l
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+
+DONE = None  # end of stream marker passed between stages
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='iDeepColor: colorize a directory of images')
+    parser.add_argument('--input_dir', dest='input_dir', help='directory of input images', type=str, required=True)
+    parser.add_argument('--output_dir', dest='output_dir', help='directory for the results', type=str, required=True)
+    parser.add_argument('--recursive', dest='recursive', help='also colorize images in subdirectories', action='store_true')
+    parser.add_argument('--ext', dest='ext', help='output format (jpg, png, webp)', type=str, default='jpg')
+    parser.add_argument('--jpeg_quality', dest='jpeg_quality', type=int, default=95)
+    parser.add_argument('--overwrite', dest='overwrite', help='redo images whose output exists', action='store_true')
+
+    parser.add_argument('--gpu', dest='gpu', help='gpu id', type=int, default=0)
+    parser.add_argument('--cpu_mode', dest='cpu_mode', help='do not use gpu', action='store_true')
+    parser.add_argument('--color_model', dest='color_model', help='colorization model', type=str,
+                        default='./models/pytorch/caffemodel.pth')
+    parser.add_argument('--pytorch_maskcent', dest='pytorch_maskcent', help='need to center mask (activate for siggraph_pretrained but not for converted caffemodel)', action='store_true')
+    parser.add_argument('--load_size', dest='load_size', help='network input size (the longer side with --keep_aspect)', type=int, default=256)
+    parser.add_argument('--keep_aspect', dest='keep_aspect', help='keep the aspect ratio of the network input instead of squashing to square', action='store_true')
+    parser.add_argument('--fullres_max', dest='fullres_max', help='longest side of the results; larger images are scaled down (Xfullres_max)', type=int, default=10000)
+
+    # pipeline
+    parser.add_argument('--batch_size', dest='batch_size', help='images per forward pass', type=int, default=8)
+    parser.add_argument('--workers', dest='workers', help='threads per decode/preprocess/upsample/encode stage (default: cores / 2)', type=int, default=0)
+    parser.add_argument('--torch_threads', dest='torch_threads', help='intra-op threads for inference (default: torch default)', type=int, default=0)
+    parser.add_argument('--queue_size', dest='queue_size', help='images buffered between stages', type=int, default=16)
+    parser.add_argument('--stream_mp', dest='stream_mp', help='images above this many megapixels are colorized strip by strip', type=float, default=50)
+    parser.add_argument('--report_every', dest='report_every', help='seconds between progress lines', type=float, default=10)
+
+    args = parser.parse_args()
+    return args
+
+
+def list_images(input_dir, recursive=False):
+    # relative paths of the images in input_dir, sorted
+    paths = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS) and not name.startswith('.'):
+                paths.append(os.path.relpath(os.path.join(root, name), input_dir))
+        if not recursive:
+            break
+    return paths
+
+
+def output_path(output_dir, rel_path, ext):
+    return os.path.join(output_dir, os.path.splitext(rel_path)[0] + '.' + ext)
+
+
+def partial_path(path):
+    # where an output is written before being renamed into place, so an
+    # interrupted run never leaves a partial output that would be skipped on
+    # resume (same extension, for the encoders)
+    base, ext = os.path.splitext(path)
+    return '%s.partial%s' % (base, ext)
+
+
+def write_image(path, rgb, params=()):
+    tmp_path = partial_path(path)
+    if not cv2.imwrite(tmp_path, cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR), list(params)):
+        raise IOError('Could not write %s' % path)
+    os.replace(tmp_path, path)
+
+
+def stream_image(model, input_path, path, jpeg_quality=95):
+    # colorize_large_image into path, through partial_path
+    tmp_path = partial_path(path)
+    try:
+        colorize_large_image(model, input_path, tmp_path, jpeg_quality=jpeg_quality)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+def fullres_l(rgb, strip_rows=512):
+    # 1xHxW float32 L of a uint8 rgb image, converted a strip at a time
+    H = rgb.shape[0]
+    img_l = np.empty((1,) + rgb.shape[:2], dtype=np.float32)
+    for r0 in range(0, H, strip_rows):
+        img_l[0, r0:r0 + strip_rows] = strip_l(rgb[r0:r0 + strip_rows])
+    return img_l
+
+
+class Progress():
+    ''' Thread-safe counters, with a throughput line every report_every seconds '''
+
+    def __init__(self, total, report_every=10):
+        self.total = total
+        self.report_every = report_every
+        self.done = 0
+        self.failed = 0
+        self.start = time.time()
+        self._last_report = self.start
+        self._lock = threading.Lock()
+
+    def finish(self, failed=False):
+        with self._lock:
+            if failed:
+                self.failed += 1
+            else:
+                self.done += 1
+            now = time.time()
+            if now - self._last_report >= self.report_every:
+                self._last_report = now
+                print(self.line())
+
+    def line(self):
+        elapsed = time.time() - self.start
+        return '%d/%d done, %d failed, %.1fs, %.2f images/sec' % (
+            self.done, self.total, self.failed, elapsed, self.done / max(elapsed, 1e-9))
+
+
+class Stage():
+    ''' A pool of threads applying fn to items from inbox
+    fn returns the item to pass to outbox, or None to drop it. An exception
+    fails just that item. DONE is passed on once every thread has seen it. '''
+
+    def __init__(self, name, fn, inbox, outbox, workers, progress):
+        self.name = name
+        self.fn = fn
+        self.inbox = inbox
+        self.outbox = outbox
+        self.progress = progress
+        self._running = workers
+        self._lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._run, name='%s-%d' % (name, i), daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def _run(self):
+        while True:
+            item = self.inbox.get()
+            if item is DONE:
+                self.inbox.put(DONE)  # for the other threads of this stage
+                break
+            try:
+                out = self.fn(item)
+            except Exception as e:
+                print('[%s] %s failed: %s' % (self.name, item['rel_path'], e))
+                self.progress.finish(failed=True)
+                continue
+            if out is not None and self.outbox is not None:
+                self.outbox.put(out)
+
+        with self._lock:
+            self._running -= 1
+            last = self._running == 0
+        if last and self.outbox is not None:
+            self.outbox.put(DONE)
+
+
+def run_pipeline(model, jobs, args, progress):
+    ''' Colorize jobs [{'rel_path', 'input_path', 'output_path'}, ...] '''
+    workers = args.workers or max(1, (os.cpu_count() or 2) // 2)
+    if args.ext.lower() in ('jpg', 'jpeg'):
+        params = (cv2.IMWRITE_JPEG_QUALITY, args.jpeg_quality)
+    else:
+        params = ()
+    queues = [queue.Queue(maxsize=args.queue_size) for _ in range(5)]
+
+    def decode(job):
+        im = cv2.imread(job['input_path'], cv2.IMREAD_COLOR)
+        if im is None:
+            raise IOError('Could not read image')
+        if im.shape[0] * im.shape[1] > args.stream_mp * 1e6:
+            # too big to hold in float: colorize it strip by strip, here
+            del im
+            stream_image(model.fork(), job['input_path'], job['output_path'], jpeg_quality=args.jpeg_quality)
+            progress.finish()
+            return None
+        job['rgb'] = cv2.cvtColor(im, cv2.COLOR_BGR2RGB)
+        return job
+
+    def preprocess(job):
+        rgb = job.pop('rgb')
+        engine = model.fork()
+        H, W = engine.inference_shape(*rgb.shape[:2])
+        engine.set_image_lowres(cv2.resize(rgb, (W, H)))
+        job['img_l_mc'] = engine.img_l_mc
+        # the network input is taken before the cap, as load_image does
+        job['img_l_fullres'] = fullres_l(limit_size(rgb, model.Xfullres_max))
+        return job
+
+    def upsample(job):
+        job['rgb'] = CI.lab2rgb_fullres(job.pop('img_l_fullres'), job.pop('output_ab'))
+        return job
+
+    def encode(job):
+        write_image(job['output_path'], job.pop('rgb'), params)
+        progress.finish()
+        return None
+
+    stages = [
+        Stage('decode', decode, queues[0], queues[1], workers, progress),
+        Stage('preprocess', preprocess, queues[1], queues[2], workers, progress),
+        Stage('upsample', upsample, queues[3], queues[4], workers, progress),
+        Stage('encode', encode, queues[4], None, workers, progress),
+    ]
+    inference = threading.Thread(target=run_inference, args=(model, queues[2], queues[3], args.batch_size, progress),
+                                 name='inference', daemon=True)
+    inference.start()
+
+    for job in jobs:
+        queues[0].put(job)
+    queues[0].put(DONE)
+
+    inference.join()
+    for stage in stages:
+        for thread in stage.threads:
+            thread.join()
+
+
+def run_inference(model, inbox, outbox, batch_size, progress):
+    # one thread: gather whatever is ready, up to batch_size, into forward
+    # passes of one input shape each
+    finished = False
+    while not finished:
+        batch = [inbox.get()]
+        if batch[0] is DONE:
+            break
+        while len(batch) < batch_size:
+            try:
+                job = inbox.get_nowait()
+            except queue.Empty:
+                break
+            if job is DONE:
+                finished = True
+                break
+            batch.append(job)
+
+        by_shape = {}
+        for job in batch:
+            by_shape.setdefault(job['img_l_mc'].shape, []).append(job)
+        for shape, jobs in by_shape.items():
+            forward_jobs(model, jobs, shape[1:], outbox, progress)
+    outbox.put(DONE)
+
+
+def forward_jobs(model, jobs, shape, outbox, progress):
+    # one forward pass, with no hints, for jobs whose inputs are all of shape (H, W)
+    zeros_ab = np.zeros((2,) + shape, dtype=model.dtype)
+    zeros_mask = np.zeros((1,) + shape, dtype=model.dtype)
+    try:
+        output_ab = model.forward_batch(
+            np.stack([job.pop('img_l_mc') for job in jobs]),
+            np.stack([(zeros_ab - model.ab_mean) / model.ab_norm] * len(jobs)),
+            np.stack([zeros_mask * model.mask_mult] * len(jobs)))
+    except Exception as e:
+        for job in jobs:
+            print('[inference] %s failed: %s' % (job['rel_path'], e))
+            progress.finish(failed=True)
+        return
+    for job, ab in zip(jobs, output_ab):
+        job['output_ab'] = ab
+        outbox.put(job)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    for arg in vars(args):
+        print('[%s] =' % arg, getattr(args, arg))
+
+    import torch
+    if args.cpu_mode or not torch.cuda.is_available():
+        args.gpu = -1
+    if args.torch_threads > 0:
+        torch.set_num_threads(args.torch_threads)
+
+    rel_paths = list_images(args.input_dir, recursive=args.recursive)
+    jobs = []
+    for rel_path in rel_paths:
+        out_path = output_path(args.output_dir, rel_path, args.ext)
+        if os.path.exists(out_path) and not args.overwrite:
+            continue
+        os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+        jobs.append({'rel_path': rel_path, 'input_path': os.path.join(args.input_dir, rel_path), 'output_path': out_path})
+    print('%d images, %d already colorized, %d to do' % (len(rel_paths), len(rel_paths) - len(jobs), len(jobs)))
+    if not jobs:
+        sys.exit(0)
+
+    model = CI.ColorizeImageTorch(Xd=args.load_size, maskcent=args.pytorch_maskcent, keep_aspect=args.keep_aspect)
+    model.Xfullres_max = args.fullres_max
+    model.prep_net(gpu_id=None if args.gpu < 0 else args.gpu, path=args.color_model)
+
+    progress = Progress(len(jobs), report_every=args.report_every)
+    run_pipeline(model, jobs, args, progress)
+    print(progress.line())
+    sys.exit(1 if progress.failed else 0)
@@ -3,12 +3,31 @@ import sys
 import cv2
 import numpy  as np
 from skimage import color
-from flask import Flask, request, jsonify, send_file, session
+from flask import Flask, request, jsonify, send_file, session, Response, g
 from werkzeug.utils import secure_filename
 import uuid
 import datetime
+import functools
+import hashlib
+import json
+import threading
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from data import colorize_image as CI
+from data import metrics
+from data.accept import negotiate
+from data.blob_store import BlobStore, sha256_file
+from data.exported_net import exported_path
+from data.cache import LRUCache
+from data.sessions import open_session_registry
+from data.hints import MAX_HINT_RADIUS, rasterize_hints
+from data.uncertainty import top_regions
+from data.jobs import JobQueue, JobWorkerPool
+from data.large_image import colorize_large_image
 from io import BytesIO
+from PIL import Image
 import base64
 from flask_cors import CORS
 
@@ -17,8 +36,14 @@ sys.path.append("./caffe_files")
 
 app = Flask(__name__)
 app.secret_key = "ideepcolor_secret_key"  # Required for session
-# Enable CORS for all routes and origins
-CORS(app, resources={r"/*": {"origins": "*"}})
+# Enable CORS for all routes and origins, letting clients read the
+# metadata headers of binary image responses and the request id
+RESULT_HEADERS = ["X-Session-Id", "X-Filename", "X-Image-Width", "X-Image-Height"]
+CORS(
+    app,
+    resources={r"/*": {"origins": "*"}},
+    expose_headers=RESULT_HEADERS + ["X-Request-Id"],
+)
 
 # Configuration
 UPLOAD_FOLDER = "./uploads"
@@ -26,8 +51,71 @@ RESULTS_FOLDER = "./results"
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg"}
 MODEL_PATH = "./models/pytorch/caffemodel.pth"
 
-# Dictionary to track active sessions and their files
-active_files = {}
+# Network runtime: "eager" PyTorch, or a graph exported by export_model.py
+# ("torchscript", or the experimental "onnx") from EXPORTED_MODEL_PATH, run
+# with MODEL_THREADS intra-op threads (0 for the runtime's default). int8
+# graphs from quantize_model.py are served with "torchscript".
+MODEL_RUNTIME = os.environ.get("MODEL_RUNTIME", "eager")
+EXPORTED_MODEL_PATH = os.environ.get(
+    "EXPORTED_MODEL_PATH", "./models/exported/siggraph"
+)
+MODEL_THREADS = int(os.environ.get("MODEL_THREADS", 0))
+
+# Content-addressed store for uploads and results, shared by all workers
+STORE_FOLDER = os.environ.get("STORE_FOLDER", "./store")
+STORE_MAX_MB = int(os.environ.get("STORE_MAX_MB", 2048))
+
+# Session registry: "sqlite" (shared by the workers on a host) or "memory"
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "sqlite")
+SESSION_MAX = int(os.environ.get("SESSION_MAX", 10000))
+SESSION_TTL = int(os.environ.get("SESSION_TTL", 24 * 60 * 60))  # seconds idle
+
+# Batch jobs: background workers per process (0 to only queue), limits on
+# what one job may upload, and how long jobs and their results are kept
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_MAX_UPLOAD_MB = int(os.environ.get("JOB_MAX_UPLOAD_MB", 1024))
+JOB_MAX_IMAGES = int(os.environ.get("JOB_MAX_IMAGES", 10000))
+# Uncompressed size of archive members: each one, and all of them together
+JOB_MAX_IMAGE_MB = int(os.environ.get("JOB_MAX_IMAGE_MB", 64))
+JOB_MAX_ARCHIVE_MB = int(os.environ.get("JOB_MAX_ARCHIVE_MB", 4096))
+JOB_TTL = int(os.environ.get("JOB_TTL", 7 * 24 * 60 * 60))  # seconds
+# Seconds a job image stays claimed without a heartbeat from its worker
+# (renewed while it runs) before another worker takes it over
+JOB_LEASE = int(os.environ.get("JOB_LEASE", 10 * 60))
+
+# Prepared image state (L planes) kept in memory per session
+PREPARED_CACHE_MB = int(os.environ.get("PREPARED_CACHE_MB", 512))
+PREPARED_CACHE_TTL = int(os.environ.get("PREPARED_CACHE_TTL", 30 * 60))  # seconds
+
+# Predicted ab distributions (float16) kept per session and hint state
+DIST_CACHE_MB = int(os.environ.get("DIST_CACHE_MB", 1024))
+
+# Low resolution ab predictions kept per image and hint state, which
+# incremental re-colorization diffs against
+AB_CACHE_MB = int(os.environ.get("AB_CACHE_MB", 256))
+
+# Network input size: the longer side, a multiple of 8 from 128 to 512. Each
+# request can choose it with the quality field, a preset name or a size.
+# Images keep their aspect ratio unless INFERENCE_KEEP_ASPECT is off, when
+# they are squashed to a square as before.
+INFERENCE_SIZE = int(os.environ.get("INFERENCE_SIZE", 256))
+INFERENCE_KEEP_ASPECT = os.environ.get("INFERENCE_KEEP_ASPECT", "true").lower() not in (
+    "0", "false", "no"
+)
+QUALITY_PRESETS = {"low": 128, "medium": 256, "high": 384, "max": 512}
+
+# Micro-batching of concurrent forward passes, run by BATCH_WORKERS threads
+# (with one, batches are run one at a time)
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 8))
+BATCH_MAX_DELAY_MS = float(os.environ.get("BATCH_MAX_DELAY_MS", 5))
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", 1))
+
+# Result encoding
+RESULT_JPEG_QUALITY = int(os.environ.get("RESULT_JPEG_QUALITY", 95))
+RESULT_WEBP_QUALITY = int(os.environ.get("RESULT_WEBP_QUALITY", 90))
+
+# Requests slower than this are logged with their per-stage timings
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", 2000))
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
@@ -36,121 +124,657 @@ if not os.path.exists(RESULTS_FOLDER):
 
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 app.config["RESULTS_FOLDER"] = RESULTS_FOLDER
+app.config["STORE_FOLDER"] = STORE_FOLDER
+app.config["STORE_MAX_MB"] = STORE_MAX_MB
+app.config["SESSION_BACKEND"] = SESSION_BACKEND
+app.config["SESSION_MAX"] = SESSION_MAX
+app.config["SESSION_TTL"] = SESSION_TTL
+app.config["JOB_WORKERS"] = JOB_WORKERS
+app.config["JOB_MAX_UPLOAD_MB"] = JOB_MAX_UPLOAD_MB
+app.config["JOB_MAX_IMAGES"] = JOB_MAX_IMAGES
+app.config["JOB_MAX_IMAGE_MB"] = JOB_MAX_IMAGE_MB
+app.config["JOB_MAX_ARCHIVE_MB"] = JOB_MAX_ARCHIVE_MB
+app.config["JOB_TTL"] = JOB_TTL
+app.config["JOB_LEASE"] = JOB_LEASE
 app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB max upload size
+app.config["INFERENCE_SIZE"] = INFERENCE_SIZE
+app.config["INFERENCE_KEEP_ASPECT"] = INFERENCE_KEEP_ASPECT
+app.config["BATCH_MAX_SIZE"] = BATCH_MAX_SIZE
+app.config["BATCH_MAX_DELAY_MS"] = BATCH_MAX_DELAY_MS
+app.config["BATCH_WORKERS"] = BATCH_WORKERS
+app.config["RESULT_JPEG_QUALITY"] = RESULT_JPEG_QUALITY
+app.config["RESULT_WEBP_QUALITY"] = RESULT_WEBP_QUALITY
+app.config["SLOW_REQUEST_MS"] = SLOW_REQUEST_MS
+app.config["MODEL_RUNTIME"] = MODEL_RUNTIME
+app.config["EXPORTED_MODEL_PATH"] = EXPORTED_MODEL_PATH
+app.config["MODEL_THREADS"] = MODEL_THREADS
 
 
 # Initialize models
 def init_models():
-    # Initialize the colorization model with PyTorch backend
-    color_model = CI.ColorizeImageTorch(Xd=256)
-    color_model.prep_net(path=MODEL_PATH)
+    runtime = app.config["MODEL_RUNTIME"]
+    if runtime == "eager":
+        color_class, dist_class = CI.ColorizeImageTorch, CI.ColorizeImageTorchDist
+        net_args = {"path": MODEL_PATH}
+    else:
+        color_class, dist_class = CI.ColorizeImageExported, CI.ColorizeImageExportedDist
+        net_args = {
+            "path": app.config["EXPORTED_MODEL_PATH"],
+            "runtime": runtime,
+            "num_threads": app.config["MODEL_THREADS"],
+        }
 
-    # Initialize the distribution model
-    dist_model = CI.ColorizeImageTorchDist(Xd=256)
-    dist_model.prep_net(path=MODEL_PATH, dist=True)
+    # Initialize the colorization model with PyTorch backend, at the default
+    # size (requests fork it at their own)
+    size = app.config["INFERENCE_SIZE"]
+    keep_aspect = app.config["INFERENCE_KEEP_ASPECT"]
+    color_model = color_class(Xd=size, keep_aspect=keep_aspect)
+    color_model.prep_net(**net_args)
+    color_model.enable_batching(
+        max_batch_size=app.config["BATCH_MAX_SIZE"],
+        max_delay=app.config["BATCH_MAX_DELAY_MS"] / 1000.0,
+        num_workers=app.config["BATCH_WORKERS"],
+    )
+
+    # Initialize the distribution model, a view over the same loaded network
+    # that also returns the ab distribution
+    dist_model = dist_class(Xd=size, keep_aspect=keep_aspect)
+    dist_model.prep_net(dist=True, **net_args)
+    # share the scheduler too, so its requests batch with the color model's
+    dist_model.scheduler = color_model.scheduler
 
     return color_model, dist_model
 
 
 color_model, dist_model = init_models()
 
+# Cached results are only valid for the weights that produced them: the
+# checkpoint, or the exported graph (which may also be int8 quantized)
+if MODEL_RUNTIME == "eager":
+    MODEL_WEIGHTS = MODEL_PATH
+else:
+    MODEL_WEIGHTS = exported_path(EXPORTED_MODEL_PATH, MODEL_RUNTIME, "color")
+MODEL_VERSION = os.environ.get("MODEL_VERSION") or sha256_file(MODEL_WEIGHTS)[:16]
+if MODEL_RUNTIME != "eager":
+    MODEL_VERSION = f"{MODEL_VERSION}-{MODEL_RUNTIME}"
+
+# Uploads and results by content hash. Sessions link to their blobs as
+# upload/<session_id> and result/<session_id>; encoded results are cached
+# by (image hash, hints hash, model version) and collected when space runs out.
+blob_store = BlobStore(
+    app.config["STORE_FOLDER"], max_bytes=app.config["STORE_MAX_MB"] * 1024 * 1024
+)
+
+
+def release_session(session_id, record):
+    """Drop an expired or evicted session's references to its blobs"""
+    blob_store.unlink(f"upload/{session_id}")
+    blob_store.unlink(f"result/{session_id}")
+
+
+# session_id -> {"image_hash", "filename"}, expired after SESSION_TTL idle
+sessions = open_session_registry(
+    app.config["SESSION_BACKEND"],
+    path=os.path.join(blob_store.root, "sessions.sqlite3"),
+    max_sessions=app.config["SESSION_MAX"],
+    ttl=app.config["SESSION_TTL"],
+    on_evict=release_session,
+)
+
+# image hash -> prepared image state, so hint edits (and other sessions
+# uploading the same image) skip decode and Lab conversion
+prepared_cache = LRUCache(
+    max_bytes=PREPARED_CACHE_MB * 1024 * 1024, ttl=PREPARED_CACHE_TTL
+)
+
 
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-@app.route("/health", methods=["GET"])
-def health_check():
-    return jsonify({"status": "healthy"})
+# (image hash, size, hint digest) -> dist_ab (float16 at 1/4 of the input
+# size, as the dist model keeps it), so repeated suggestion clicks on the same
+# image skip the network
+dist_cache = LRUCache(max_bytes=DIST_CACHE_MB * 1024 * 1024, ttl=PREPARED_CACHE_TTL)
 
+# (image hash, size, hint digest) -> output_ab, the state a result was
+# rendered from, for /colorize_incremental
+ab_cache = LRUCache(max_bytes=AB_CACHE_MB * 1024 * 1024, ttl=PREPARED_CACHE_TTL)
 
-@app.route("/colorize", methods=["POST"])
-def colorize_image():
+
+def hint_digest(input_ab, input_mask):
+    """Key for the hint state given to the network"""
+    if not input_mask.any():
+        return "none"
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(input_ab, dtype=np.float32).tobytes())
+    h.update(np.ascontiguousarray(input_mask, dtype=np.float32).tobytes())
+    return h.hexdigest()
+
+
+def cache_dist(model, image_hash, input_ab, input_mask):
+    """Store the distribution from a dist-mode forward pass"""
+    key = (image_hash, model.Xd, hint_digest(input_ab, input_mask))
+    dist_cache.put(key, model.dist_ab)
+
+
+def cache_ab(model, image_hash, hints_key):
+    """Store the ab prediction a result is rendered from"""
+    ab_cache.put((image_hash, model.Xd, hints_key), model.output_ab)
+
+
+def make_result_id(size, hints_key):
     """
-    Endpoint to colorize a grayscale image.
-    Accepts: image file
-    Returns: colorized image
+    Id of a result: its inference size and hint state, which together with
+    the image give the ab it was rendered from (the ab_cache key)
     """
-    # Generate or retrieve session ID
-    session_id = request.form.get("session_id")
+    return f"{size}/{hints_key}"
 
-    # Check if we have an existing file for this session or need to save a new one
-    file_path = None
-    result_path = None
-    file_exists = False
-    result_filename = None
-
-    if session_id and session_id in active_files:
-        # Use existing file path if session exists
-        file_path = active_files[session_id]["upload_path"]
-        result_path = active_files[session_id]["result_path"]
-        result_filename = os.path.basename(result_path)
-        file_exists = os.path.exists(file_path)
-
-    # If file doesn't exist or no session ID, process new upload
-    if not file_exists:
-        # Check if an image was uploaded
-        if "image" not in request.files:
-            return jsonify({"error": "No image provided"}), 400
-
-        file = request.files["image"]
-        if file.filename == "":
-            return jsonify({"error": "No image selected"}), 400
-
-        if not file or not allowed_file(file.filename):
-            return jsonify({"error": "Invalid file format"}), 400
-
-        # Generate new session ID if not provided
-        if not session_id:
-            session_id = str(uuid.uuid4())
-
-        # Save the uploaded file with consistent naming based on session
-        filename = secure_filename(file.filename)
-        base_filename = f"session_{session_id}_{filename}"
-        file_path = os.path.join(app.config["UPLOAD_FOLDER"], base_filename)
-        result_filename = f"result_{session_id}.jpg"
-        result_path = os.path.join(app.config["RESULTS_FOLDER"], result_filename)
-
-        # Save the file
-        file.save(file_path)
-
-        # Store file paths in active_files dictionary
-        active_files[session_id] = {
-            "upload_path": file_path,
-            "result_path": result_path,
-        }
 
-    # Process the image using the colorization model
+def parse_result_id(result_id):
+    """(size, hints_key) of a result id, or None if it isn't one"""
+    size, _, hints_key = (result_id or "").partition("/")
+    if not size.isdigit() or not hints_key:
+        return None
+    return int(size), hints_key
+
+
+def remember_result(session_id, result_id):
+    """Note the result id of the last result sent to a session"""
+    record = sessions.get(session_id)
+    if record is not None and record.get("last_result") != result_id:
+        sessions.put(session_id, dict(record, last_result=result_id))
+
+
+def valid_radius(radius):
+    """Whether a hint radius is a whole number from 0 to MAX_HINT_RADIUS"""
+    if isinstance(radius, bool) or not isinstance(radius, (int, float)):
+        return False
+    return float(radius).is_integer() and 0 <= radius <= MAX_HINT_RADIUS
+
+
+def parse_hints(raw):
+    """
+    (hints, error) for a hints form field: the parsed and validated hints
+    object, or a response to return.
+    """
     try:
-        # Load the image
-        color_model.load_image(file_path)
+        hints = json.loads(raw)
+        # Validate hints structure
+        if not isinstance(hints, dict):
+            return None, (jsonify({"error": "Hints should be a JSON object"}), 400)
+
+        # Check if points key exists and is a list
+        if "points" not in hints:
+            return None, (
+                jsonify({"error": "Hints object missing 'points' array"}),
+                400,
+            )
+
+        if not isinstance(hints["points"], list):
+            return None, (jsonify({"error": "'points' should be an array"}), 400)
+
+        if hints.get("falloff", "linear") not in ("linear", "gaussian", "none"):
+            return None, (
+                jsonify({"error": "'falloff' should be linear, gaussian or none"}),
+                400,
+            )
+
+        radius_error = (
+            jsonify(
+                {
+                    "error": "'radius' should be a whole number from 0 to "
+                    f"{MAX_HINT_RADIUS}"
+                }
+            ),
+            400,
+        )
+        if not valid_radius(hints.get("radius", 3)):
+            return None, radius_error
+
+        # Validate each point has required attributes
+        for i, point in enumerate(hints["points"]):
+            if not all(key in point for key in ["x", "y", "r", "g", "b"]):
+                return None, (
+                    jsonify(
+                        {
+                            "error": f"Point {i} missing required attributes (x, y, r, g, b)"
+                        }
+                    ),
+                    400,
+                )
+            if not valid_radius(point.get("radius", 3)):
+                return None, radius_error
+    except json.JSONDecodeError:
+        return None, (jsonify({"error": "Invalid JSON format for hints"}), 400)
+    except Exception as e:
+        return None, (jsonify({"error": f"Error processing hints: {str(e)}"}), 400)
+    return hints, None
+
+
+def parse_quality(raw):
+    """
+    (size, error) for a quality form field: the network input size for a
+    preset (low, medium, high, max) or a size given directly, a multiple of
+    8 from 128 to 512, or else a response to return. No field is the
+    default size.
+    """
+    if not raw:
+        return app.config["INFERENCE_SIZE"], None
+    size = QUALITY_PRESETS.get(raw.lower())
+    if size is None and raw.isdigit():
+        size = int(raw)
+    if size not in CI.INFERENCE_SIZES:
+        return None, (
+            jsonify(
+                {
+                    "error": "quality should be low, medium, high, max or a "
+                    "multiple of 8 from 128 to 512"
+                }
+            ),
+            400,
+        )
+    return size, None
+
+
+@functools.lru_cache(maxsize=4096)
+def image_size(image_hash):
+    """(height, width) of a stored image, as decoded, from its header"""
+    with Image.open(blob_store.path(image_hash)) as im:
+        width, height = im.size
+        # OpenCV applies the EXIF orientation, turning these by 90 degrees
+        if im.getexif().get(0x0112) in (5, 6, 7, 8):
+            width, height = height, width
+    return height, width
+
+
+def input_shape(model, image_hash):
+    """Network input shape (H, W) of a stored image for a model fork"""
+    return model.inference_shape(*image_size(image_hash))
+
+
+def hints_to_inputs(hints, shape):
+    """
+    Network inputs (input_ab, input_mask) of shape (H, W) for a validated
+    hints object {points: [{x, y, r, g, b, a?, radius?}, ...], radius?,
+    falloff?}. Coordinates are in percent of the image width/height.
+    """
+    H, W = shape
+    points = hints["points"]
+    xy = [(int(point["x"] * W / 100), int(point["y"] * H / 100)) for point in points]
+    rgb = [(point["r"], point["g"], point["b"]) for point in points]
+    alpha = [float(point.get("a", 1.0)) for point in points]
+    radius = [int(point.get("radius", hints.get("radius", 3))) for point in points]
+    return rasterize_hints(
+        xy,
+        rgb,
+        shape,
+        alpha=alpha,
+        radius=radius,
+        falloff=hints.get("falloff", "linear"),
+    )
+
+
+# Results are stored off the request thread. A single writer keeps writes
+# for the same session in submission order.
+result_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="result-writer")
+pending_writes = {}
+pending_writes_lock = threading.Lock()
+
+RESULT_EXTENSIONS = {"image/jpeg": ".jpg", "image/webp": ".webp"}
+
+
+def encode_image(rgb, mimetype):
+    """Encode an RGB uint8 image in memory as image/jpeg or image/webp"""
+    if mimetype == "image/webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, app.config["RESULT_WEBP_QUALITY"]]
+    else:
+        params = [cv2.IMWRITE_JPEG_QUALITY, app.config["RESULT_JPEG_QUALITY"]]
+    with metrics.stage_timer("encode"):
+        ok, buf = cv2.imencode(
+            RESULT_EXTENSIONS[mimetype], cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR), params
+        )
+    if not ok:
+        raise IOError(f"Could not encode result as {mimetype}")
+    return buf.tobytes()
+
+
+def background_write(fn, *args, session_id=None):
+    """
+    Run a store write on the result writer. With session_id, the write is
+    tracked so wait_for_result can wait for it.
+    """
+    future = result_writer.submit(fn, *args)
+    if session_id is not None:
+        with pending_writes_lock:
+            pending_writes[session_id] = future
 
-        # Run the model for automatic colorization (no user input)
-        input_ab = np.zeros((2, color_model.Xd, color_model.Xd))
-        input_mask = np.zeros((1, color_model.Xd, color_model.Xd))
+    def done(f):
+        if session_id is not None:
+            with pending_writes_lock:
+                if pending_writes.get(session_id) is f:
+                    del pending_writes[session_id]
+        if f.exception() is not None:
+            print(f"Error storing result: {f.exception()}")
 
-        # Process the image
-        color_model.net_forward(input_ab, input_mask)
+    future.add_done_callback(done)
 
-        # Get full resolution result instead of resizing the low-res output
-        result_rgb = color_model.get_img_fullres()
 
-        # Convert result to BGR for OpenCV
-        result_bgr = cv2.cvtColor(result_rgb, cv2.COLOR_RGB2BGR)
-        cv2.imwrite(result_path, result_bgr)
+def wait_for_result(session_id):
+    """Block until any queued result write for session_id has finished"""
+    with pending_writes_lock:
+        future = pending_writes.get(session_id)
+    if future is not None:
+        future.exception()
 
-        # Return the image as base64
-        with open(result_path, "rb") as image_file:
-            encoded_image = base64.b64encode(image_file.read()).decode("utf-8")
 
-        return jsonify(
+def store_session_result(session_id, data):
+    """Link a session's result JPEG, unless the session has expired since"""
+    if sessions.get(session_id) is not None:
+        blob_store.put(data, ".jpg", name=f"result/{session_id}")
+
+
+def result_cache_key(image_hash, hints_key, shape):
+    return f"{image_hash}/{hints_key}/{MODEL_VERSION}/{shape[0]}x{shape[1]}"
+
+
+def result_response(session_id, result_filename, cache_key, render):
+    """
+    Response for a colorized result, negotiated from the Accept header:
+    raw image/jpeg or image/webp bytes with metadata in X- headers when the
+    client asks for them by name, or (the default, used by the frontend and
+    browsers) JSON with the JPEG base64-encoded.
+    Encoded results are looked up in the store under cache_key first, and
+    render() (returning the RGB result) is only called on a miss.
+    The JPEG is linked to the session unless the form sets persist=false.
+    """
+    mimetype = negotiate(request.accept_mimetypes, ["image/jpeg", "image/webp"])
+    persist = request.form.get("persist", "true").lower() not in ("0", "false", "no")
+
+    needed = {"image/webp" if mimetype == "image/webp" else "image/jpeg"}
+    if persist:
+        needed.add("image/jpeg")
+
+    encoded = {}
+    size = None
+    for fmt in needed:
+        cached = blob_store.cache_get(f"{cache_key}/{fmt}")
+        if cached is not None:
+            encoded[fmt], meta = cached
+            size = (meta["width"], meta["height"])
+
+    missing = needed - set(encoded)
+    if missing:
+        result_rgb = render()
+        size = (result_rgb.shape[1], result_rgb.shape[0])
+        for fmt in missing:
+            encoded[fmt] = encode_image(result_rgb, fmt)
+            background_write(
+                blob_store.cache_put,
+                f"{cache_key}/{fmt}",
+                encoded[fmt],
+                RESULT_EXTENSIONS[fmt],
+                {"width": size[0], "height": size[1]},
+            )
+
+    if persist:
+        background_write(
+            store_session_result,
+            session_id,
+            encoded["image/jpeg"],
+            session_id=session_id,
+        )
+
+    if mimetype == "application/json":
+        response = jsonify(
             {
                 "status": "success",
-                "image": encoded_image,
+                "image": base64.b64encode(encoded["image/jpeg"]).decode("utf-8"),
                 "filename": result_filename,
                 "session_id": session_id,
             }
         )
+    else:
+        response = Response(encoded[mimetype], mimetype=mimetype)
+        response.headers["X-Session-Id"] = session_id
+        response.headers["X-Filename"] = result_filename
+        response.headers["X-Image-Width"] = str(size[0])
+        response.headers["X-Image-Height"] = str(size[1])
+    response.vary.add("Accept")
+    return response
+
+
+def session_image(session_id):
+    """
+    (session_id, image_hash, error) for a request: the stored image of an
+    existing session or else the uploaded file, which is added to the store
+    and linked to the (possibly new) session. error is a response to return
+    when neither is usable.
+    """
+    if session_id:
+        record = sessions.get(session_id)
+        if record is not None:
+            path = blob_store.path(record["image_hash"])
+            if path is not None and os.path.exists(path):
+                return session_id, record["image_hash"], None
+
+    # Check if an image was uploaded
+    if "image" not in request.files:
+        return session_id, None, (jsonify({"error": "No image provided"}), 400)
+
+    file = request.files["image"]
+    if file.filename == "":
+        return session_id, None, (jsonify({"error": "No image selected"}), 400)
+
+    if not file or not allowed_file(file.filename):
+        return session_id, None, (jsonify({"error": "Invalid file format"}), 400)
+
+    # Generate new session ID if not provided
+    if not session_id:
+        session_id = str(uuid.uuid4())
+
+    # Identical uploads share one blob, and its prepared state and results
+    filename = secure_filename(file.filename)
+    ext = os.path.splitext(filename)[1].lower()
+    with metrics.stage_timer("store_upload"):
+        image_hash = blob_store.put(file.read(), ext, name=f"upload/{session_id}")
+    sessions.put(session_id, {"image_hash": image_hash, "filename": filename})
+    return session_id, image_hash, None
+
+
+def load_prepared_image(model, image_hash):
+    """
+    Load the stored image into model, reusing its prepared image state
+    (full-res L, network size L and mean-centered L) when it is cached.
+    """
+    key = (image_hash, model.Xd)
+    prepared = prepared_cache.get(key)
+    if prepared is not None:
+        model.set_prepared(prepared)
+        return
+
+    model.load_image(blob_store.path(image_hash))
+    prepared_cache.put(key, model.get_prepared())
+
+
+def load_dist(model, image_hash, input_ab, input_mask):
+    """
+    Load the stored image into a dist model fork and set its distribution
+    for the given hints, from the cache or else a forward pass.
+    """
+    load_prepared_image(model, image_hash)
+    dist_ab = dist_cache.get((image_hash, model.Xd, hint_digest(input_ab, input_mask)))
+    if dist_ab is not None:
+        model.set_dist(dist_ab)
+    else:
+        model.net_forward(input_ab, input_mask)
+        cache_dist(model, image_hash, input_ab, input_mask)
+
+
+# Latency per endpoint, and per stage (see data/metrics.py), for /metrics.
+# Every response carries an X-Request-Id: the client's, or a new one.
+metrics.REGISTRY.histogram(
+    "deepcolor_request_seconds", "Time to handle a request, by endpoint and status."
+)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_id = request.headers.get("X-Request-Id") or uuid.uuid4().hex
+    g.request_start = time.perf_counter()
+    g.trace_token = metrics.start_trace()
+
+
+@app.after_request
+def record_request_time(response):
+    if "request_start" not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    trace = metrics.end_trace(g.trace_token)
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    metrics.REGISTRY.observe(
+        "deepcolor_request_seconds",
+        elapsed,
+        endpoint=endpoint,
+        method=request.method,
+        status=response.status_code,
+    )
+    response.headers["X-Request-Id"] = g.request_id
+    if 1000 * elapsed > app.config["SLOW_REQUEST_MS"]:
+        stages = ", ".join(f"{name} {1000 * t:.0f}ms" for name, t in trace)
+        app.logger.warning(
+            f"Slow request {g.request_id}: {request.method} {request.path} "
+            f"{response.status_code} in {1000 * elapsed:.0f}ms "
+            f"({stages or 'no stages'})"
+        )
+    return response
+
+
+def collect_service_metrics():
+    """Gauges and counters kept by the scheduler and caches, for /metrics"""
+    batching = color_model.scheduler.stats()
+    caches = {
+        "prepared": prepared_cache.stats(),
+        "dist": dist_cache.stats(),
+        "ab": ab_cache.stats(),
+    }
+    out = [
+        (
+            "deepcolor_batch_queue_depth",
+            "gauge",
+            "Forward passes waiting for a batch.",
+            [({}, batching["queue_depth"])],
+        ),
+        (
+            "deepcolor_batches_total",
+            "counter",
+            "Batched forward passes run.",
+            [({}, batching["batches"])],
+        ),
+        (
+            "deepcolor_batch_items_total",
+            "counter",
+            "Images run through batched forward passes.",
+            [({}, batching["items"])],
+        ),
+        (
+            "deepcolor_cache_bytes",
+            "gauge",
+            "Bytes held by the in-memory caches.",
+            [({"cache": name}, stats["bytes"]) for name, stats in caches.items()],
+        ),
+    ]
+    for kind in ("hits", "misses", "evictions"):
+        out.append(
+            (
+                f"deepcolor_cache_{kind}_total",
+                "counter",
+                f"Cache {kind} of the in-memory caches.",
+                [({"cache": name}, stats[kind]) for name, stats in caches.items()],
+            )
+        )
+    return out
+
+
+metrics.REGISTRY.add_collector(collect_service_metrics)
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Latency histograms and service counters, for Prometheus to scrape"""
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/health", methods=["GET"])
+def health_check():
+    return jsonify(
+        {
+            "status": "healthy",
+            "batching": color_model.scheduler.stats(),
+            "prepared_cache": prepared_cache.stats(),
+            "dist_cache": dist_cache.stats(),
+            "ab_cache": ab_cache.stats(),
+            "blob_store": blob_store.stats(),
+            "sessions": sessions.stats(),
+            "jobs": job_queue.stats(),
+        }
+    )
+
+
+@app.route("/colorize", methods=["POST"])
+def colorize_image():
+    """
+    Endpoint to colorize a grayscale image.
+    Accepts:
+        - image file
+        - quality: network input size, low, medium, high, max or a multiple
+          of 8 from 128 to 512 (default: the server's, normally medium)
+        - persist: whether to save the result for /get_result_file (default true)
+    Returns: colorized image, as JSON with base64 data or, when the Accept
+    header asks for it, raw image/jpeg or image/webp bytes
+    """
+    # Generate or retrieve session ID
+    session_id = request.form.get("session_id")
+
+    size, error = parse_quality(request.form.get("quality"))
+    if error:
+        return error
+
+    # Use the session's stored image, or store a new upload
+    session_id, image_hash, error = session_image(session_id)
+    if error:
+        return error
+    result_filename = f"result_{session_id}.jpg"
+
+    # Process the image using the colorization model
+    try:
+        # Work on a per-request fork, so concurrent requests sharing the
+        # loaded network never see each other's image state.
+        # The dist view returns the distribution from the same forward
+        # pass, so later /suggest_colors calls need no network run.
+        model = dist_model.fork(Xd=size)
+        shape = input_shape(model, image_hash)
+
+        def render():
+            # Load the image
+            load_prepared_image(model, image_hash)
+
+            # Run the model for automatic colorization (no user input)
+            input_ab, input_mask = hints_to_inputs({"points": []}, shape)
+
+            # Process the image
+            model.net_forward(input_ab, input_mask)
+            cache_dist(model, image_hash, input_ab, input_mask)
+            cache_ab(model, image_hash, "none")
+
+            # Get full resolution result instead of resizing the low-res output
+            return model.get_img_fullres()
+
+        # Encode in memory, reusing an earlier result for the same image
+        cache_key = result_cache_key(image_hash, "none", shape)
+        response = result_response(session_id, result_filename, cache_key, render)
+        remember_result(session_id, make_result_id(size, "none"))
+        return response
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -163,7 +787,10 @@ def colorize_with_hints():
     Accepts:
         - image file
         - JSON with color hints {points: [{x, y, r, g, b, a}, ...]} (a is optional)
-    Returns: colorized image
+        - quality: network input size, as for /colorize
+        - persist: whether to save the result for /get_result_file (default true)
+    Returns: colorized image, as JSON with base64 data or, when the Accept
+    header asks for it, raw image/jpeg or image/webp bytes
     """
     # Generate or retrieve session ID
     session_id = request.form.get("session_id")
@@ -173,152 +800,47 @@ def colorize_with_hints():
     if not hints:
         return jsonify({"error": "No color hints provided"}), 400
 
-    import json
+    hints, error = parse_hints(hints)
+    if error:
+        return error
+    size, error = parse_quality(request.form.get("quality"))
+    if error:
+        return error
+
+    # Use the session's stored image, or store a new upload
+    session_id, image_hash, error = session_image(session_id)
+    if error:
+        return error
+    result_filename = f"result_{session_id}.jpg"
 
+    # Process the image using the colorization model
     try:
-        hints = json.loads(hints)
-        # Validate hints structure
-        if not isinstance(hints, dict):
-            return jsonify({"error": "Hints should be a JSON object"}), 400
+        # Work on a per-request fork, so concurrent requests sharing the
+        # loaded network never see each other's image state
+        model = color_model.fork(Xd=size)
 
-        # Check if points key exists and is a list
-        if "points" not in hints:
-            return jsonify({"error": "Hints object missing 'points' array"}), 400
+        # Rasterize all color hints at once, at the image's network shape
+        shape = input_shape(model, image_hash)
+        input_ab, input_mask = hints_to_inputs(hints, shape)
+        hints_key = hint_digest(input_ab, input_mask)
 
-        if not isinstance(hints["points"], list):
-            return jsonify({"error": "'points' should be an array"}), 400
+        def render():
+            # Load the image
+            load_prepared_image(model, image_hash)
 
-        # Validate each point has required attributes
-        for i, point in enumerate(hints["points"]):
-            if not all(key in point for key in ["x", "y", "r", "g", "b"]):
-                return (
-                    jsonify(
-                        {
-                            "error": f"Point {i} missing required attributes (x, y, r, g, b)"
-                        }
-                    ),
-                    400,
-                )
-    except json.JSONDecodeError:
-        return jsonify({"error": "Invalid JSON format for hints"}), 400
-    except Exception as e:
-        return jsonify({"error": f"Error processing hints: {str(e)}"}), 400
+            # Process the image
+            model.net_forward(input_ab, input_mask)
+            cache_ab(model, image_hash, hints_key)
 
-    # Check if we have an existing file for this session or need to save a new one
-    file_path = None
-    result_path = None
-    file_exists = False
-    result_filename = None
-
-    if session_id and session_id in active_files:
-        # Use existing file path if session exists
-        file_path = active_files[session_id]["upload_path"]
-        result_path = active_files[session_id]["result_path"]
-        result_filename = os.path.basename(result_path)
-        file_exists = os.path.exists(file_path)
-
-    # If file doesn't exist or no session ID, process new upload
-    if not file_exists:
-        # Check if an image was uploaded
-        if "image" not in request.files:
-            return jsonify({"error": "No image provided"}), 400
-
-        file = request.files["image"]
-        if file.filename == "":
-            return jsonify({"error": "No image selected"}), 400
-
-        if not file or not allowed_file(file.filename):
-            return jsonify({"error": "Invalid file format"}), 400
-
-        # Generate new session ID if not provided
-        if not session_id:
-            session_id = str(uuid.uuid4())
-
-        # Save the uploaded file with consistent naming based on session
-        filename = secure_filename(file.filename)
-        base_filename = f"session_{session_id}_{filename}"
-        file_path = os.path.join(app.config["UPLOAD_FOLDER"], base_filename)
-        result_filename = f"result_{session_id}.jpg"
-        result_path = os.path.join(app.config["RESULTS_FOLDER"], result_filename)
-
-        # Save the file
-        file.save(file_path)
-
-        # Store file paths in active_files dictionary
-        active_files[session_id] = {
-            "upload_path": file_path,
-            "result_path": result_path,
-        }
+            # Get full resolution result instead of resizing the low-res output
+            return model.get_img_fullres()
 
-    # Process the image using the colorization model
-    try:
-        # Load the image
-        color_model.load_image(file_path)
-
-        # Initialize empty inputs
-        input_ab = np.zeros((2, color_model.Xd, color_model.Xd))
-        input_mask = np.zeros((1, color_model.Xd, color_model.Xd))
-
-        # Add color hints
-        for hint in hints["points"]:
-            # Scale coordinates to model dimensions
-            x = int(
-                hint["x"] * color_model.Xd / 100
-            )  # Assuming coordinates are in percent
-            y = int(hint["y"] * color_model.Xd / 100)
-
-            # Get alpha value (intensity) for this point (default to 1.0 if not provided)
-            alpha = float(hint.get("a", 1.0))
-            alpha = max(0.0, min(1.0, alpha))  # Clamp between 0.0 and 1.0
-
-            # Convert RGB to LAB - fixing the conversion and indexing
-            rgb = np.array([[[hint["r"], hint["g"], hint["b"]]]], dtype=np.uint8)
-            lab = color.rgb2lab(rgb / 255.0)
-
-            # Extract a and b values - properly indexed now
-            # Scale by alpha to control color intensity
-            a_value = lab[0, 0, 1] * alpha  # a channel with intensity
-            b_value = lab[0, 0, 2] * alpha  # b channel with intensity
-
-            # Add hint to input
-            input_ab[0, y, x] = a_value
-            input_ab[1, y, x] = b_value
-            input_mask[0, y, x] = 1.0
-
-            # Make hints affect surrounding pixels (create a small patch)
-            radius = 3
-            for i in range(max(0, y - radius), min(color_model.Xd, y + radius + 1)):
-                for j in range(max(0, x - radius), min(color_model.Xd, x + radius + 1)):
-                    dist = np.sqrt((i - y) ** 2 + (j - x) ** 2)
-                    if dist <= radius:
-                        input_ab[0, i, j] = a_value
-                        input_ab[1, i, j] = b_value
-                        input_mask[0, i, j] = max(
-                            input_mask[0, i, j], 1.0 - dist / radius
-                        )
-
-        # Process the image
-        color_model.net_forward(input_ab, input_mask)
-
-        # Get full resolution result instead of resizing the low-res output
-        result_rgb = color_model.get_img_fullres()
-
-        # Convert result to BGR for OpenCV
-        result_bgr = cv2.cvtColor(result_rgb, cv2.COLOR_RGB2BGR)
-        cv2.imwrite(result_path, result_bgr)
-
-        # Return the image as base64
-        with open(result_path, "rb") as image_file:
-            encoded_image = base64.b64encode(image_file.read()).decode("utf-8")
-
-        return jsonify(
-            {
-                "status": "success",
-                "image": encoded_image,
-                "filename": result_filename,
-                "session_id": session_id,
-            }
-        )
+        # Encode in memory, reusing an earlier result for the same image
+        # and hints
+        cache_key = result_cache_key(image_hash, hints_key, shape)
+        response = result_response(session_id, result_filename, cache_key, render)
+        remember_result(session_id, make_result_id(size, hints_key))
+        return response
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -334,7 +856,8 @@ def suggest_colors():
     Accepts:
         - image file: The image to analyze
         - x, y coordinates: Position to get color suggestions for (as percent of image width/height)
-        - k: Number of color suggestions to return (default: 5)
+        - k: Number of color suggestions to return, 1 to 529 (default: 5)
+        - quality: network input size, as for /colorize
         - session_id: Optional session ID to reuse existing uploaded file
 
     Returns:
@@ -350,85 +873,56 @@ def suggest_colors():
         k = int(request.form.get("k", 5))  # Default to 5 suggestions
     except:
         return jsonify({"error": "Invalid coordinates"}), 400
-
-    # Check if we have an existing file for this session or need to save a new one
-    file_path = None
-    file_exists = False
-
-    if session_id and session_id in active_files:
-        # Use existing file path if session exists
-        file_path = active_files[session_id]["upload_path"]
-        file_exists = os.path.exists(file_path)
-
-    # If file doesn't exist or no session ID, process new upload
-    if not file_exists:
-        # Check if an image was uploaded
-        if "image" not in request.files:
-            return jsonify({"error": "No image provided"}), 400
-
-        file = request.files["image"]
-        if file.filename == "":
-            return jsonify({"error": "No image selected"}), 400
-
-        if not file or not allowed_file(file.filename):
-            return jsonify({"error": "Invalid file format"}), 400
-
-        # Generate new session ID if not provided
-        if not session_id:
-            session_id = str(uuid.uuid4())
-
-        # Save the uploaded file with consistent naming based on session
-        filename = secure_filename(file.filename)
-        base_filename = f"session_{session_id}_{filename}"
-        file_path = os.path.join(app.config["UPLOAD_FOLDER"], base_filename)
-        result_filename = f"result_{session_id}.jpg"
-        result_path = os.path.join(app.config["RESULTS_FOLDER"], result_filename)
-
-        # Save the file
-        file.save(file_path)
-
-        # Store file paths in active_files dictionary
-        active_files[session_id] = {
-            "upload_path": file_path,
-            "result_path": result_path,
-        }
+    # at most one suggestion per ab bin
+    if not 1 <= k <= dist_model.AB:
+        return jsonify({"error": f"k should be between 1 and {dist_model.AB}"}), 400
+    size, error = parse_quality(request.form.get("quality"))
+    if error:
+        return error
+
+    # Use the session's stored image, or store a new upload
+    session_id, image_hash, error = session_image(session_id)
+    if error:
+        return error
+    file_path = blob_store.path(image_hash)
 
     if allowed_file(os.path.basename(file_path)):
         try:
-            # Load the image directly with the model's load_image method
-            # This handles all necessary resizing and preprocessing
-            dist_model.load_image(file_path)
+            # Per-request fork of the shared distribution model
+            model = dist_model.fork(Xd=size)
 
-            # Run empty prediction to initialize the model
-            input_ab = np.zeros((2, dist_model.Xd, dist_model.Xd))
-            input_mask = np.zeros((1, dist_model.Xd, dist_model.Xd))
-            dist_model.net_forward(input_ab, input_mask)
+            # Load the image (or its cached preprocessed state) and run an
+            # empty prediction, unless the distribution for this image and
+            # hint state is cached
+            H, W = input_shape(model, image_hash)
+            input_ab, input_mask = hints_to_inputs({"points": []}, (H, W))
+            load_dist(model, image_hash, input_ab, input_mask)
 
             # Convert percentage to model coordinates
             # (coordinates need to be in the model's downsampled space)
-            h = int(y_percent * dist_model.Xd / 100)
-            w = int(x_percent * dist_model.Xd / 100)
+            h = int(y_percent * H / 100)
+            w = int(x_percent * W / 100)
 
             # Ensure coordinates are within valid range
-            h = max(0, min(dist_model.Xd - 1, h))
-            w = max(0, min(dist_model.Xd - 1, w))
+            h = max(0, min(H - 1, h))
+            w = max(0, min(W - 1, w))
 
             # Get color suggestions with coordinates in the right format (h, w)
             # This matches how it's used in gui_draw.py
-            ab_colors, confidences = dist_model.get_ab_reccs(
+            ab_colors, confidences = model.get_ab_reccs(
                 h=h, w=w, K=k, N=25000, return_conf=True
             )
 
             if ab_colors is not None:
                 # Add L channel (from the image) to create LAB colors
-                L = np.tile(dist_model.img_l[0, h, w], (k, 1))
+                L = np.tile(model.img_l[0, h, w], (len(ab_colors), 1))
                 colors_lab = np.concatenate((L, ab_colors), axis=1)
 
                 # Reshape for conversion to RGB
                 colors_lab3 = colors_lab[:, np.newaxis, :]
 
                 # Convert LAB to RGB
-                colors_rgb = np.clip(np.squeeze(color.lab2rgb(colors_lab3)), 0, 1)
+                colors_rgb = np.clip(color.lab2rgb(colors_lab3)[:, 0], 0, 1)
 
                 # Convert to 0-255 range
                 colors_rgb = (colors_rgb * 255).astype(np.uint8)
@@ -465,6 +959,246 @@ def suggest_colors():
     return jsonify({"error": "Invalid file format"}), 400
 
 
+PATCH_FORMATS = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+
+
+@app.route("/colorize_incremental", methods=["POST"])
+def colorize_incremental():
+    """
+    Endpoint to update a result after a small hint edit, sending only the
+    part of the image that changed, for the client to draw over the result
+    it already shows.
+    Accepts:
+        - session_id (or image file)
+        - hints: JSON as for /colorize_with_hints (may have no points)
+        - base: result_id of the result the client shows (default: the last
+          result sent to this session by any colorize endpoint, if it was at
+          this quality)
+        - threshold: smallest ab change that counts, in Lab units (default 1)
+        - format: patch encoding, jpeg, webp or png (default jpeg)
+        - quality: network input size, as for /colorize; a base given at
+          another quality is rejected (409)
+    Returns: JSON with the result_id of the new result, the full image
+    size, and the patch as base64 with its bbox {x, y, width, height} in
+    pixels; full is true when the patch is the whole image (no usable
+    base), and patch and bbox are null when nothing changed.
+    The patch is not stored as the session's result.
+    """
+    session_id = request.form.get("session_id")
+
+    hints, error = parse_hints(request.form.get("hints", '{"points": []}'))
+    if error:
+        return error
+    fmt = request.form.get("format", "jpeg").lower()
+    if fmt not in PATCH_FORMATS:
+        return jsonify({"error": "format should be jpeg, webp or png"}), 400
+    try:
+        threshold = float(request.form.get("threshold", 1.0))
+    except ValueError:
+        return jsonify({"error": "Invalid threshold"}), 400
+    size, error = parse_quality(request.form.get("quality"))
+    if error:
+        return error
+
+    # The result the client shows: a patch only fits it if it was rendered
+    # at the same size
+    base = request.form.get("base")
+    if base:
+        parsed = parse_result_id(base)
+        if parsed is None:
+            return jsonify({"error": "base should be a result_id"}), 400
+        if parsed[0] != size:
+            return (
+                jsonify(
+                    {
+                        "error": f"base was rendered at quality {parsed[0]}, "
+                        f"not {size}"
+                    }
+                ),
+                409,
+            )
+
+    # Use the session's stored image, or store a new upload
+    session_id, image_hash, error = session_image(session_id)
+    if error:
+        return error
+
+    try:
+        model = color_model.fork(Xd=size)
+        input_ab, input_mask = hints_to_inputs(hints, input_shape(model, image_hash))
+        hints_key = hint_digest(input_ab, input_mask)
+        load_prepared_image(model, image_hash)
+
+        # ab of the new result, from the cache or a forward pass
+        output_ab = ab_cache.get((image_hash, model.Xd, hints_key))
+        if output_ab is not None:
+            model.set_output_ab(output_ab)
+        else:
+            model.net_forward(input_ab, input_mask)
+            cache_ab(model, image_hash, hints_key)
+
+        # ab of the result the client has; the session's last result is
+        # only used if it was at this size (else the whole image is sent)
+        if not base:
+            base = (sessions.get(session_id) or {}).get("last_result")
+            parsed = parse_result_id(base)
+            if parsed is None or parsed[0] != size:
+                base = None
+        base_ab = None
+        if base:
+            base_ab = ab_cache.get((image_hash, size, parse_result_id(base)[1]))
+        if base_ab is not None and base_ab.shape != model.output_ab.shape:
+            return jsonify({"error": "base does not match this image's shape"}), 409
+
+        H, W = model.img_l_fullres.shape[1:]
+        if base_ab is None:
+            bbox = (0, H, 0, W)
+        else:
+            bbox = CI.changed_bbox(base_ab, model.output_ab, H, W, threshold=threshold)
+
+        data = {
+            "status": "success",
+            "session_id": session_id,
+            "result_id": make_result_id(size, hints_key),
+            "base": base if base_ab is not None else None,
+            "full": base_ab is None,
+            "image_width": W,
+            "image_height": H,
+            "bbox": None,
+            "patch": None,
+        }
+        if bbox is not None:
+            r0, r1, c0, c1 = bbox
+            patch = model.get_img_fullres_window(r0, r1, c0, c1)
+            if fmt == "png":
+                with metrics.stage_timer("encode"):
+                    ok, buf = cv2.imencode(
+                        ".png", cv2.cvtColor(patch, cv2.COLOR_RGB2BGR)
+                    )
+                if not ok:
+                    raise IOError("Could not encode the patch")
+                encoded = buf.tobytes()
+            else:
+                encoded = encode_image(patch, PATCH_FORMATS[fmt])
+            data["bbox"] = {"x": c0, "y": r0, "width": c1 - c0, "height": r1 - r0}
+            data["patch"] = base64.b64encode(encoded).decode("utf-8")
+            data["patch_format"] = PATCH_FORMATS[fmt]
+
+        remember_result(session_id, make_result_id(size, hints_key))
+        return jsonify(data)
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+UNCERTAINTY_STRIDES = (1, 2, 4, 8, 16)
+
+
+@app.route("/uncertainty", methods=["POST"])
+def uncertainty():
+    """
+    Endpoint to find where the colorization is least certain, i.e. where a
+    hint would help most. Uses the predicted color distribution, so it needs
+    no forward pass when the image and hints were seen by /suggest_colors or
+    /colorize.
+    Accepts:
+        - image file or session_id
+        - hints: optional JSON as for /colorize_with_hints
+        - stride: sample every stride-th network pixel (1, 2, 4, 8, 16; default 4)
+        - n: number of regions to return (default 5)
+        - region: region size in percent of the image (default 12.5)
+        - heatmap: also return the map as a base64 PNG (default false)
+        - quality: network input size, as for /colorize
+    Returns: JSON with the n most uncertain regions {x, y, width, height,
+    score} in percent of the image, most uncertain first, scores in [0, 1].
+    With an Accept header asking for image/png, the heatmap itself: a
+    grayscale PNG of the map, brighter where less certain.
+    """
+    session_id = request.form.get("session_id")
+
+    try:
+        stride = int(request.form.get("stride", 4))
+        n = int(request.form.get("n", 5))
+        region = float(request.form.get("region", 12.5))
+    except ValueError:
+        return jsonify({"error": "Invalid stride, n or region"}), 400
+    if stride not in UNCERTAINTY_STRIDES or not 1 <= n <= 100 or not 0 < region <= 100:
+        return (
+            jsonify(
+                {
+                    "error": "stride should be one of 1, 2, 4, 8, 16, n between 1 "
+                    "and 100 and region between 0 and 100"
+                }
+            ),
+            400,
+        )
+    heatmap = request.form.get("heatmap", "false").lower() in ("1", "true", "yes")
+    size, error = parse_quality(request.form.get("quality"))
+    if error:
+        return error
+
+    hints = {"points": []}
+    if request.form.get("hints"):
+        hints, error = parse_hints(request.form["hints"])
+        if error:
+            return error
+
+    # Use the session's stored image, or store a new upload
+    session_id, image_hash, error = session_image(session_id)
+    if error:
+        return error
+
+    try:
+        model = dist_model.fork(Xd=size)
+        input_ab, input_mask = hints_to_inputs(hints, input_shape(model, image_hash))
+        load_dist(model, image_hash, input_ab, input_mask)
+        entropy = model.compute_entropy(stride=stride, normalize=True)
+
+        H, W = entropy.shape
+        cell = max(1, int(round(region * min(H, W) / 100)))
+        regions = [
+            {
+                "x": 100.0 * x0 / W,
+                "y": 100.0 * y0 / H,
+                "width": 100.0 * (x1 - x0) / W,
+                "height": 100.0 * (y1 - y0) / H,
+                "score": score,
+            }
+            for y0, x0, y1, x1, score in top_regions(entropy, n=n, cell=cell)
+        ]
+
+        mimetype = negotiate(request.accept_mimetypes, ["image/png"])
+        png = None
+        if heatmap or mimetype == "image/png":
+            ok, buf = cv2.imencode(".png", (entropy * 255).round().astype(np.uint8))
+            if not ok:
+                raise IOError("Could not encode the heatmap")
+            png = buf.tobytes()
+
+        if mimetype == "image/png":
+            response = Response(png, mimetype="image/png")
+            response.headers["X-Session-Id"] = session_id
+            response.headers["X-Image-Width"] = str(W)
+            response.headers["X-Image-Height"] = str(H)
+        else:
+            data = {
+                "status": "success",
+                "session_id": session_id,
+                "regions": regions,
+                "mean": float(entropy.mean()),
+            }
+            if png is not None:
+                data["heatmap"] = base64.b64encode(png).decode("utf-8")
+                data["heatmap_width"] = W
+                data["heatmap_height"] = H
+            response = jsonify(data)
+        response.vary.add("Accept")
+        return response
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route("/get_session_image", methods=["GET"])
 def get_session_image():
     """
@@ -486,12 +1220,13 @@ def get_session_image():
     if not original_file_name:
         return jsonify({"error": "Original file name is required"}), 400
 
-    # Look for the file in the active_files dictionary if available
+    # Look for the session's image in the store
     file_path = None
-    if session_id in active_files:
-        file_path = active_files[session_id]["upload_path"]
-    else:
-        # Fall back to constructing the path from the session_id and original filename
+    record = sessions.get(session_id)
+    if record is not None:
+        file_path = blob_store.path(record["image_hash"])
+    if file_path is None:
+        # Fall back to the path uploads were saved at before the store
         file_path = os.path.join(
             app.config["UPLOAD_FOLDER"], f"session_{session_id}_{original_file_name}"
         )
@@ -528,8 +1263,18 @@ def get_result():
     if not session_id:
         return jsonify({"error": "Session ID is required"}), 400
         
-    filename = "result_" + session_id + ".jpg"
-    result_path = os.path.join(app.config["RESULTS_FOLDER"], filename)
+    # Wait for a result of this session still being stored
+    wait_for_result(session_id)
+    result_path = None
+    result_hash = None
+    if sessions.get(session_id) is not None:
+        result_hash = blob_store.resolve(f"result/{session_id}")
+    if result_hash is not None:
+        result_path = blob_store.path(result_hash)
+    if result_path is None:
+        # Fall back to the path results were saved at before the store
+        filename = "result_" + session_id + ".jpg"
+        result_path = os.path.join(app.config["RESULTS_FOLDER"], filename)
     
     # Check if result file exists
     if not os.path.exists(result_path):
@@ -539,5 +1284,239 @@ def get_result():
     return send_file(result_path, mimetype="image/jpeg")
 
 
+def job_result_name(job_id, index):
+    return f"jobs/{job_id}/result/{index}"
+
+
+def run_job_item(item):
+    """
+    Colorize one job image at full resolution (capped as /colorize caps it)
+    into the store, returning the result's hash. Runs on the job workers; an
+    earlier result for the same image (from a job or /colorize) is reused.
+    """
+    name = job_result_name(item["job_id"], item["index"])
+    model = color_model.fork(Xd=item["options"].get("quality"))
+    shape = input_shape(model, item["image_hash"])
+    cache_key = f'{result_cache_key(item["image_hash"], "none", shape)}/image/jpeg'
+    cached = blob_store.cache_get(cache_key)
+    if cached is not None:
+        result_hash = blob_store.put(cached[0], ".jpg", name=name)
+    else:
+        # Strip by strip, so large scans colorize in bounded memory
+        fd, out_path = tempfile.mkstemp(suffix=".jpg", dir=blob_store.root)
+        os.close(fd)
+        try:
+            height, width = colorize_large_image(
+                model,
+                blob_store.path(item["image_hash"]),
+                out_path,
+                jpeg_quality=app.config["RESULT_JPEG_QUALITY"],
+            )
+            with open(out_path, "rb") as f:
+                data = f.read()
+        finally:
+            os.remove(out_path)
+        blob_store.cache_put(
+            cache_key, data, ".jpg", {"width": width, "height": height}
+        )
+        result_hash = blob_store.put(data, ".jpg", name=name)
+
+    # The job may have been deleted while this ran
+    if not job_queue.exists(item["job_id"]):
+        blob_store.unlink(name)
+    return result_hash
+
+
+def delete_job(job_id):
+    """Remove a job and release its inputs and results. Returns its status."""
+    job_queue.cancel(job_id)
+    job = job_queue.delete(job_id)
+    if job is not None:
+        for item in job["items"]:
+            blob_store.unlink(f"jobs/{job_id}/input/{item['index']}")
+            blob_store.unlink(job_result_name(job_id, item["index"]))
+    return job
+
+
+# Jobs queued by any worker process on the host; every process runs its own
+# job workers, which share the loaded network (and its batching) with requests
+job_queue = JobQueue(
+    os.path.join(blob_store.root, "jobs.sqlite3"), stale_after=app.config["JOB_LEASE"]
+)
+job_pool = None
+if app.config["JOB_WORKERS"] > 0:
+    job_pool = JobWorkerPool(
+        job_queue, run_job_item, num_workers=app.config["JOB_WORKERS"]
+    )
+
+
+def job_status(job):
+    """Public view of a job, with result URLs instead of blob hashes"""
+    job = dict(job)
+    items = []
+    for item in job["items"]:
+        item = dict(item)
+        del item["result_hash"]
+        if item["status"] == "done":
+            item["result_url"] = f"/jobs/{job['job_id']}/results/{item['index']}"
+        items.append(item)
+    job["items"] = items
+    job["results_url"] = f"/jobs/{job['job_id']}/results.zip"
+    return job
+
+
+def result_download_name(name):
+    return os.path.splitext(name)[0] + "_color.jpg"
+
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    """
+    Endpoint to queue a batch colorization job.
+    Accepts:
+        - images: one or more image files
+        - archive: a zip file of images (other files are skipped)
+        - quality: network input size, as for /colorize
+    Returns: the job status (202), to poll at /jobs/<job_id>
+    """
+    # Jobs may upload far more than a single image
+    request.max_content_length = app.config["JOB_MAX_UPLOAD_MB"] * 1024 * 1024
+    request.max_form_parts = app.config["JOB_MAX_IMAGES"] + 16
+
+    for old_job_id in job_queue.expired(app.config["JOB_TTL"]):
+        delete_job(old_job_id)
+
+    size, error = parse_quality(request.form.get("quality"))
+    if error:
+        return error
+
+    # Collect (name, read function) of every input image before storing any
+    inputs = []
+    archive = None
+    for file in request.files.getlist("images"):
+        if file.filename == "" or not allowed_file(file.filename):
+            return jsonify({"error": f"Invalid file format: {file.filename}"}), 400
+        inputs.append((secure_filename(file.filename), file.read))
+
+    if "archive" in request.files:
+        try:
+            archive = zipfile.ZipFile(request.files["archive"].stream)
+        except zipfile.BadZipFile:
+            return jsonify({"error": "Archive is not a valid zip file"}), 400
+        # Members are read whole, so bound their sizes before reading any.
+        # zipfile reads no more than file_size bytes of a member and fails
+        # the CRC check of one that claims less than it holds.
+        max_member = app.config["JOB_MAX_IMAGE_MB"] * 1024 * 1024
+        max_total = app.config["JOB_MAX_ARCHIVE_MB"] * 1024 * 1024
+        total = 0
+        for info in archive.infolist():
+            parts = info.filename.split("/")
+            if info.is_dir() or "__MACOSX" in parts or parts[-1].startswith("."):
+                continue
+            if not allowed_file(info.filename):
+                continue
+            total += info.file_size
+            if info.file_size > max_member or total > max_total:
+                archive.close()
+                limit = (
+                    f"{app.config['JOB_MAX_IMAGE_MB']}MB per image"
+                    if info.file_size > max_member
+                    else f"{app.config['JOB_MAX_ARCHIVE_MB']}MB in total"
+                )
+                return (
+                    jsonify({"error": f"Archive images exceed {limit}"}),
+                    413,
+                )
+            name = secure_filename(parts[-1])
+            inputs.append((name, lambda info=info: archive.read(info)))
+
+    max_images = app.config["JOB_MAX_IMAGES"]
+    if not inputs or len(inputs) > max_images:
+        if archive is not None:
+            archive.close()
+        if not inputs:
+            return jsonify({"error": "No images provided"}), 400
+        return jsonify({"error": f"At most {max_images} images per job"}), 400
+
+    job_id = str(uuid.uuid4())
+    items = []
+    try:
+        for index, (name, read) in enumerate(inputs):
+            ext = os.path.splitext(name)[1].lower()
+            name_in_store = f"jobs/{job_id}/input/{index}"
+            image_hash = blob_store.put(read(), ext, name=name_in_store)
+            items.append((name, image_hash))
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, OSError) as e:
+        for index in range(len(items)):
+            blob_store.unlink(f"jobs/{job_id}/input/{index}")
+        return jsonify({"error": f"Could not read images: {str(e)}"}), 400
+    finally:
+        if archive is not None:
+            archive.close()
+
+    job_queue.create(items, options={"quality": size}, job_id=job_id)
+    if job_pool is not None:
+        job_pool.notify()
+    return jsonify(job_status(job_queue.job(job_id))), 202
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Progress of a job, with the URL of every finished result"""
+    job = job_queue.job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_status(job))
+
+
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    """Cancel a job and delete its inputs and results"""
+    job = delete_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({"status": "deleted", "job_id": job_id})
+
+
+@app.route("/jobs/<job_id>/results/<int:index>", methods=["GET"])
+def get_job_result(job_id, index):
+    """One finished result of a job, as image/jpeg"""
+    job = job_queue.job(job_id)
+    if job is None or not 0 <= index < job["total"]:
+        return jsonify({"error": "Job item not found"}), 404
+    item = job["items"][index]
+    path = blob_store.path(item["result_hash"]) if item["result_hash"] else None
+    if path is None or not os.path.exists(path):
+        return jsonify({"error": f"Result not ready ({item['status']})"}), 404
+    return send_file(
+        path, mimetype="image/jpeg", download_name=result_download_name(item["name"])
+    )
+
+
+@app.route("/jobs/<job_id>/results.zip", methods=["GET"])
+def get_job_results(job_id):
+    """All results of a job finished so far, as a zip"""
+    job = job_queue.job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    # JPEGs don't compress further, so they are stored as they are
+    archive = tempfile.TemporaryFile()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_STORED) as zf:
+        for item in job["items"]:
+            path = blob_store.path(item["result_hash"]) if item["result_hash"] else None
+            if path is not None and os.path.exists(path):
+                zf.write(
+                    path, f"{item['index']:05d}_{result_download_name(item['name'])}"
+                )
+    archive.seek(0)
+    return send_file(
+        archive,
+        mimetype="application/zip",
+        as_attachment=True,
+        download_name=f"job_{job_id}.zip",
+    )
+
+
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0", port=5000)
@@ -0,0 +1,107 @@
+''' Quantize the colorization network to int8 for CPU inference
+
+Calibrates the int8 network on the images of --calibration_dir, saves it as
+<output>_color.pt and <output>_dist.pt (see data/quantized_net.py), then
+reloads it and compares it against the float32 network on --eval_dir:
+
+    PSNR fp32     of the float32 result against the original image (get_result_PSNR)
+    PSNR int8     of the int8 result against the original image (get_result_PSNR)
+    PSNR vs fp32  of the int8 result against the float32 one, in dB
+    ab max err    largest difference of the ab prediction, in ab units
+
+Exits with status 1 if any image is below --min_psnr against float32.
+
+    python quantize_model.py --color_model ./models/pytorch/caffemodel.pth --calibration_dir ../test_img
+
+The API then serves it with MODEL_RUNTIME=torchscript and
+EXPORTED_MODEL_PATH=./models/quantized/siggraph.
+'''
+from __future__ import print_function
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from data import colorize_image as CI
+from data import quantized_net
+from data.hints import rasterize_hints
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='iDeepColor: int8 post-training quantization')
+    parser.add_argument('--color_model', dest='color_model', help='colorization model', type=str,
+                        default='./models/pytorch/caffemodel.pth')
+    parser.add_argument('--output', dest='output', help='path prefix of the quantized graphs', type=str,
+                        default='./models/quantized/siggraph')
+    parser.add_argument('--calibration_dir', dest='calibration_dir', help='images to calibrate on', type=str,
+                        default='../test_img')
+    parser.add_argument('--max_images', dest='max_images', help='calibrate on at most this many images (0: all)', type=int, default=0)
+    parser.add_argument('--eval_dir', dest='eval_dir', help='images to compare on (default: the calibration images)', type=str, default='')
+    parser.add_argument('--load_size', dest='load_size', help='network input size', type=int, default=256)
+    parser.add_argument('--pytorch_maskcent', dest='pytorch_maskcent', help='need to center mask (activate for siggraph_pretrained but not for converted caffemodel)', action='store_true')
+    parser.add_argument('--backend', dest='backend', help='quantized engine (x86, fbgemm, qnnpack)', type=str, default='x86')
+    parser.add_argument('--threads', dest='threads', help='intra-op threads for inference', type=int, default=0)
+    parser.add_argument('--num_hints', dest='num_hints', help='random color hints per image when comparing', type=int, default=10)
+    parser.add_argument('--min_psnr', dest='min_psnr', help='lowest allowed PSNR against float32, dB', type=float, default=30.)
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def colorize(model, path, input_ab, input_mask):
+    # (engine, seconds of the forward pass)
+    engine = model.fork()
+    engine.load_image(path)
+    start = time.perf_counter()
+    engine.net_forward(input_ab, input_mask)
+    return engine, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    rng = np.random.RandomState(args.seed)
+    if os.path.dirname(args.output) and not os.path.exists(os.path.dirname(args.output)):
+        os.makedirs(os.path.dirname(args.output))
+
+    model32 = CI.ColorizeImageTorch(Xd=args.load_size, maskcent=args.pytorch_maskcent)
+    model32.prep_net(path=args.color_model)
+
+    paths = quantized_net.calibration_images(args.calibration_dir, args.max_images)
+    if not paths:
+        sys.exit('No images in %s' % args.calibration_dir)
+    print('Calibrating on %d images' % len(paths))
+    batches = list(quantized_net.calibration_batches(model32, paths, seed=args.seed))
+    quantized = {mode: quantized_net.quantize_siggraph_net(model32.net, batches, dist=(mode == 'dist'),
+                                                           maskcent=model32.mask_cent, backend=args.backend)
+                 for mode in ('color', 'dist')}
+    for mode, path in quantized_net.save_quantized(quantized, args.output, Xd=args.load_size).items():
+        print('Saved int8 %s graph to %s' % (mode, path))
+
+    # reload, as the API would
+    model8 = CI.ColorizeImageExported(Xd=args.load_size, maskcent=args.pytorch_maskcent)
+    model8.prep_net(path=args.output, runtime='torchscript', num_threads=args.threads)
+
+    eval_paths = quantized_net.calibration_images(args.eval_dir) if args.eval_dir else paths
+    colorize(model8, eval_paths[0], *rasterize_hints([], [], args.load_size))  # warm up
+    print('%-24s %10s %10s %12s %10s %10s %10s' % ('image', 'PSNR fp32', 'PSNR int8', 'PSNR vs fp32', 'ab max', 'ms fp32', 'ms int8'))
+    failed = []
+    for path in eval_paths:
+        xy = rng.randint(0, args.load_size, size=(args.num_hints, 2))
+        rgb = rng.randint(0, 256, size=(args.num_hints, 3))
+        input_ab, input_mask = rasterize_hints(xy, rgb, args.load_size)
+        engine32, seconds32 = colorize(model32, path, input_ab, input_mask)
+        engine8, seconds8 = colorize(model8, path, input_ab, input_mask)
+
+        err = engine8.get_img_forward().astype(np.float64) - engine32.get_img_forward()
+        mse = np.mean(err**2)
+        psnr = float('inf') if mse == 0 else 20 * np.log10(255. / np.sqrt(mse))
+        print('%-24s %10.2f %10.2f %12.2f %10.4f %10.1f %10.1f' % (
+            os.path.basename(path)[:24], engine32.get_result_PSNR(), engine8.get_result_PSNR(), psnr,
+            np.abs(engine8.output_ab - engine32.output_ab).max(), 1000. * seconds32, 1000. * seconds8))
+        if psnr < args.min_psnr:
+            failed.append(os.path.basename(path))
+
+    if failed:
+        print('Below --min_psnr: %s' % ', '.join(failed))
+        sys.exit(1)
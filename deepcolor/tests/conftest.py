@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+import pytest
+
+from data import colorize_image as CI
+
+TEST_IMG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'test_img')
+
+
+def image_paths(count=None):
+    ''' Paths of the images in test_img, sorted (the first count, if given) '''
+    names = sorted(n for n in os.listdir(TEST_IMG_DIR) if n.lower().endswith(('.jpg', '.jpeg', '.png')))
+    return [os.path.join(TEST_IMG_DIR, n) for n in names[:count]]
+
+
+class StubNet():
+    ''' In place of the network in a ColorizeImageTorch view: a fixed, smooth
+    function of its inputs, so the engine around it can be tested without the
+    model definition or weights '''
+
+    def prep_net(self, gpu_id=None, path='', dist=False):
+        self.net = None
+        self.dist = dist
+        self.net_set = True
+
+    def forward_batch(self, img_l_mc, input_ab_mc, input_mask_mult, dist=None):
+        if dist is None:
+            dist = self.dist
+        l = np.asarray(img_l_mc, dtype=np.float32)
+        ab = np.concatenate((20 * np.tanh(l / 30), 25 * np.cos(l / 20)), axis=1)
+        # hints pull the prediction towards them, as the network's do
+        ab = ab + np.asarray(input_mask_mult, dtype=np.float32) * (np.asarray(input_ab_mc, dtype=np.float32) - ab)
+        ab = ab.astype(np.float32)
+        if dist:
+            return ab, stub_dist(ab)
+        return ab
+
+
+def stub_dist(ab, sigma=15.):
+    ''' Nx529x(H/4)x(W/4) distribution peaked at the Nx2xHxW ab, on the grid of
+    ColorizeImageTorchDist.pts_grid '''
+    grid = np.arange(-110, 120, 10, dtype=np.float32)
+    pts = np.stack(np.meshgrid(grid, grid), axis=-1).reshape((-1, 2))
+    ab = ab[:, :, ::4, ::4]
+    d2 = ((ab[:, np.newaxis] - pts[np.newaxis, :, :, np.newaxis, np.newaxis]) ** 2).sum(axis=2)
+    logits = -d2 / (2 * sigma ** 2)
+    dist = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return (dist / dist.sum(axis=1, keepdims=True)).astype(np.float32)
+
+
+class StubColorizeImage(StubNet, CI.ColorizeImageTorch):
+    pass
+
+
+class StubColorizeImageDist(StubNet, CI.ColorizeImageTorchDist):
+
+    def prep_net(self, gpu_id=None, path='', dist=True):
+        StubNet.prep_net(self, gpu_id=gpu_id, path=path, dist=dist)
+
+
+@pytest.fixture
+def stub_model():
+    model = StubColorizeImage(Xd=64)
+    model.prep_net()
+    return model
+
+
+@pytest.fixture(scope='session')
+def siggraph_net():
+    ''' A randomly initialized SIGGRAPHGenerator; tests using it are skipped
+    where models.pytorch.model is not on the path '''
+    pytest.importorskip('torch')
+    pytest.importorskip('models.pytorch.model')
+    return CI.load_siggraph_net(None)
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from data.ab_reccs import ab_reccs_modes
+
+PTS = np.array(np.meshgrid(np.arange(-110, 120, 10), np.arange(-110, 120, 10))).reshape((2, 529)).T
+
+
+@pytest.mark.parametrize('K, expected', [(0, 1), (-1, 1), (1, 1), (5, 5), (529, 529), (600, 529)])
+def test_modes_clamps_K(K, expected):
+    dist = np.random.RandomState(0).uniform(size=529)
+    centers, conf = ab_reccs_modes(dist, PTS, K=K)
+    assert centers.shape == (expected, 2)
+    assert conf.shape == (expected,)
+    assert np.isclose(conf.sum(), 1)
+    assert np.all(np.diff(conf) <= 0)
+
+
+def test_modes_finds_peaks():
+    dist = np.zeros(529)
+    a, b = np.argmin(((PTS - [40, -30])**2).sum(axis=1)), np.argmin(((PTS - [-60, 50])**2).sum(axis=1))
+    dist[a], dist[b] = .7, .3
+    centers, conf = ab_reccs_modes(dist, PTS, K=2)
+    assert np.allclose(centers, [[40, -30], [-60, 50]])
+    assert np.allclose(conf, [.7, .3])
@@ -0,0 +1,26 @@
+import pytest
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from data.accept import negotiate
+
+RESULT_TYPES = ['image/jpeg', 'image/webp']
+
+
+@pytest.mark.parametrize('header, expected', [
+    # what browsers send on navigation: webp is named, but below text/html
+    ('text/html,image/webp;q=0.9,*/*;q=0.8', 'application/json'),
+    ('', 'application/json'),
+    ('*/*', 'application/json'),
+    ('image/*', 'application/json'),
+    ('application/json', 'application/json'),
+    ('application/json, image/webp', 'application/json'),
+    ('image/webp', 'image/webp'),
+    ('image/jpeg', 'image/jpeg'),
+    ('image/webp,*/*;q=0.8', 'image/webp'),
+    ('image/jpeg, application/json;q=0.5', 'image/jpeg'),
+    ('image/png', 'application/json'),
+])
+def test_negotiate(header, expected):
+    accept = parse_accept_header(header, MIMEAccept)
+    assert negotiate(accept, RESULT_TYPES) == expected
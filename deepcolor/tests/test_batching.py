@@ -0,0 +1,165 @@
+import threading
+
+import numpy as np
+import pytest
+
+from data.batching import BatchScheduler
+
+from .conftest import StubColorizeImage, StubColorizeImageDist, image_paths
+
+# keys as the engine makes them: (dist, input shape)
+KEYS = [(False, (1, 8, 8)), (True, (1, 8, 8)), (False, (1, 16, 8))]
+
+
+class RecordingForward():
+    ''' forward_fn for a BatchScheduler: records the key and size of every
+    batch, and returns each input doubled with its sum, or raises for the
+    keys in fail '''
+
+    def __init__(self, fail=()):
+        self.batches = []
+        self.fail = fail
+
+    def __call__(self, batch, key):
+        (inputs,) = batch
+        self.batches.append((key, len(inputs)))
+        if key in self.fail:
+            raise ValueError('no forward for %s' % (key,))
+        assert inputs.shape[1:] == key[1]
+        return inputs * 2, inputs.sum(axis=(1, 2, 3))
+
+
+def make_input(key, n):
+    return (np.full(key[1], n, dtype=np.float32),)
+
+
+@pytest.fixture
+def scheduler():
+    # a long delay, so everything submitted at once is batched together
+    scheduler = BatchScheduler(RecordingForward(), max_batch_size=8, max_delay=.5)
+    yield scheduler
+    scheduler.close()
+
+
+def test_groups_by_key(scheduler):
+    futures = [(key, n, scheduler.submit_async(make_input(key, n), key=key)) for n in range(4) for key in KEYS]
+    for key, n, future in futures:
+        doubled, total = future.result(timeout=10)
+        assert (doubled == 2 * n).all()
+        assert total == n * np.prod(key[1])
+    assert sorted(scheduler.forward_fn.batches) == sorted((key, 4) for key in KEYS)
+    assert scheduler.stats()['items'] == 12
+
+
+def test_max_batch_size():
+    forward = RecordingForward()
+    scheduler = BatchScheduler(forward, max_batch_size=4, max_delay=.5)
+    try:
+        futures = [scheduler.submit_async(make_input(KEYS[0], n), key=KEYS[0]) for n in range(10)]
+        results = [future.result(timeout=10)[0] for future in futures]
+    finally:
+        scheduler.close()
+    assert [result[0, 0, 0] for result in results] == [2 * n for n in range(10)]
+    assert [size for _, size in forward.batches] == [4, 4, 2]
+
+
+def test_results_to_callers():
+    # callers on their own threads, each checking it got its own slice back
+    scheduler = BatchScheduler(RecordingForward(), max_batch_size=8, max_delay=.05)
+    errors = []
+
+    def call(key, n):
+        try:
+            doubled, _ = scheduler.submit(make_input(key, n), key=key)
+            assert (doubled == 2 * n).all() and doubled.shape == key[1]
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=call, args=(KEYS[n % 3], n)) for n in range(30)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        scheduler.close()
+    assert not errors
+
+
+def test_exception_propagated():
+    forward = RecordingForward(fail=[KEYS[1]])
+    scheduler = BatchScheduler(forward, max_batch_size=8, max_delay=.5)
+    try:
+        futures = [(key, scheduler.submit_async(make_input(key, 1), key=key)) for key in KEYS for _ in range(2)]
+        for key, future in futures:
+            if key in forward.fail:
+                with pytest.raises(ValueError):
+                    future.result(timeout=10)
+            else:
+                assert (future.result(timeout=10)[0] == 2).all()
+        # and the worker carries on
+        with pytest.raises(ValueError):
+            scheduler.submit(make_input(KEYS[1], 1), key=KEYS[1])
+        assert (scheduler.submit(make_input(KEYS[0], 3), key=KEYS[0])[0] == 6).all()
+    finally:
+        scheduler.close()
+
+
+def colorize(model, path, Xd):
+    model = model.fork(Xd=Xd)
+    model.load_image(path)
+    H, W = model.input_shape
+    model.net_forward(np.zeros((2, H, W)), np.zeros((1, H, W)))
+    if model.dist:
+        return model.output_ab, np.asarray(model.dist_ab, dtype=np.float32)
+    return model.output_ab
+
+
+def test_engines_share_scheduler():
+    # color and dist views batched through one scheduler, as in model_api,
+    # at different input shapes: each fork gets the outputs of its own image
+    color_model = StubColorizeImage(Xd=64, keep_aspect=True)
+    color_model.prep_net()
+    dist_model = StubColorizeImageDist(Xd=64, keep_aspect=True)
+    dist_model.prep_net()
+    calls = [(model, path, Xd) for model in (color_model, dist_model) for path in image_paths(3) for Xd in (64, 96)]
+    expected = [colorize(*call) for call in calls]
+
+    scheduler = color_model.enable_batching(max_batch_size=8, max_delay=.05)
+    dist_model.scheduler = scheduler
+    results = [None] * len(calls)
+
+    def run(n):
+        results[n] = colorize(*calls[n])
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(len(calls))]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        scheduler.close()
+
+    assert scheduler.stats()['items'] == len(calls)
+    for result, reference in zip(results, expected):
+        if isinstance(reference, tuple):
+            assert result[0].shape == reference[0].shape
+            assert all(np.allclose(r, e, atol=1e-3) for r, e in zip(result, reference))
+        else:
+            assert result.shape == reference.shape
+            assert np.allclose(result, reference, atol=1e-3)
+
+
+def test_workers_run_batches_concurrently():
+    # each forward pass waits for the other: only passes with two workers
+    barrier = threading.Barrier(2, timeout=10)
+
+    def forward(batch, key):
+        barrier.wait()
+        return batch[0]
+    scheduler = BatchScheduler(forward, max_delay=0, num_workers=2)
+    try:
+        futures = [scheduler.submit_async(make_input(key, 1), key=key) for key in KEYS[:2]]
+        assert all((future.result(timeout=10) == 1).all() for future in futures)
+        assert scheduler.stats()['workers'] == 2
+    finally:
+        scheduler.close()
@@ -0,0 +1,143 @@
+import os
+import sqlite3
+
+import pytest
+
+from data import blob_store
+from data.blob_store import BlobStore, sha256_bytes
+
+
+class FakeTime():
+    ''' A clock that ticks on every read, so last_access orders operations '''
+
+    def __init__(self):
+        self.now = 1000.
+
+    def time(self):
+        self.now += 1
+        return self.now
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(blob_store, 'time', FakeTime())
+    store = BlobStore(str(tmp_path / 'store'), max_bytes=100)
+    yield store
+    store.close()
+
+
+def blob(n, size=30):
+    return bytes([n]) * size
+
+
+def total_size(store):
+    # what the size kept by triggers must match
+    with store._db.read() as db:
+        return db.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+
+
+def refs(store, digest):
+    with store._db.read() as db:
+        row = db.execute('SELECT refs FROM blobs WHERE hash=?', (digest,)).fetchone()
+    return None if row is None else row[0]
+
+
+def test_put_get(store):
+    digest = store.put(blob(1), '.jpg')
+    assert digest == sha256_bytes(blob(1))
+    assert store.get(digest) == blob(1)
+    assert store.path(digest).endswith('.jpg') and os.path.exists(store.path(digest))
+    # the same bytes are stored once, with the first extension
+    assert store.put(blob(1), '.png') == digest
+    assert store.path(digest).endswith('.jpg')
+    assert store.stats()['blobs'] == 1 and store.stats()['bytes'] == 30
+    assert store.get('0' * 64) is None
+
+
+def test_refcounts(store):
+    a, b = store.put(blob(1)), store.put(blob(2))
+    assert refs(store, a) == 0
+    store.link('x', a)
+    store.link('y', a)
+    store.link('x', a)  # relinking to the same blob changes nothing
+    assert refs(store, a) == 2
+    store.link('x', b)  # moving a link releases the old blob
+    assert (refs(store, a), refs(store, b)) == (1, 1)
+    assert store.resolve('x') == b
+    store.unlink('y')
+    store.unlink('y')
+    assert (refs(store, a), refs(store, b)) == (0, 1)
+    assert store.resolve('y') is None
+    # put with a name links in the same step
+    c = store.put(blob(3), name='z')
+    assert refs(store, c) == 1 and store.resolve('z') == c
+
+
+def test_gc_least_recently_used_first(store):
+    digests = [store.put(blob(n)) for n in range(3)]
+    store.get(digests[0])  # now the most recently used
+    assert store.gc() == 0  # 90 of 100 bytes: nothing to do
+    store.put(blob(3))
+    # 120 bytes: the least recently used unreferenced blob goes
+    assert store.get(digests[1]) is None
+    assert not os.path.exists(store.path(digests[1], ''))
+    assert store.get(digests[0]) == blob(0) and store.get(digests[2]) == blob(2)
+    assert store.stats()['bytes'] == total_size(store) == 90
+
+
+def test_gc_keeps_referenced(store):
+    for n in range(3):
+        store.put(blob(n, size=40), name='link/%d' % n)
+    # over the cap, but every blob is referenced
+    assert store.stats()['bytes'] == 120
+    assert all(store.get(store.resolve('link/%d' % n)) for n in range(3))
+    # releasing one lets gc bring the store back under the cap
+    digest = store.resolve('link/1')
+    store.unlink('link/1')
+    assert store.get(digest) is None
+    assert store.stats()['bytes'] == total_size(store) == 80
+
+
+def test_gc_drops_cache_entries(store):
+    store.cache_put('key', blob(1), meta={'shape': [1, 2]})
+    assert store.cache_get('key') == (blob(1), {'shape': [1, 2]})
+    for n in range(2, 6):
+        store.put(blob(n))
+    assert store.cache_get('key') is None
+    assert store.stats()['cache_entries'] == 0
+
+
+def test_total_size_tracked(store):
+    for n in range(10):
+        store.put(blob(n, size=10 + n), name='link/%d' % (n % 4))
+        store.put(blob(n, size=5))
+        assert store.stats()['bytes'] == total_size(store)
+    for n in range(4):
+        store.unlink('link/%d' % n)
+        assert store.stats()['bytes'] == total_size(store) <= 100
+
+
+def test_total_size_of_existing_store(tmp_path):
+    # stores created before the size was tracked start from the sum of theirs
+    root = tmp_path / 'store'
+    root.mkdir()
+    db = sqlite3.connect(str(root / 'index.sqlite3'))
+    db.executescript('''
+        CREATE TABLE blobs (hash TEXT PRIMARY KEY, ext TEXT, size INTEGER,
+                            refs INTEGER DEFAULT 0, last_access REAL);
+        INSERT INTO blobs VALUES ('a', '', 30, 1, 0), ('b', '', 12, 0, 0);
+    ''')
+    db.close()
+    store = BlobStore(str(root), max_bytes=100)
+    try:
+        assert store.stats()['bytes'] == 42
+        store.put(blob(1))
+        assert store.stats()['bytes'] == 72
+    finally:
+        store.close()
+    # and reopening doesn't count them again
+    store = BlobStore(str(root), max_bytes=100)
+    try:
+        assert store.stats()['bytes'] == 72
+    finally:
+        store.close()
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from data import cache
+from data.cache import LRUCache, nbytes
+
+
+class FakeTime():
+    def __init__(self):
+        self.now = 1000.
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(cache, 'time', clock)
+    return clock
+
+
+def value(size):
+    return np.zeros(size, dtype=np.uint8)
+
+
+def test_nbytes():
+    assert nbytes({'a': value(10), 'b': [b'xyz', (value(5), 'text')]}) == 18
+
+
+def test_lru_order():
+    evicted = []
+    lru = LRUCache(max_bytes=30, on_evict=lambda key, value: evicted.append(key))
+    for key in 'abc':
+        lru.put(key, value(10))
+    assert lru.get('a') is not None  # now the most recently used
+    lru.put('d', value(10))
+    assert evicted == ['b']
+    assert 'b' not in lru and all(key in lru for key in 'acd')
+    # replacing an entry also makes it the most recent
+    lru.put('c', value(10))
+    lru.put('e', value(10))
+    assert evicted == ['b', 'a']
+    assert lru.stats()['evictions'] == 2
+
+
+def test_byte_limit():
+    lru = LRUCache(max_bytes=100)
+    for n in range(10):
+        lru.put(n, value(30))
+        assert lru.stats()['bytes'] <= 100
+    assert len(lru) == 3 and lru.stats()['bytes'] == 90
+    # one entry larger than the whole cache is refused, not stored after
+    # evicting everything else
+    assert not lru.put('big', value(101))
+    assert 'big' not in lru and len(lru) == 3
+    # and replacing an entry with a larger one counts the new size
+    lru.put(9, value(70))
+    assert lru.stats()['bytes'] == 100 and len(lru) == 2
+    assert lru.pop(9).nbytes == 70 and lru.stats()['bytes'] == 30
+
+
+def test_hits_and_misses():
+    lru = LRUCache()
+    lru.put('a', value(1))
+    lru.get('a')
+    assert lru.get('b', 'default') == 'default'
+    stats = lru.stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+
+
+def test_ttl_from_insertion(clock):
+    evicted = []
+    lru = LRUCache(ttl=10, on_evict=lambda key, value: evicted.append(key))
+    lru.put('a', value(1))
+    clock.now += 6
+    assert lru.get('a') is not None
+    # the get did not extend the ttl
+    clock.now += 6
+    assert 'a' not in lru
+    assert lru.get('a') is None
+    assert evicted == ['a'] and lru.stats()['bytes'] == 0
+
+
+def test_ttl_expired_on_put(clock):
+    evicted = []
+    lru = LRUCache(ttl=10, on_evict=lambda key, value: evicted.append(key))
+    lru.put('a', value(1))
+    lru.put('b', value(1))
+    clock.now += 5
+    lru.put('c', value(1))
+    clock.now += 6
+    lru.put('d', value(1))
+    # a and b are expired, c is not yet
+    assert evicted == ['a', 'b'] and len(lru) == 2
+
+
+def test_ttl_expiry_on_put_stops_at_fresh_entry(clock):
+    # put only walks from the least recently used end up to the first fresh
+    # entry; an expired entry used since is left for get to drop
+    lru = LRUCache(ttl=10)
+    lru.put('a', value(1))
+    clock.now += 5
+    lru.put('b', value(1))
+    lru.get('a')  # a is now after b
+    clock.now += 6
+    lru.put('c', value(1))
+    assert len(lru) == 3
+    assert lru.get('a') is None and len(lru) == 2
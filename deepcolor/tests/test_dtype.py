@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from data import colorize_image as CI
+from data.hints import rasterize_hints
+
+from .conftest import StubColorizeImage, image_paths
+
+# the float32 dtype policy: the result stays within a level or two of the
+# float64 reference path, at 53-57 dB (see benchmarks/bench_dtype.py)
+MAX_AB_ERR = 1.
+MAX_RGB_ERR = 2
+MIN_PSNR = 50.
+
+
+def models(network):
+    cls = StubColorizeImage if network == 'stub' else CI.ColorizeImageTorch
+    pair = []
+    for dtype in (np.float32, np.float64):
+        model = cls(Xd=256, dtype=dtype)
+        model.prep_net(path=None)
+        pair.append(model)
+    return pair
+
+
+@pytest.mark.parametrize('network', ['stub', 'siggraph'])
+def test_float32_matches_float64(network, request):
+    if network == 'siggraph':
+        request.getfixturevalue('siggraph_net')
+    model32, model64 = models(network)
+    rng = np.random.RandomState(0)
+    for path in image_paths(3):
+        xy = rng.randint(0, 256, size=(10, 2))
+        rgb = rng.randint(0, 256, size=(10, 3))
+        input_ab, input_mask = rasterize_hints(xy, rgb, 256, dtype=np.float64)
+        results = []
+        for model in (model32, model64):
+            engine = model.fork()
+            engine.load_image(path)
+            engine.net_forward(input_ab, input_mask)
+            results.append((engine, engine.get_img_fullres()))
+        (engine32, result32), (engine64, result64) = results
+
+        assert result32.dtype == np.uint8 and result32.shape == result64.shape
+        assert engine32.img_l.dtype == np.float32 and engine64.img_l.dtype == np.float64
+        assert np.abs(engine32.output_ab - engine64.output_ab).max() <= MAX_AB_ERR
+        err = np.abs(result32.astype(np.int16) - result64.astype(np.int16))
+        assert err.max() <= MAX_RGB_ERR
+        psnr = 20 * np.log10(255. / np.sqrt(np.mean(err.astype(np.float64)**2) + 1e-12))
+        assert psnr >= MIN_PSNR
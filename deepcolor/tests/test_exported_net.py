@@ -0,0 +1,35 @@
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('models.pytorch.model')  # not part of the repo
+
+from data import exported_net
+
+TOLERANCE = .05  # ab units, as export_model.py --tolerance
+
+
+def check_runtime(net, runtime, prefix):
+    if runtime == 'onnx':
+        exported_net.export_onnx(net, prefix, Xd=64)
+    else:
+        exported_net.export_torchscript(net, prefix, Xd=64)
+    exported = exported_net.ExportedSiggraphNet(prefix, runtime=runtime)
+    # another size and batch size than traced at
+    diffs = exported_net.check_parity(net, exported, batch_size=2, Xd=96, maskcent=.5)
+    assert diffs['color_reg'] < TOLERANCE
+    assert diffs['dist_reg'] < TOLERANCE
+    assert diffs['dist_cl'] < 1e-4
+
+    input_A, input_B, mask_B = exported_net.example_inputs(batch_size=1, Xd=96)
+    _, dist = exported.forward(input_A, input_B, mask_B, dist=True)
+    assert dist.shape == (1, 529, 24, 24)
+
+
+def test_torchscript_parity(siggraph_net, tmp_path):
+    check_runtime(siggraph_net, 'torchscript', str(tmp_path / 'siggraph'))
+
+
+def test_onnx_parity(siggraph_net, tmp_path):
+    pytest.importorskip('onnx')
+    pytest.importorskip('onnxruntime')
+    check_runtime(siggraph_net, 'onnx', str(tmp_path / 'siggraph'))
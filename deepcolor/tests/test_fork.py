@@ -0,0 +1,55 @@
+import numpy as np
+
+from .conftest import StubColorizeImage, image_paths
+
+
+def colorize(model, path):
+    model.load_image(path)
+    H, W = model.input_shape
+    input_ab = np.zeros((2, H, W))
+    input_mask = np.zeros((1, H, W))
+    # one hint, so the outputs depend on the hints as well as the image
+    input_ab[:, H // 2, W // 2] = (40, -30)
+    input_mask[:, H // 2, W // 2] = 1
+    model.net_forward(input_ab, input_mask)
+    return model.get_img_fullres()
+
+
+def test_forks_keep_own_state():
+    model = StubColorizeImage(Xd=64, keep_aspect=True)
+    model.prep_net()
+    model.enable_batching(max_delay=0)
+    first, second = model.fork(), model.fork(Xd=96)
+    try:
+        # shared: the network, settings and scheduler
+        for fork in (first, second):
+            assert fork.net is model.net and fork.scheduler is model.scheduler
+            assert fork.dtype == model.dtype and fork.keep_aspect == model.keep_aspect
+        assert (first.Xd, second.Xd, model.Xd) == (64, 96, 64)
+
+        path_a, path_b = image_paths(2)
+        result_a = colorize(first, path_a)
+        memo_a = dict(first._memo)
+        result_b = colorize(second, path_b)
+
+        # the second fork's image, outputs and memoized results are its own
+        assert first.img_l is not second.img_l
+        assert first.output_ab.shape[1:] == first.input_shape
+        assert second.output_ab.shape[1:] == second.input_shape
+        assert first._memo is not second._memo
+        assert all(first._memo[key] is value for key, value in memo_a.items())
+        assert np.array_equal(first.get_img_fullres(), result_a)
+        assert result_a.shape != result_b.shape
+        # and the parent has none
+        assert not model.img_l_set and '_memo' not in model.__dict__
+
+        # new hints on one fork recompute only its memoized outputs
+        H, W = first.input_shape
+        first.net_forward(np.zeros((2, H, W)), np.zeros((1, H, W)))
+        assert not np.array_equal(first.get_img_fullres(), result_a)
+        assert np.array_equal(second.get_img_fullres(), result_b)
+
+        # a fresh fork of the same image gets the same result
+        assert np.array_equal(colorize(model.fork(), path_a), result_a)
+    finally:
+        model.scheduler.close()
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from data import colorize_image as CI
+
+from .conftest import StubColorizeImage, image_paths
+
+
+def hints(shape, points):
+    ''' input_ab, input_mask with a 3x3 square of color at each (h, w, a, b) '''
+    input_ab = np.zeros((2,) + shape)
+    input_mask = np.zeros((1,) + shape)
+    for h, w, a, b in points:
+        input_ab[:, h - 1:h + 2, w - 1:w + 2] = np.array((a, b))[:, np.newaxis, np.newaxis]
+        input_mask[:, h - 1:h + 2, w - 1:w + 2] = 1
+    return input_ab, input_mask
+
+
+def recolorize(model, points):
+    model.net_forward(*hints(model.input_shape, points))
+    return model.output_ab.copy(), model.get_img_fullres()
+
+
+@pytest.fixture(params=image_paths(3))
+def model(request):
+    model = StubColorizeImage(Xd=96, keep_aspect=True)
+    model.prep_net()
+    model.load_image(request.param)
+    return model
+
+
+@pytest.mark.parametrize('threshold', [0, 1.])
+def test_patch_matches_full_recolorize(model, threshold):
+    # as /colorize_incremental: the previous result, with the region
+    # changed_bbox finds replaced by get_img_fullres_window
+    H, W = model.img_l_fullres.shape[1:]
+    h, w = model.input_shape
+    points = [(h // 4, w // 4, 40, -30)]
+    for new_points in ([(h // 4, w // 4, 40, 20)],
+                       points + [(3 * h // 4, w // 2, -20, 50)],
+                       points + [(h - 2, w - 2, 60, 60)],
+                       []):
+        base_ab, base = recolorize(model, points)
+        new_ab, full = recolorize(model, new_points)
+        bbox = CI.changed_bbox(base_ab, new_ab, H, W, threshold=threshold)
+        assert bbox is not None
+        r0, r1, c0, c1 = bbox
+        assert (r1 - r0) * (c1 - c0) < H * W
+        patched = base.copy()
+        patched[r0:r1, c0:c1] = model.get_img_fullres_window(r0, r1, c0, c1)
+        err = np.abs(patched.astype(np.int16) - full)
+        if threshold == 0:
+            assert err.max() == 0
+        else:
+            # ab moves of up to threshold are left out of the patch
+            assert err.max() <= 2
+        points = new_points
+
+
+def test_no_change(model):
+    ab, _ = recolorize(model, [(10, 10, 40, -30)])
+    H, W = model.img_l_fullres.shape[1:]
+    assert CI.changed_bbox(ab, ab.copy(), H, W) is None
+
+
+@pytest.mark.parametrize('window', [(0, 16, 0, 16), (5, 77, 33, 34), (100, 400, 0, None), (0, None, 0, None)])
+def test_window_matches_full(model, window):
+    recolorize(model, [(20, 30, 40, -30)])
+    r0, r1, c0, c1 = window
+    H, W = model.img_l_fullres.shape[1:]
+    r1, c1 = r1 or H, c1 or W
+    assert np.array_equal(model.get_img_fullres_window(r0, r1, c0, c1), model.get_img_fullres()[r0:r1, c0:c1])
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from data import colorize_image as CI
+from data.colorize_image import INFERENCE_SIZES, inference_shape
+
+from .conftest import StubColorizeImage
+
+# (h, w) of images, from square to extreme aspect ratios, both orientations
+IMAGE_SIZES = [(100, 100), (661, 910), (910, 661), (1080, 1920), (1000, 1001),
+               (3000, 100), (100, 3000), (20000, 7), (1, 1), (1, 5000)]
+
+
+def test_inference_sizes():
+    assert min(INFERENCE_SIZES) == 128 and max(INFERENCE_SIZES) == 512
+    assert all(size % 8 == 0 for size in INFERENCE_SIZES)
+    assert 120 not in INFERENCE_SIZES and 260 not in INFERENCE_SIZES
+
+
+@pytest.mark.parametrize('size', INFERENCE_SIZES)
+@pytest.mark.parametrize('h, w', IMAGE_SIZES)
+def test_shape_limits(h, w, size):
+    H, W = inference_shape(h, w, size)
+    # the longer side of the image is size, the shorter within [128, size],
+    # and both multiples of 8, for the network
+    assert max(H, W) == size
+    assert (H >= W) if h >= w else (H <= W)
+    assert 128 <= min(H, W) <= size
+    assert H % 8 == 0 and W % 8 == 0
+
+
+@pytest.mark.parametrize('h, w', IMAGE_SIZES)
+def test_bucketing(h, w):
+    for size in (128, 256, 384, 512):
+        H, W = inference_shape(h, w, size)
+        short, image_short = min(H, W), 1. * min(h, w) / max(h, w) * size
+        # the shorter side is the nearest multiple of 16, unless clamped
+        assert short % 16 == 0
+        assert abs(short - image_short) <= 8 or short in (128, size)
+
+
+def test_similar_images_share_a_shape():
+    # aspect ratios within half a bucket of each other get one shape
+    shapes = {inference_shape(1000, w, 256) for w in range(1300, 1360, 5)}
+    assert shapes == {(192, 256)}
+    assert inference_shape(480, 640, 256) == inference_shape(768, 1024, 256) == (192, 256)
+
+
+def test_extreme_aspect_ratios():
+    # the shorter side is kept at 128 at least, however thin the image
+    assert inference_shape(20000, 7, 512) == (512, 128)
+    assert inference_shape(1, 5000, 256) == (128, 256)
+    assert inference_shape(3000, 100, 128) == (128, 128)
+    # and never rounds past the longer one
+    assert inference_shape(1000, 1000, 152) == (152, 152)
+    # min_side below size still clamps to size
+    assert inference_shape(100, 3000, 64, min_side=128) == (64, 64)
+
+
+@pytest.mark.parametrize('keep_aspect, expected', [(True, (128, 256)), (False, (256, 256))])
+def test_engine_shape(keep_aspect, expected):
+    model = StubColorizeImage(Xd=256, keep_aspect=keep_aspect)
+    model.prep_net()
+    assert model.inference_shape(20, 3000) == expected
+
+
+@pytest.mark.parametrize('shape', [(512, 128), (128, 512), (136, 128), (128, 128), (264, 504)])
+def test_network_takes_shapes(siggraph_net, shape):
+    # every shape inference_shape gives runs through the network as is
+    H, W = shape
+    out_reg, out_cl = CI.siggraph_forward(siggraph_net, np.zeros((1, 1, H, W)), np.zeros((1, 2, H, W)),
+                                          np.zeros((1, 1, H, W)), dist=True)
+    assert out_reg.shape == (1, 2, H, W)
+    assert out_cl.shape == (1, 529, H // 4, W // 4)
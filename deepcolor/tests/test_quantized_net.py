@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('models.pytorch.model')  # not part of the repo
+
+import torch
+
+from data import colorize_image as CI
+from data import quantized_net
+from data.hints import rasterize_hints
+
+from .conftest import image_paths
+
+# int8 against float32, in dB, as quantize_model.py --min_psnr; loose (about
+# 40 with the random weights used here)
+MIN_PSNR = 30
+XD = 64
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b) ** 2)
+    return float('inf') if mse == 0 else 20 * np.log10(255. / np.sqrt(mse))
+
+
+@pytest.fixture(scope='module')
+def quantized_prefix(siggraph_net, tmp_path_factory):
+    if 'x86' not in torch.backends.quantized.supported_engines:
+        pytest.skip('no x86 quantized engine')
+    model32 = CI.ColorizeImageTorch(Xd=XD)
+    model32.prep_net(path=None)
+    batches = list(quantized_net.calibration_batches(model32, image_paths(3)))
+    quantized = {mode: quantized_net.quantize_siggraph_net(siggraph_net, batches, dist=(mode == 'dist'))
+                 for mode in ('color', 'dist')}
+    prefix = str(tmp_path_factory.mktemp('quantized') / 'siggraph')
+    quantized_net.save_quantized(quantized, prefix, Xd=XD)
+    return prefix
+
+
+def colorize(model, path, seed=0):
+    rng = np.random.RandomState(seed)
+    engine = model.fork()
+    engine.load_image(path)
+    xy = rng.randint(0, XD, size=(10, 2))
+    engine.net_forward(*rasterize_hints(xy, rng.randint(0, 256, size=(10, 3)), XD))
+    return engine
+
+
+@pytest.mark.parametrize('path', image_paths(3))
+def test_quantized_psnr(quantized_prefix, path):
+    # as quantize_model.py: the reloaded graph against the float32 network
+    model32 = CI.ColorizeImageTorch(Xd=XD)
+    model32.prep_net(path=None)
+    model8 = CI.ColorizeImageExported(Xd=XD)
+    model8.prep_net(path=quantized_prefix, runtime='torchscript')
+    engine32, engine8 = colorize(model32, path), colorize(model8, path)
+    assert engine8.get_img_forward().shape == engine32.get_img_forward().shape
+    assert psnr(engine8.get_img_forward(), engine32.get_img_forward()) >= MIN_PSNR
+
+
+def test_quantized_dist(quantized_prefix):
+    # the distribution head stays in float32: still a distribution, at 1/4
+    # of the input size
+    model8 = CI.ColorizeImageExportedDist(Xd=XD)
+    model8.prep_net(path=quantized_prefix, runtime='torchscript')
+    engine = colorize(model8, image_paths(1)[0])
+    dist = np.asarray(engine.dist_ab, dtype=np.float32)
+    assert dist.shape == (529, XD // 4, XD // 4)
+    assert np.allclose(dist.sum(axis=0), 1, atol=1e-2)
@@ -0,0 +1,132 @@
+import pytest
+
+from data import cache, sessions
+from data.sessions import SQLiteSessionRegistry, open_session_registry
+
+TTL = 100
+
+
+class FakeTime():
+    def __init__(self):
+        self.now = 1000.
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(cache, 'time', clock)
+    monkeypatch.setattr(sessions, 'time', clock)
+    return clock
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def open_registry(request, tmp_path, clock):
+    ''' Opens registries of the backend under test; sqlite ones on the same
+    path share their sessions, as processes do '''
+    registries = []
+
+    def open_registry(max_sessions=3, on_evict=None):
+        registry = open_session_registry(request.param, path=str(tmp_path / 'sessions.sqlite3'),
+                                         max_sessions=max_sessions, ttl=TTL, on_evict=on_evict)
+        registries.append(registry)
+        return registry
+    yield open_registry
+    for registry in registries:
+        if hasattr(registry, 'close'):
+            registry.close()
+
+
+def test_put_get_pop(open_registry):
+    registry = open_registry()
+    registry.put('a', {'image_hash': 'x'})
+    assert registry.get('a') == {'image_hash': 'x'}
+    registry.put('a', {'image_hash': 'y'})
+    assert registry.get('a') == {'image_hash': 'y'}
+    assert registry.get('b') is None
+    assert registry.pop('a') == {'image_hash': 'y'}
+    assert registry.pop('a') is None and registry.get('a') is None
+    assert registry.stats()['sessions'] == 0
+
+
+def test_evicts_least_recently_used(open_registry, clock):
+    evicted = []
+    registry = open_registry(on_evict=lambda session_id, record: evicted.append(session_id))
+    for session_id in 'abc':
+        registry.put(session_id, {})
+        clock.now += 1
+    registry.get('a')
+    clock.now += 1
+    registry.put('d', {})
+    assert evicted == ['b']
+    assert [registry.get(session_id) is not None for session_id in 'abcd'] == [True, False, True, True]
+    assert registry.stats()['evictions'] == 1
+
+
+def test_idle_sessions_expire(open_registry, clock):
+    evicted = []
+    registry = open_registry(on_evict=lambda session_id, record: evicted.append(session_id))
+    registry.put('a', {'n': 1})
+    registry.put('b', {'n': 2})
+    # getting a session restarts its idle time
+    clock.now += TTL - 10
+    assert registry.get('a') == {'n': 1}
+    clock.now += 20
+    assert registry.get('a') == {'n': 1}
+    assert registry.get('b') is None
+    # expired sessions are released, at the latest on the next put
+    registry.put('c', {})
+    assert evicted == ['b']
+    assert registry.stats()['sessions'] == 2
+
+
+def test_sqlite_get_only_reads(tmp_path, clock):
+    registry = SQLiteSessionRegistry(str(tmp_path / 'sessions.sqlite3'), ttl=TTL, touch_interval=60)
+    other = SQLiteSessionRegistry(str(tmp_path / 'sessions.sqlite3'), ttl=TTL, touch_interval=60)
+    try:
+        registry.put('a', {})
+        changes = registry._db._db.total_changes
+        clock.now += 30
+        for _ in range(10):
+            assert registry.get('a') == {}
+        assert registry._db._db.total_changes == changes
+
+        # the touches are written together, once touch_interval has passed,
+        # so the session stays alive for other processes
+        clock.now += 40
+        assert registry.get('a') == {}
+        assert registry._db._db.total_changes == changes + 1
+        clock.now += TTL - 5
+        assert other.get('a') == {}
+    finally:
+        registry.close()
+        other.close()
+
+
+def test_sqlite_touches_written_on_put_and_close(tmp_path, clock):
+    path = str(tmp_path / 'sessions.sqlite3')
+    registry = SQLiteSessionRegistry(path, max_sessions=2, ttl=TTL, touch_interval=60)
+    registry.put('a', {})
+    registry.put('b', {})
+    clock.now += 10
+    registry.get('a')  # not written yet, but a is now the most recent
+    clock.now += 10
+    registry.put('c', {})
+    assert registry.get('a') == {} and registry.get('b') is None
+
+    clock.now += 10
+    registry.get('c')
+    registry.close()
+    other = SQLiteSessionRegistry(path, ttl=TTL)
+    try:
+        with other._db.read() as db:
+            assert db.execute("SELECT last_access FROM sessions WHERE id='c'").fetchone()[0] == clock.now
+    finally:
+        other.close()
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        open_session_registry('redis')
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from data import colorize_image as CI
+
+TOLERANCE = 1e-3  # ab units; the two differ only in float summation order
+
+
+def example_inputs(batch_size=2, Xd=64, seed=0):
+    rng = np.random.RandomState(seed)
+    input_A = rng.uniform(-50, 50, size=(batch_size, 1, Xd, Xd)).astype(np.float32)
+    input_B = rng.uniform(-110, 110, size=(batch_size, 2, Xd, Xd)).astype(np.float32)
+    mask_B = (rng.uniform(size=(batch_size, 1, Xd, Xd)) < .05).astype(np.float32)
+    return input_A, input_B * mask_B, mask_B
+
+
+@pytest.fixture
+def net_dist(siggraph_net):
+    ''' Sets the mode SIGGRAPHGenerator.forward runs in, for one test '''
+    dist = siggraph_net.dist
+
+    def set_dist(value):
+        siggraph_net.dist = value
+        return siggraph_net
+    yield set_dist
+    siggraph_net.dist = dist
+
+
+@pytest.mark.parametrize('maskcent', [0, .5])
+def test_matches_forward(net_dist, maskcent):
+    net = net_dist(False)
+    input_A, input_B, mask_B = example_inputs()
+    out = CI.siggraph_forward(net, input_A, input_B, mask_B, maskcent=maskcent)
+    assert out.shape == (2, 2, 64, 64)
+    for i in range(len(out)):
+        ref = net.forward(input_A[i], input_B[i], mask_B[i], maskcent=maskcent).detach().numpy()
+        assert np.abs(out[i] - ref[0]).max() < TOLERANCE
+
+
+@pytest.mark.parametrize('maskcent', [0, .5])
+def test_matches_forward_dist(net_dist, maskcent):
+    net = net_dist(True)
+    input_A, input_B, mask_B = example_inputs()
+    out_reg, out_cl = CI.siggraph_forward(net, input_A, input_B, mask_B, maskcent=maskcent, dist=True)
+    # the distribution stays at the resolution it is predicted at
+    assert out_reg.shape == (2, 2, 64, 64)
+    assert out_cl.shape == (2, 529, 16, 16)
+    for i in range(len(out_reg)):
+        ref_reg, ref_cl = (ref.detach().numpy() for ref in net.forward(input_A[i], input_B[i], mask_B[i], maskcent=maskcent))
+        assert np.abs(out_reg[i] - ref_reg[0]).max() < TOLERANCE
+        # forward repeats each value 4x4 (nearest upsampling)
+        assert np.abs(np.repeat(np.repeat(out_cl[i], 4, axis=1), 4, axis=2) - ref_cl[0]).max() < 1e-6
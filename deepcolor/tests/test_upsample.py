@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from scipy.ndimage import zoom
+
+from data.colorize_image import lab2rgb_fullres, lab2rgb_transpose, upsample_ab_cols, upsample_ab_rows
+
+# (H, W) full resolution, (h, w) network output: odd sizes, both orientations
+SIZES = [
+    ((457, 311), (64, 48)),
+    ((301, 457), (48, 64)),
+    ((129, 1003), (32, 256)),
+    ((255, 257), (64, 64)),
+    ((1001, 999), (256, 256)),
+]
+
+
+def reference_ab(img_ab, H, W):
+    # the path lab2rgb_fullres replaced
+    return zoom(img_ab, (1, 1. * H / img_ab.shape[1], 1. * W / img_ab.shape[2]), order=1)
+
+
+def compared(ref_ab):
+    # zoom(mode='constant') writes 0 into the last row or column at some
+    # sizes, where lab2rgb_fullres keeps interpolating; leave those out
+    rows = slice(None, -1) if not ref_ab[:, -1].any() else slice(None)
+    cols = slice(None, -1) if not ref_ab[:, :, -1].any() else slice(None)
+    return rows, cols
+
+
+def inputs(H, W, h, w, seed=0):
+    rng = np.random.RandomState(seed)
+    img_l = rng.uniform(0, 100, size=(1, H, W))
+    img_ab = rng.uniform(-60, 60, size=(2, h, w))
+    return img_l, img_ab
+
+
+@pytest.mark.parametrize('full, low', SIZES)
+def test_upsample_matches_zoom(full, low):
+    (H, W), (h, w) = full, low
+    _, img_ab = inputs(H, W, h, w)
+    ref = reference_ab(img_ab, H, W)
+    rows, cols = compared(ref)
+
+    ab_cols = upsample_ab_cols(img_ab, W, dtype=np.float32)
+    # in strips, as lab2rgb_fullres and colorize_large_image run it
+    ab = np.concatenate([upsample_ab_rows(ab_cols, H, r0, min(H, r0 + 100)) for r0 in range(0, H, 100)], axis=1)
+    assert ab.shape == ref.shape
+    assert np.abs(ab - ref)[:, rows, cols].max() < 1e-3
+
+
+@pytest.mark.parametrize('full, low', SIZES)
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_lab2rgb_fullres_matches_reference(full, low, dtype):
+    (H, W), (h, w) = full, low
+    img_l, img_ab = inputs(H, W, h, w)
+    ref_ab = reference_ab(img_ab, H, W)
+    rows, cols = compared(ref_ab)
+    ref = lab2rgb_transpose(img_l, ref_ab, dtype=np.float64)
+
+    out = lab2rgb_fullres(img_l.astype(dtype), img_ab, tile_rows=100, dtype=dtype)
+    assert out.shape == (H, W, 3) and out.dtype == np.uint8
+    err = np.abs(out.astype(np.int16) - ref)[rows, cols]
+    assert err.max() <= 1
@@ -275,11 +275,7 @@ class GUIDraw(QWidget):
 
     def predict_color(self):
         if self.dist_model is not None and self.image_loaded:
-            im, mask = self.uiControl.get_input()
-            im_mask0 = mask > 0.0
-            self.im_mask0 = im_mask0.transpose((2, 0, 1))
-            im_lab = color.rgb2lab(im).transpose((2, 0, 1))
-            self.im_ab0 = im_lab[1:3, :, :]
+            self.im_ab0, self.im_mask0 = self.uiControl.get_input_ab()
 
             self.dist_model.net_forward(self.im_ab0, self.im_mask0)
 
@@ -296,11 +292,7 @@ class GUIDraw(QWidget):
             return None
 
     def compute_result(self):
-        im, mask = self.uiControl.get_input()
-        im_mask0 = mask > 0.0
-        self.im_mask0 = im_mask0.transpose((2, 0, 1))
-        im_lab = color.rgb2lab(im).transpose((2, 0, 1))
-        self.im_ab0 = im_lab[1:3, :, :]
+        self.im_ab0, self.im_mask0 = self.uiControl.get_input_ab()
 
         self.model.net_forward(self.im_ab0, self.im_mask0)
         ab = self.model.output_ab.transpose((1, 2, 0))
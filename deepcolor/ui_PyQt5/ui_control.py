@@ -2,6 +2,7 @@ import numpy as np
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 import cv2
+from data.hints import rasterize_hints
 
 
 class UserEdit(object):
@@ -62,6 +63,13 @@ class PointEdit(UserEdit):
         cv2.rectangle(im, tl, br, c, -1)
         cv2.rectangle(vis_im, tl, br, uc, -1)
 
+    def get_hint(self):
+        # center, color and half width of the square painted by updateInput
+        w = int(self.width / self.scale)
+        x, y = self.scale_point(self.pnt.x(), self.pnt.y(), 0)
+        c = (self.color.red(), self.color.green(), self.color.blue())
+        return (x, y), c, w
+
     def is_same(self, pnt):
         dx = abs(self.pnt.x() - pnt.x())
         dy = abs(self.pnt.y() - pnt.y())
@@ -186,6 +194,15 @@ class UIControl:
 
         return im, mask
 
+    def get_input_ab(self):
+        # network inputs (2xHxW ab, 1xHxW mask) for the current edits,
+        # without painting and converting a full rgb image
+        hints = [ue.get_hint() for ue in self.userEdits]
+        xy = [hint[0] for hint in hints]
+        rgb = [hint[1] for hint in hints]
+        radius = [hint[2] for hint in hints]
+        return rasterize_hints(xy, rgb, self.load_size, radius=radius, shape='square', falloff='none')
+
     def reset(self):
         self.userEdits = []
         self.userEdit = None